@@ -5,150 +5,186 @@
     The average accuracy for each of the methods is saved in the
     numeric_results text file.
 
+    Every method in predictions.csv is evaluated, so a new prediction method
+    only has to be added there. The differences between the predictions and
+    the actual race positions are counted for every method and FP3 position
+    with a single np.bincount; the average difference and the probability of
+    being within any number of positions (0 being exactly right) are all
+    calculated from these counts. All of the metrics are saved in
+    metrics.csv, e.g. for every tolerance from 1 to 10:
+
+        python accuracy.py --tolerances 1 2 3 4 5 6 7 8 9 10
+
+    The predictions of the other models (see predictions.py) are evaluated
+    with --model, e.g. --model empirical; their files get the model name
+    added to them (metrics_empirical.csv, ...).
+
     If you have any suggestions on how I can improve this code, feel free to
     open an issue on GitHub. I would love to hear your insight!
 """
-
+import argparse
 import pandas as pd
 import os
 import numpy as np
+import instrumentation
+from numeric_results import write_block
+from predictions import DEFAULT_MODEL, MODELS, predictions_path
+from race_store import TEST_SEASONS, load_store
 
-predictions = pd.read_csv("results/predictions/predictions.csv", index_col=0)
+INPUT_PATH = "data/race_store.npy"
+PREDICTIONS_PATH = "results/predictions/predictions.csv"
 OUTPUT_PATH = "results"
-sx_differences = {}
-fx_differences = {}
-gx_differences = {}
-for position in range(1, 21):
-    # Contains differences between predicted position and actual position
-    sx_differences[position] = []
-    fx_differences[position] = []
-    gx_differences[position] = []
-
-if not os.path.isdir(f"{OUTPUT_PATH}/accuracy_files"):
-    os.mkdir(f"{OUTPUT_PATH}/accuracy_files")
-
-avg_diff_results = pd.DataFrame(columns=["position",  "s(x)_diff",
-                                         "f(x)_diff", "g(x)_diff"])
-
-correct_prob = pd.DataFrame(columns=["position", "s(x)_prob_finish",
-                                     "s(x)_prob_no_finish",
-                                     "f(x)_prob_finish",
-                                     "f(x)_prob_no_finish",
-                                     "g(x)_prob_finish",
-                                     "g(x)_prob_no_finish"])
-
-approx_results_prob = pd.DataFrame(columns=["position", "s(x)_prob_finish",
-                                            "s(x)_prob_no_finish",
-                                            "f(x)_prob_finish",
-                                            "f(x)_prob_no_finish",
-                                            "g(x)_prob_finish",
-                                            "g(x)_prob_no_finish"])
-
-for file in os.listdir("data/2019"):
-    fp3_race = pd.read_csv(f"data/2019/{file}", index_col=0)
-    fp3_results = fp3_race["fp3_pos"].values.tolist()
-    race_results = fp3_race["race_pos"].values.tolist()
-    for fp3_result, race_result in zip(fp3_results, race_results):
-        # Getting the differences between predictions and actual race positions
-        sx_differences[fp3_result].append(abs(fp3_result - race_result))
-        fx_prediction = predictions.loc[fp3_result, "f(x)"]
-        fx_differences[fp3_result].append(abs(fx_prediction - race_result))
-        gx_prediction = predictions.loc[fp3_result, "g(x)"]
-        gx_differences[fp3_result].append(abs(gx_prediction - race_result))
-
-for position in range(1, 21):
-    # Calculating average difference for each position
-    sx_avg_diff = np.mean(sx_differences[position])
-    fx_avg_diff = np.mean(fx_differences[position])
-    gx_avg_diff = np.mean(gx_differences[position])
-    avg_diff_row = [position, sx_avg_diff, fx_avg_diff, gx_avg_diff]
-    avg_diff_results.loc[len(avg_diff_results)] = avg_diff_row
-
-    # Calculating how many predictions were exactly correct
-    sx_correct = sum(diff == 0 for diff in sx_differences[position])
-    sx_correct_finish_prob = sx_correct / len(sx_differences[position])
-    sx_correct_no_finish_prob = sx_correct / 21
-    fx_correct = sum(diff == 0 for diff in fx_differences[position])
-    fx_correct_finish_prob = fx_correct / len(fx_differences[position])
-    fx_correct_no_finish_prob = fx_correct / 21
-    gx_correct = sum(diff == 0 for diff in gx_differences[position])
-    gx_correct_finish_prob = gx_correct / len(gx_differences[position])
-    gx_correct_no_finish_prob = gx_correct / 21
-    correct_row = [position, sx_correct_finish_prob, sx_correct_no_finish_prob,
-                   fx_correct_finish_prob, fx_correct_no_finish_prob,
-                   gx_correct_finish_prob, gx_correct_no_finish_prob]
-    correct_prob.loc[len(correct_prob)] = correct_row
-
-    # Calculating how many finishing positions were within 3 positions of
-    # the assigned prediction
-    sx_approx = sum(diff <= 3 for diff in sx_differences[position])
-    sx_approx_finish_prob = sx_approx / len(sx_differences[position])
-    sx_approx_no_finish_prob = sx_approx / 21
-
-    fx_approx = sum(diff <= 3 for diff in fx_differences[position])
-    fx_approx_finish_prob = fx_approx / len(fx_differences[position])
-    fx_approx_no_finish_prob = fx_approx / 21
-
-    gx_approx = sum(diff <= 3 for diff in gx_differences[position])
-    gx_approx_finish_prob = gx_approx / len(gx_differences[position])
-    gx_approx_no_finish_prob = gx_approx / 21
-
-    approx_row = [position, sx_approx_finish_prob, sx_approx_no_finish_prob,
-                  fx_approx_finish_prob, fx_approx_no_finish_prob,
-                  gx_approx_finish_prob, gx_approx_no_finish_prob]
-
-    approx_results_prob.loc[len(approx_results_prob)] = approx_row
-
-# Saving the dataframes:
-avg_diff_results.to_csv(f"{OUTPUT_PATH}/accuracy_files/avg_diff.csv",
-                        index=False)
-
-correct_prob.to_csv(f"{OUTPUT_PATH}/accuracy_files/corr_prob.csv", index=False)
-
-approx_results_prob.to_csv(f"{OUTPUT_PATH}/accuracy_files/approx_prob.csv",
-                           index=False)
-
-if not os.path.exists(f"{OUTPUT_PATH}/numeric_results.txt"):
-    with open(f"{OUTPUT_PATH}/numeric_results.txt", "w") as results_file:
-        results_file.write("These are the results obtained during analysis:\n")
-
-# Saving the average values:
-with open(f"{OUTPUT_PATH}/numeric_results.txt", "a") as results_file:
-    results_file.write("\n")
-    results_file.write("Accuracy for Each Prediction:\n")
-    results_file.write("s(x):\n")
-    sx_avg_diff = avg_diff_results["s(x)_diff"].mean()
-    sx_correct_finish_avg = correct_prob["s(x)_prob_finish"].mean()
-    sx_correct_no_finish_avg = correct_prob["s(x)_prob_no_finish"].mean()
-    sx_approx_finish_avg = approx_results_prob["s(x)_prob_finish"].mean()
-    sx_approx_no_finish_avg = approx_results_prob["s(x)_prob_no_finish"].mean()
-    results_file.write(f"- Avg. Difference: {sx_avg_diff}\n")
-    results_file.write(f"""- Prob. Exactly Right: {sx_correct_finish_avg} &
-{sx_correct_no_finish_avg} \n""")
-    results_file.write(f"""- Prob. Approx Right: {sx_approx_finish_avg} &
-{sx_approx_no_finish_avg} \n""")
-
-    results_file.write("f(x):\n")
-    fx_avg_diff = avg_diff_results["f(x)_diff"].mean()
-    fx_correct_finish_avg = correct_prob["f(x)_prob_finish"].mean()
-    fx_correct_no_finish_avg = correct_prob["f(x)_prob_no_finish"].mean()
-    fx_approx_finish_avg = approx_results_prob["f(x)_prob_finish"].mean()
-    fx_approx_no_finish_avg = approx_results_prob["f(x)_prob_no_finish"].mean()
-    results_file.write(f"- Avg. Difference: {fx_avg_diff}\n")
-    results_file.write(f"""- Prob. Exactly Right: {fx_correct_finish_avg} &
-{fx_correct_no_finish_avg} \n""")
-    results_file.write(f"""- Prob. Approx Right: {fx_approx_finish_avg} &
-{fx_approx_no_finish_avg} \n""")
-
-    results_file.write("g(x):\n")
-    gx_avg_diff = avg_diff_results["g(x)_diff"].mean()
-    gx_correct_finish_avg = correct_prob["g(x)_prob_finish"].mean()
-    gx_correct_no_finish_avg = correct_prob["g(x)_prob_no_finish"].mean()
-    gx_approx_finish_avg = approx_results_prob["g(x)_prob_finish"].mean()
-    gx_approx_no_finish_avg = approx_results_prob["g(x)_prob_no_finish"].mean()
-    results_file.write(f"- Avg. Difference: {gx_avg_diff}\n")
-    results_file.write(f"""- Prob. Exactly Right: {gx_correct_finish_avg} &
-{gx_correct_no_finish_avg} \n""")
-    results_file.write(f"""- Prob. Approx Right: {gx_approx_finish_avg} &
-{gx_approx_no_finish_avg} \n""")
-    results_file.write("Obtained from accuracy.py \n")
+# A prediction is approximately right if it is within 3 positions
+APPROX_TOLERANCE = 3
+
+
+def prediction_lookup(predictions):
+    # Turns the predictions table into an array, where
+    # lookup[i, fp3_pos] is the race position predicted by the i-th method.
+    # Column 0 is unused so that the FP3 positions can index it directly.
+    names = [name for name in predictions.columns if name != "position"]
+    lookup = np.zeros((len(names), predictions["position"].max() + 1),
+                      dtype=np.int64)
+    lookup[:, predictions["position"].values] = predictions[names].values.T
+    return names, lookup
+
+
+def error_histogram(lookup, fp3_pos, race_pos):
+    # Returns counts[i, fp3_pos - 1, diff], the number of times the i-th
+    # method was off by diff positions for the FP3 position
+    fp3_pos = np.asarray(fp3_pos, dtype=np.intp)
+    differences = np.abs(lookup[:, fp3_pos] - np.asarray(race_pos))
+    method_count, grid_size = lookup.shape[0], lookup.shape[1] - 1
+    max_difference = max(grid_size, int(differences.max(initial=0))) + 1
+    cells = ((np.arange(method_count)[:, np.newaxis] * grid_size +
+              fp3_pos - 1) * max_difference + differences)
+    counts = np.bincount(cells.ravel(),
+                         minlength=method_count * grid_size * max_difference)
+    return counts.reshape(method_count, grid_size, max_difference)
+
+
+def metrics_table(names, counts, tolerances, race_count):
+    # One row for every method, FP3 position and tolerance. prob_finish is
+    # the share of the finishes which were within the tolerance, and
+    # prob_no_finish is the share of all races (including the ones in which
+    # the FP3 position did not finish).
+    method_count, grid_size, _ = counts.shape
+    finishes = counts.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_diff = (counts @ np.arange(counts.shape[-1])) / finishes
+    within = np.cumsum(counts, axis=-1)
+    tolerances = np.asarray(tolerances)
+    hits = within[..., np.minimum(tolerances, counts.shape[-1] - 1)]
+
+    shape = (method_count, grid_size, len(tolerances))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        prob_finish = hits / finishes[..., np.newaxis]
+    return pd.DataFrame({
+        "method": np.repeat(names, grid_size * len(tolerances)),
+        "position": np.broadcast_to(
+            np.arange(1, grid_size + 1)[:, np.newaxis], shape).ravel(),
+        "tolerance": np.broadcast_to(tolerances, shape).ravel(),
+        "finishes": np.broadcast_to(finishes[..., np.newaxis],
+                                    shape).ravel(),
+        "avg_diff": np.broadcast_to(avg_diff[..., np.newaxis],
+                                    shape).ravel(),
+        "hits": hits.ravel(),
+        "prob_finish": prob_finish.ravel(),
+        "prob_no_finish": (hits / race_count).ravel(),
+    })
+
+
+def evaluate(predictions, races, tolerances=(0, APPROX_TOLERANCE)):
+    names, lookup = prediction_lookup(predictions)
+    counts = error_histogram(lookup, races.fp3_pos, races.race_pos)
+    return metrics_table(names, counts, tolerances, len(races.races()))
+
+
+def accuracy_files(metrics):
+    # The per-position tables in the layout of the original accuracy files
+    names = metrics["method"].unique()
+    exact = metrics[metrics["tolerance"] == 0]
+    avg_diff = exact.pivot(index="position", columns="method",
+                           values="avg_diff")[names]
+    avg_diff.columns = [f"{name}_diff" for name in names]
+
+    tables = [avg_diff.reset_index()]
+    for tolerance in (0, APPROX_TOLERANCE):
+        table = metrics[metrics["tolerance"] == tolerance].pivot(
+            index="position", columns="method",
+            values=["prob_finish", "prob_no_finish"])
+        columns = [(value, name) for name in names
+                   for value in ("prob_finish", "prob_no_finish")]
+        table = table[columns]
+        table.columns = [f"{name}_{value}" for value, name in columns]
+        tables.append(table.reset_index())
+    return tables
+
+
+def save_results(metrics, model=DEFAULT_MODEL):
+    if not os.path.isdir(f"{OUTPUT_PATH}/accuracy_files"):
+        os.mkdir(f"{OUTPUT_PATH}/accuracy_files")
+    folder = f"{OUTPUT_PATH}/accuracy_files"
+    suffix = "" if model == DEFAULT_MODEL else f"_{model}"
+
+    metrics.to_csv(f"{folder}/metrics{suffix}.csv", index=False)
+    avg_diff_results, correct_prob, approx_results_prob = \
+        accuracy_files(metrics)
+    avg_diff_results.to_csv(f"{folder}/avg_diff{suffix}.csv", index=False)
+    correct_prob.to_csv(f"{folder}/corr_prob{suffix}.csv", index=False)
+    approx_results_prob.to_csv(f"{folder}/approx_prob{suffix}.csv",
+                               index=False)
+
+    # Saving the average values:
+    averages = metrics.groupby(["method", "tolerance"], sort=False).mean(
+        numeric_only=True)
+    lines = ["Accuracy for Each Prediction:"]
+    figures = {}
+    for name in metrics["method"].unique():
+        exact = averages.loc[(name, 0)]
+        approx = averages.loc[(name, APPROX_TOLERANCE)]
+        figures.update({
+            f"{name}.avg_diff": exact["avg_diff"],
+            f"{name}.prob_exact": exact["prob_finish"],
+            f"{name}.prob_exact_no_finish": exact["prob_no_finish"],
+            f"{name}.prob_approx": approx["prob_finish"],
+            f"{name}.prob_approx_no_finish": approx["prob_no_finish"]})
+        lines += [f"{name}:",
+                  f"- Avg. Difference: {exact['avg_diff']}",
+                  f"- Prob. Exactly Right: {exact['prob_finish']} & "
+                  f"{exact['prob_no_finish']}",
+                  f"- Prob. Approx Right: {approx['prob_finish']} & "
+                  f"{approx['prob_no_finish']}"]
+    source = "accuracy.py"
+    if model != DEFAULT_MODEL:
+        source += f" --model {model}"
+    write_block(source, lines, OUTPUT_PATH, figures)
+
+
+def run(predictions, races, tolerances=(0, APPROX_TOLERANCE),
+        model=DEFAULT_MODEL, save=True):
+    # The metrics of the predictions on the test races. With save, they are
+    # also written to the accuracy files of the model.
+    metrics = evaluate(predictions, races.select(seasons=TEST_SEASONS),
+                       tolerances)
+    if save:
+        save_results(metrics, model)
+    return metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tolerances", type=int, nargs="*", default=[],
+                        help="additional tolerances to calculate the "
+                             "probabilities for")
+    parser.add_argument("--model", choices=MODELS, default=DEFAULT_MODEL,
+                        help="which model's predictions to evaluate")
+    args = parser.parse_args()
+
+    with instrumentation.stage("accuracy") as stage:
+        tolerances = sorted({0, APPROX_TOLERANCE, *args.tolerances})
+
+        predictions = pd.read_csv(predictions_path(args.model))
+        test_races = load_store(INPUT_PATH).select(seasons=TEST_SEASONS)
+        stage["rows"] = len(test_races)
+        run(predictions, test_races, tolerances, args.model)
@@ -0,0 +1,84 @@
+"""
+    This script runs the whole analysis chain in a single process:
+
+        pearson_correlation
+        position_summary -> normal_distribution_probability -> predictions
+        -> accuracy
+
+    Every stage is the run function of its script, and the output of every
+    stage is passed on to the next one in memory (the summary table, the
+    probability grid and the predictions table), instead of being written to
+    a file by one script and read back by the next. Nothing is read except
+    the race store, and the results are exactly the same as those of the
+    scripts, since no value goes through a text file on the way.
+
+    By default nothing is written and the accuracy of the predictions is
+    printed. With --save, every stage also writes the same files as its
+    script, so the results folder is the same as after running the scripts
+    one by one (or with pipeline.py):
+
+        python analysis.py
+        python analysis.py --save
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import time
+import instrumentation
+import accuracy
+import normal_distribution_probability
+import pearson_correlation
+import position_summary
+import predictions
+from accuracy import APPROX_TOLERANCE
+from position_summary import build_state
+from race_store import load_store
+
+INPUT_PATH = "data/race_store.npy"
+
+
+def stages(races, save=False, tolerances=(0, APPROX_TOLERANCE)):
+    # Runs the chain one stage at a time, yielding the name and the output
+    # of every stage as soon as it is done
+    yield "pearson_correlation", pearson_correlation.run(races, save)
+    summary_df = position_summary.run(build_state(races), save)
+    yield "position_summary", summary_df
+    grids = normal_distribution_probability.run(summary_df, save=save)
+    yield "normal_distribution_probability", grids
+    predictions_df = predictions.run(grids["probabilities"], save=save)
+    yield "predictions", predictions_df
+    yield "accuracy", accuracy.run(predictions_df, races, tolerances,
+                                   save=save)
+
+
+def run_analysis(races, save=False, tolerances=(0, APPROX_TOLERANCE)):
+    # The outputs of all of the stages, by stage name
+    return dict(stages(races, save, tolerances))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save", action="store_true",
+                        help="write the output files of every stage")
+    parser.add_argument("--tolerances", type=int, nargs="*", default=[],
+                        help="additional tolerances to calculate the "
+                             "probabilities for")
+    args = parser.parse_args()
+
+    with instrumentation.stage("analysis") as stage:
+        races = load_store(INPUT_PATH)
+        stage["rows"] = len(races)
+        tolerances = sorted({0, APPROX_TOLERANCE, *args.tolerances})
+        outputs = {}
+        start = time.perf_counter()
+        for name, output in stages(races, args.save, tolerances):
+            # The time of every stage, when the instrumentation is on
+            instrumentation.record("timer", f"analysis.{name}",
+                                   seconds=time.perf_counter() - start)
+            outputs[name] = output
+            start = time.perf_counter()
+
+    averages = outputs["accuracy"].groupby(["method", "tolerance"],
+                                           sort=False).mean(numeric_only=True)
+    print(averages[["avg_diff", "prob_finish", "prob_no_finish"]])
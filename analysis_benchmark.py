@@ -0,0 +1,538 @@
+"""
+    This script benchmarks the analysis chain (pearson_correlation,
+    position_summary, normal_distribution_probability, predictions and
+    accuracy) on synthetic data, since the real data (around 120 races) is
+    far too small to show how the scripts behave with more seasons or with
+    simulated races.
+
+    The synthetic races are generated in the race store layout: every driver
+    has a pace which drifts a little from season to season, the FP3 and the
+    race order are the order of the pace plus some noise (more in the race
+    than in FP3), and a share of the drivers does not finish, whose rows are
+    left out like the NC, DQ and EX rows of the real data. The races are
+    spread evenly over the 2014-2019 seasons, so the scripts use all of them.
+    The races can also be written as per-race CSVs (with a links file), in
+    the layout of data/2014-2018.
+
+    For every scale, the chain is run in two ways, each in its own process:
+    - scripts: the scripts themselves, one after another, in a temporary
+      folder holding the synthetic race store. The time and peak memory
+      come from instrumentation.py;
+    - memory: the chain of analysis.py, which passes the outputs of every
+      stage on in memory. The peak memory of every stage is measured with
+      tracemalloc.
+    With --check, both ways are run on the real race store, and the outputs
+    of the in-memory chain have to be exactly the same as the files written
+    by the scripts. The chain is also compared, stage by stage, with a
+    reference implementation of the original scripts (np.mean and np.std
+    per position, stats.pearsonr per race and loops for the predictions and
+    their accuracy), which it has to match exactly, apart from the few
+    documented outputs that may be a few ulps apart (MAX_ULPS).
+
+    The results are saved as JSON lines, and can be compared to a previous
+    run with --baseline, which fails if any stage got noticeably slower:
+
+        python analysis_benchmark.py --scales 1000 10000 100000 1000000
+        python analysis_benchmark.py --check
+        python analysis_benchmark.py --baseline old_benchmark.jsonl
+        python analysis_benchmark.py --generate 5000 --csv data/synthetic
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy import stats
+import instrumentation
+import accuracy
+import normal_distribution_probability
+import pearson_correlation
+import position_summary
+import predictions
+from accuracy import APPROX_TOLERANCE
+from analysis import stages
+from drivers import DriverTable
+from position_summary import build_state
+from race_store import (DTYPE, STORE_PATH, TEST_SEASONS, TRAIN_SEASONS,
+                        WIDE_DTYPE, RaceStore, load_store, save_store)
+
+OUTPUT_PATH = "results/analysis_benchmark.jsonl"
+REPOSITORY_PATH = os.path.dirname(os.path.abspath(__file__))
+SCALES = [1_000, 10_000, 100_000, 1_000_000]
+STAGES = ("pearson_correlation", "position_summary",
+          "normal_distribution_probability", "predictions", "accuracy")
+SEED = 2014
+DRIVERS = 20
+# Standard deviations of the pace of the drivers, of its drift from season
+# to season and of the noise in FP3 and in the race, which give a Pearson
+# Correlation close to the one of the real races
+PACE_STD = 1.0
+DRIFT_STD = 0.3
+FP3_NOISE = 0.4
+RACE_NOISE = 0.6
+DNF_RATE = 0.1
+CHUNK_SIZE = 100_000
+# A stage is a regression if it is slower by more than this share, and by
+# more than MIN_SLOWDOWN seconds (the smallest scales are mostly noise)
+REGRESSION_TOLERANCE = 0.2
+MIN_SLOWDOWN = 0.05
+# How many units in the last place the chain may differ from the reference
+# implementation (see check_reference); every other output has to be
+# exactly the same. The chain calculates the correlations from the sums of
+# the positions, which are exact, so its pearson_corr is at most a rounding
+# or two from the exact value, while stats.pearsonr centres the positions
+# first and is a few ulps off. The p-value is a steep function of the
+# correlation, and turns these few ulps into a few hundred. The standard
+# deviations come from Chan et al.'s merge instead of a single sum, and
+# cl_var squares them.
+MAX_ULPS = {"pearson_corr": 8, "p_value": 1024, "std_finish_position": 4,
+            "cl_var_finish_position": 8}
+
+
+def _ranks(scores):
+    # The position (1 = lowest score) of every driver in every race
+    return np.argsort(np.argsort(scores, axis=1), axis=1) + 1
+
+
+def generate_store(race_count, drivers=DRIVERS, seed=SEED,
+                   dnf_rate=DNF_RATE, chunk_size=CHUNK_SIZE):
+    rng = np.random.default_rng(seed)
+    seasons = np.array(list(TRAIN_SEASONS) + TEST_SEASONS)
+    # The race numbers only fit in the store's int16 up to 32767 races
+    dtype = DTYPE if race_count <= np.iinfo(DTYPE).max else WIDE_DTYPE
+    pace = (rng.normal(0, PACE_STD, drivers) +
+            rng.normal(0, DRIFT_STD, (len(seasons), drivers)))
+
+    chunks = []
+    for start in range(0, race_count, chunk_size):
+        race_numbers = np.arange(start, min(start + chunk_size, race_count))
+        season_ids = race_numbers * len(seasons) // race_count
+        shape = (len(race_numbers), drivers)
+        race_pace = pace[season_ids]
+        fp3_pos = _ranks(race_pace + rng.normal(0, FP3_NOISE, shape))
+        race_pos = _ranks(race_pace + rng.normal(0, RACE_NOISE, shape))
+        finished = (rng.random(shape) >= dnf_rate).ravel()
+        rows = np.stack([np.repeat(race_numbers + 1, drivers),
+                         np.repeat(seasons[season_ids], drivers),
+                         np.tile(np.arange(drivers), len(race_numbers)),
+                         fp3_pos.ravel(), race_pos.ravel()])
+        chunks.append(rows[:, finished].astype(dtype))
+    return RaceStore(np.concatenate(chunks, axis=1))
+
+
+def synthetic_drivers(drivers=DRIVERS):
+    # The driver table of the synthetic races, whose driver IDs are simply
+    # 0 to drivers - 1
+    return DriverTable([f"D{i:02d}" for i in range(drivers)],
+                       [f"Driver {i}" for i in range(drivers)])
+
+
+def write_csvs(races, folder):
+    # One CSV per race and a links file, like data/2014-2018 and
+    # data/links.csv, so the races can also be imported by race_store.py
+    os.makedirs(folder, exist_ok=True)
+    drivers = synthetic_drivers(int(races.driver.max()) + 1)
+    frame = races.to_frame(drivers)
+    with open(f"{folder}/links.csv", "w") as links_file:
+        for race_number, race in frame.groupby("race_no"):
+            season = race["season"].iloc[0]
+            links_file.write("https://www.formula1.com/en/results.html/"
+                             f"{season}/races/{race_number}/synthetic/\n")
+            race[["driver", "fp3_pos", "race_pos"]].to_csv(
+                f"{folder}/{race_number}.csv", index=False)
+
+
+def memory_chain(races):
+    # The chain of analysis.py, which passes the outputs of every stage on
+    # in memory. Returns the outputs and the measurements of every stage;
+    # the peak memory is the most memory allocated while the stage ran.
+    outputs = {}
+    measurements = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for name, output in stages(races):
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        measurements.append({"stage": name, "seconds": seconds,
+                             "peak_memory": peak})
+        outputs[name] = output
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+    tracemalloc.stop()
+    return outputs, measurements
+
+
+def run_memory_chain(store_path):
+    # Runs in a separate process; prints the measurements of every stage
+    races = load_store(store_path)
+    _, measurements = memory_chain(races)
+    for measurement in measurements:
+        measurement["rows"] = len(races)
+        print(json.dumps(measurement))
+    print(json.dumps({"stage": "total",
+                      "seconds": sum(m["seconds"] for m in measurements),
+                      "peak_memory": instrumentation.peak_memory(),
+                      "rows": len(races)}))
+
+
+def run_scripts(work_path):
+    # Runs the scripts in work_path, which holds data/race_store.npy.
+    # Returns the measurements of every script.
+    os.makedirs(f"{work_path}/results", exist_ok=True)
+    events_path = f"{work_path}/instrumentation.jsonl"
+    environment = dict(os.environ, F1_INSTRUMENTATION=events_path,
+                       PYTHONPATH=REPOSITORY_PATH)
+    environment.pop("F1_RUN_ID", None)
+    wall_times = {}
+    for stage in STAGES:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, f"{REPOSITORY_PATH}/{stage}.py"],
+                       cwd=work_path, env=environment, check=True)
+        wall_times[stage] = time.perf_counter() - start
+
+    with open(events_path, "r") as events_file:
+        events = [json.loads(line) for line in events_file]
+    measurements = []
+    for event in events:
+        if event["kind"] == "stage":
+            measurements.append({
+                "stage": event["name"], "seconds": event["seconds"],
+                "wall_time": wall_times[event["name"]],
+                "peak_memory": event["peak_memory"],
+                "rows": event.get("rows")})
+    return measurements
+
+
+def run_memory(store_path):
+    completed = subprocess.run(
+        [sys.executable, __file__, "--run-chain", store_path],
+        capture_output=True, text=True, check=True)
+    return [json.loads(line) for line in completed.stdout.splitlines()]
+
+
+def benchmark(scales, seed=SEED):
+    results = []
+    for race_count in scales:
+        with tempfile.TemporaryDirectory() as work_path:
+            os.makedirs(f"{work_path}/data")
+            store_path = f"{work_path}/data/race_store.npy"
+            races = generate_store(race_count, seed=seed)
+            save_store(races, store_path)
+            del races
+
+            for path, measurements in (("scripts", run_scripts(work_path)),
+                                       ("memory", run_memory(store_path))):
+                for measurement in measurements:
+                    results.append({"path": path, "races": race_count,
+                                    "seed": seed, "timestamp": time.time(),
+                                    **measurement})
+                    print(f"{race_count} races, {path} "
+                          f"{measurement['stage']}: "
+                          f"{measurement['seconds']:.3f} s, "
+                          f"{measurement['peak_memory'] / 2**20:.0f} MB")
+    return results
+
+
+def reference_correlations(races):
+    # The Pearson Correlation of every training race, with stats.pearsonr
+    rows = []
+    for race_number, race in races.select(seasons=TRAIN_SEASONS).iter_races():
+        r, p = stats.pearsonr(race.fp3_pos.tolist(), race.race_pos.tolist())
+        rows.append([race_number, r, p])
+    return pd.DataFrame(rows, columns=["race_no", "pearson_corr", "p_value"])
+
+
+def reference_summary(races):
+    # np.mean and np.std of the finishing positions of every FP3 position
+    finishes = {position: [] for position in range(1, 21)}
+    test_finishes = {position: 0 for position in range(1, 21)}
+    train_races = races.select(seasons=TRAIN_SEASONS)
+    for fp3_pos, race_pos in zip(train_races.fp3_pos, train_races.race_pos):
+        finishes[fp3_pos].append(race_pos)
+    for fp3_pos in races.select(seasons=TEST_SEASONS).fp3_pos:
+        test_finishes[fp3_pos] += 1
+    rows = []
+    for position in range(1, 21):
+        race_std = np.std(finishes[position])
+        rows.append([position, np.mean(finishes[position]), race_std,
+                     test_finishes[position],
+                     race_std**2 / test_finishes[position]])
+    return pd.DataFrame(rows, columns=[
+        "position", "mean_finish_position", "std_finish_position",
+        "race_amount", "cl_var_finish_position"])
+
+
+def reference_grids(summary_df):
+    # A frozen stats.norm for every FP3 position, evaluated one value at a
+    # time
+    increments = np.arange(-3.0, 3.1, 0.1)
+    increment_positions, increment_probabilities, probabilities = [], [], []
+    for mean_finish, cl_var in zip(summary_df["mean_finish_position"],
+                                   summary_df["cl_var_finish_position"]):
+        distribution = stats.norm(mean_finish, cl_var)
+        increment_positions.append([mean_finish + increment * cl_var
+                                    for increment in increments])
+        increment_probabilities.append([distribution.pdf(position)
+                                        for position in
+                                        increment_positions[-1]])
+        probabilities.append([distribution.pdf(race_pos)
+                              for race_pos in range(1, 21)])
+    return {"increments": increments,
+            "increment_positions": np.array(increment_positions),
+            "increment_probabilities": np.array(increment_probabilities),
+            "race_positions": np.arange(1.0, 21.0),
+            "probabilities": np.array(probabilities)}
+
+
+def reference_predictions(probabilities):
+    # s(x), f(x) and g(x), with the loops of the original predictions.py
+    probabilities = np.asarray(probabilities).tolist()
+    available_positions = list(range(1, 21))
+    fx = []
+    for race_pos in range(1, 21):
+        maximum_probability, best_position = 0, 0
+        for fp3_pos in available_positions:
+            probability = probabilities[fp3_pos - 1][race_pos - 1]
+            if probability > maximum_probability:
+                maximum_probability = probability
+                best_position = fp3_pos
+        available_positions.remove(best_position)
+        fx.append(best_position)
+    gx = [row.index(max(row)) + 1 for row in probabilities]
+    return pd.DataFrame({"position": range(1, 21), "s(x)": range(1, 21),
+                         "f(x)": fx, "g(x)": gx})
+
+
+def reference_accuracy(predictions_df, races):
+    # The differences of every prediction on the test races, one at a time
+    test_races = races.select(seasons=TEST_SEASONS)
+    rows = []
+    for name in ("s(x)", "f(x)", "g(x)"):
+        predicted = predictions_df[name].tolist()
+        differences = {position: [] for position in range(1, 21)}
+        for fp3_pos, race_pos in zip(test_races.fp3_pos,
+                                     test_races.race_pos):
+            differences[fp3_pos].append(abs(predicted[fp3_pos - 1] -
+                                            race_pos))
+        for position in range(1, 21):
+            for tolerance in (0, APPROX_TOLERANCE):
+                hits = sum(diff <= tolerance
+                           for diff in differences[position])
+                rows.append([name, position, tolerance,
+                             np.mean(differences[position]),
+                             hits / len(differences[position]),
+                             hits / len(test_races.races())])
+    return pd.DataFrame(rows, columns=[
+        "method", "position", "tolerance", "avg_diff", "prob_finish",
+        "prob_no_finish"])
+
+
+def _ulps(expected, actual):
+    # The largest difference in units in the last place. NaNs and infinities
+    # have to be in the same places.
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = np.asarray(actual, dtype=np.float64)
+    if expected.shape != actual.shape:
+        return np.inf
+    finite = np.isfinite(expected)
+    if not np.array_equal(finite, np.isfinite(actual)) or \
+            not np.array_equal(expected[~finite], actual[~finite]):
+        return np.inf
+    difference = np.abs(expected[finite] - actual[finite])
+    scale = np.spacing(np.maximum(np.abs(expected[finite]),
+                                  np.abs(actual[finite])))
+    return float(np.max(difference / scale, initial=0.0))
+
+
+def _compare(name, expected, actual, mismatches, max_ulps=None):
+    # Compares every column (or array) of expected to the same one of actual.
+    # max_ulps gives the allowed difference of some of the columns; all of
+    # the others have to be exactly the same.
+    if not isinstance(expected, pd.DataFrame):
+        expected, actual = {name: expected}, {name: actual}
+        columns = [name]
+    else:
+        columns = expected.columns
+        if len(expected) != len(actual):
+            mismatches.append(f"{name}: {len(actual)} rows instead of "
+                              f"{len(expected)}")
+            return
+    for column in columns:
+        values = np.asarray(expected[column])
+        if values.dtype.kind in "OUS":
+            same = list(values) == list(actual[column])
+            ulps = 0.0 if same else np.inf
+        else:
+            ulps = _ulps(values, actual[column])
+        label = name if column == name else f"{name} {column}"
+        allowed = (max_ulps or {}).get(column, 0)
+        if ulps > allowed:
+            mismatches.append(f"{label}: {ulps:g} ulps apart (at most "
+                              f"{allowed} allowed)")
+
+
+def check_reference(races):
+    # Compares the chain to the reference implementation, one stage at a
+    # time, with the reference's output of the previous stage as its input.
+    # Returns the outputs which are further apart than MAX_ULPS allows.
+    mismatches = []
+    _compare("pearson_corr_table.csv", reference_correlations(races),
+             pearson_correlation.run(races, save=False), mismatches,
+             MAX_ULPS)
+    summary_df = reference_summary(races)
+    _compare("position_summary.csv", summary_df,
+             position_summary.run(build_state(races), save=False),
+             mismatches, MAX_ULPS)
+    grids = reference_grids(summary_df)
+    actual_grids = normal_distribution_probability.run(summary_df, save=False)
+    for name, grid in grids.items():
+        _compare(name, grid, actual_grids[name], mismatches)
+    predictions_df = reference_predictions(grids["probabilities"])
+    _compare("predictions.csv", predictions_df,
+             predictions.run(grids["probabilities"],
+                             save=False)[predictions_df.columns],
+             mismatches)
+    metrics = accuracy.run(predictions_df, races, save=False)
+    _compare("metrics.csv", reference_accuracy(predictions_df, races),
+             metrics[reference_accuracy(predictions_df, races).columns],
+             mismatches)
+
+    # The whole chain, which passes its own outputs on. The probabilities
+    # differ from the reference's as much as the summaries do, but the
+    # predictions and their accuracy have to be exactly the same.
+    outputs, _ = memory_chain(races)
+    _compare("chained predictions.csv", predictions_df,
+             outputs["predictions"][predictions_df.columns], mismatches)
+    metrics = outputs["accuracy"]
+    metrics = metrics[metrics["method"].isin(predictions_df.columns)]
+    _compare("chained metrics.csv", reference_accuracy(predictions_df, races),
+             metrics.reset_index(drop=True)[
+                 ["method", "position", "tolerance", "avg_diff",
+                  "prob_finish", "prob_no_finish"]], mismatches)
+    return mismatches
+
+
+def check(store_path=STORE_PATH):
+    # Runs the scripts and the in-memory chain on the real race store, and
+    # returns the outputs which are not exactly the same, followed by the
+    # ones which are too far from the reference implementation
+    with tempfile.TemporaryDirectory() as work_path:
+        os.makedirs(f"{work_path}/data")
+        save_store(load_store(store_path),
+                   f"{work_path}/data/race_store.npy")
+        run_scripts(work_path)
+        results_path = f"{work_path}/results"
+
+        def read(name):
+            return pd.read_csv(f"{results_path}/{name}",
+                               float_precision="round_trip")
+
+        races = load_store(store_path)
+        outputs, _ = memory_chain(races)
+        mismatches = []
+        _compare("pearson_corr_table.csv", read("pearson_corr_table.csv"),
+                 outputs["pearson_correlation"], mismatches)
+        _compare("position_summary.csv", read("position_summary.csv"),
+                 outputs["position_summary"], mismatches)
+        grids = outputs["normal_distribution_probability"]
+        with np.load(f"{results_path}/probabilities_increments.npz") as grid:
+            _compare("increments", grid["increments"], grids["increments"],
+                     mismatches)
+            _compare("increment positions", grid["positions"],
+                     grids["increment_positions"], mismatches)
+            _compare("increment probabilities", grid["probability"],
+                     grids["increment_probabilities"], mismatches)
+        with np.load(f"{results_path}/probabilities_positions.npz") as grid:
+            _compare("race positions", grid["race_positions"],
+                     grids["race_positions"], mismatches)
+            _compare("position probabilities", grid["probability"],
+                     grids["probabilities"], mismatches)
+        _compare("predictions.csv", read("predictions/predictions.csv"),
+                 outputs["predictions"], mismatches)
+        _compare("metrics.csv", read("accuracy_files/metrics.csv"),
+                 outputs["accuracy"], mismatches)
+    return mismatches + check_reference(races)
+
+
+def regressions(results, baseline_path, tolerance=REGRESSION_TOLERANCE):
+    # Compares every stage to the last baseline run with the same settings
+    baseline = {}
+    with open(baseline_path, "r") as f:
+        for line in f:
+            run = json.loads(line)
+            baseline[(run["path"], run["stage"], run["races"])] = \
+                run["seconds"]
+    slower = []
+    for run in results:
+        key = (run["path"], run["stage"], run["races"])
+        if key in baseline and \
+                run["seconds"] > (1 + tolerance) * baseline[key] and \
+                run["seconds"] - baseline[key] > MIN_SLOWDOWN:
+            slower.append((key, baseline[key], run["seconds"]))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES,
+                        help="numbers of synthetic races")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--baseline", default=None,
+                        help="JSON lines of an earlier run to compare to")
+    parser.add_argument("--check", action="store_true",
+                        help="check that the in-memory chain gives exactly "
+                             "the same results as the scripts on the real "
+                             "race store, and the same as the reference "
+                             "implementation")
+    parser.add_argument("--generate", type=int, default=None,
+                        metavar="RACES",
+                        help="only generate this many synthetic races")
+    parser.add_argument("--store", default=None,
+                        help="with --generate, save the races in this race "
+                             "store file")
+    parser.add_argument("--csv", default=None, metavar="FOLDER",
+                        help="with --generate, write the races as one CSV "
+                             "per race in this folder")
+    parser.add_argument("--run-chain", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_chain:
+        run_memory_chain(args.run_chain)
+        sys.exit()
+    if args.generate:
+        races = generate_store(args.generate, seed=args.seed)
+        if args.store:
+            save_store(races, args.store)
+        if args.csv:
+            write_csvs(races, args.csv)
+        print(f"Generated {len(races.races())} races ({len(races)} rows)")
+        sys.exit()
+    if args.check:
+        mismatches = check()
+        for mismatch in mismatches:
+            print(f"Different results for {mismatch}")
+        if not mismatches:
+            print("The in-memory chain gives the same results as the scripts "
+                  "and as the reference implementation")
+        sys.exit(1 if mismatches else 0)
+
+    results = benchmark(args.scales, args.seed)
+    with open(args.output, "a") as f:
+        for run in results:
+            f.write(json.dumps(run) + "\n")
+
+    if args.baseline:
+        slower = regressions(results, args.baseline)
+        for key, before, after in slower:
+            print(f"Regression in {key}: {before:.3f} -> {after:.3f} s")
+        if slower:
+            sys.exit(1)
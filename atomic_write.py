@@ -0,0 +1,29 @@
+"""
+    This script contains the code for writing the result and model files
+    atomically: a file is written to a temporary file next to it first, which
+    only replaces the file once it has been written completely. This way a
+    crash halfway through never leaves a broken file behind, and a reader
+    like prediction_service.py (which reloads the model files while the
+    scripts are running) never reads half of a file.
+
+        with atomic_write("results/position_summary.csv") as temp_path:
+            summary_df.to_csv(temp_path, index=False)
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def atomic_write(path):
+    # The temporary file keeps the extension of the file, since np.save and
+    # np.savez add theirs to any path without it
+    temp_path = f"{path}.tmp{os.path.splitext(path)[1]}"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
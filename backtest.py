@@ -0,0 +1,151 @@
+"""
+    This script checks whether the FP3 positions are as useful for
+    predicting the race positions in every season, instead of only fitting
+    the model on 2014-2018 and evaluating it on 2019. The seasons are split
+    into rolling-origin folds, e.g. with at least three training seasons:
+
+        expanding: 2014-2016 -> 2017, 2014-2017 -> 2018, 2014-2018 -> 2019
+        sliding:   2014-2016 -> 2017, 2015-2017 -> 2018, 2016-2018 -> 2019
+
+    For every fold, the same steps as position_summary.py,
+    normal_distribution_probability.py, predictions.py and accuracy.py are
+    run on the training and test seasons of the fold, without writing any
+    of their files. The folds run in a pool of processes; every process
+    memory maps the race store, so the race data is shared between them
+    instead of being copied into each one.
+
+    The metrics of every fold are saved in backtest_folds.csv, and their
+    average and standard deviation over the folds in backtest_summary.csv.
+
+        python backtest.py --min-train 3 --schemes expanding sliding
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import concurrent.futures
+import pandas as pd
+import instrumentation
+from accuracy import APPROX_TOLERANCE, evaluate
+from normal_distribution_probability import position_grid
+from numeric_results import write_block
+from pearson_correlation import race_correlations
+from position_summary import build_state, summarise
+from predictions import predictions_frame
+from race_store import GRID_SIZE, load_store
+
+INPUT_PATH = "data/race_store.npy"
+OUTPUT_PATH = "results"
+SCHEMES = ("expanding", "sliding")
+# The smallest number of training seasons (and the window of the sliding
+# scheme)
+MIN_TRAIN = 3
+
+# The race store of each worker process, memory mapped once
+_races = None
+
+
+def _load_races(path):
+    global _races
+    _races = load_store(path)
+
+
+def folds(seasons, schemes=SCHEMES, min_train=MIN_TRAIN):
+    # Returns (scheme, training seasons, test season) for every fold
+    seasons = sorted(int(season) for season in seasons)
+    result = []
+    for scheme in schemes:
+        for i in range(min_train, len(seasons)):
+            start = 0 if scheme == "expanding" else i - min_train
+            result.append((scheme, seasons[start:i], seasons[i]))
+    return result
+
+
+def run_fold(fold, tolerances=(0, APPROX_TOLERANCE), races=None):
+    # The whole chain for one fold, with everything kept in memory
+    scheme, train_seasons, test_season = fold
+    if races is None:
+        races = _races
+    races = races.select(seasons=train_seasons + [test_season])
+    test_races = races.select(seasons=test_season)
+
+    summary = summarise(build_state(races, GRID_SIZE, train_seasons,
+                                    [test_season]))
+    _, probabilities = position_grid(summary["mean_finish_position"].values,
+                                     summary["cl_var_finish_position"].values)
+    metrics = evaluate(predictions_frame(probabilities), test_races,
+                       tolerances)
+
+    averages = metrics.groupby(["method", "tolerance"], sort=False).mean(
+        numeric_only=True)[["avg_diff", "prob_finish", "prob_no_finish"]]
+    averages = averages.reset_index()
+    averages.insert(0, "scheme", scheme)
+    averages.insert(1, "train_seasons",
+                    f"{train_seasons[0]}-{train_seasons[-1]}")
+    averages.insert(2, "test_season", test_season)
+    # How strongly the FP3 positions are correlated with the race positions
+    # in the test season, independently of the model
+    averages["test_pearson_corr"] = \
+        race_correlations(test_races)["pearson_corr"].mean()
+    return averages
+
+
+def backtest(fold_list, path=INPUT_PATH, tolerances=(0, APPROX_TOLERANCE),
+             max_workers=None):
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers, initializer=_load_races,
+            initargs=(path,)) as executor:
+        results = executor.map(run_fold, fold_list,
+                               [tolerances] * len(fold_list))
+        return pd.concat(list(results), ignore_index=True)
+
+
+def summarise_folds(fold_metrics):
+    columns = ["avg_diff", "prob_finish", "prob_no_finish",
+               "test_pearson_corr"]
+    summary = fold_metrics.groupby(["scheme", "method", "tolerance"],
+                                   sort=False)[columns].agg(["mean", "std"])
+    summary.columns = [f"{column}_{value}" for column, value in summary]
+    summary.insert(0, "folds", fold_metrics.groupby(
+        ["scheme", "method", "tolerance"], sort=False).size())
+    return summary.reset_index()
+
+
+def save_results(fold_metrics, summary):
+    fold_metrics.to_csv(f"{OUTPUT_PATH}/backtest_folds.csv", index=False)
+    summary.to_csv(f"{OUTPUT_PATH}/backtest_summary.csv", index=False)
+
+    lines = ["Backtest Prob. Approx Right (mean & std over the folds):"]
+    metrics = {}
+    approx = summary[summary["tolerance"] == APPROX_TOLERANCE]
+    for row in approx.itertuples():
+        lines.append(f"- {row.scheme} {row.method}: {row.prob_finish_mean} "
+                     f"& {row.prob_finish_std}")
+        metrics[f"{row.scheme} {row.method}.prob_approx_mean"] = \
+            row.prob_finish_mean
+        metrics[f"{row.scheme} {row.method}.prob_approx_std"] = \
+            row.prob_finish_std
+    write_block("backtest.py", lines, OUTPUT_PATH, metrics)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schemes", nargs="+", choices=SCHEMES,
+                        default=list(SCHEMES))
+    parser.add_argument("--min-train", type=int, default=MIN_TRAIN,
+                        help="number of training seasons of the first fold "
+                             "(and of every fold of the sliding scheme)")
+    parser.add_argument("--tolerances", type=int, nargs="*", default=[])
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with instrumentation.stage("backtest") as stage:
+        tolerances = sorted({0, APPROX_TOLERANCE, *args.tolerances})
+
+        races = load_store(INPUT_PATH)
+        stage["rows"] = len(races)
+        fold_list = folds(races.seasons(), args.schemes, args.min_train)
+        stage["folds"] = len(fold_list)
+        fold_metrics = backtest(fold_list, INPUT_PATH, tolerances,
+                                args.max_workers)
+        save_results(fold_metrics, summarise_folds(fold_metrics))
@@ -0,0 +1,276 @@
+"""
+    This script calculates bootstrap confidence intervals for the figures in
+    the numeric_results text file: the average Pearson Correlation of the
+    races, the correlation between the FP3 position and the mean finishing
+    position, and the accuracy of each of the predictions.
+
+    The races are resampled, not the rows, since the rows of a race are not
+    independent of each other (e.g. two drivers cannot finish in the same
+    position). Every statistic is calculated from per-race sums, so a
+    resample only has to count how many times it picked each race: the sums
+    of a whole batch of resamples are then a single matrix product of these
+    counts and the per-race sums. The batches are spread across a pool of
+    processes. Every batch has its own seed, derived from the main seed, so
+    the intervals are the same no matter how many processes are used.
+
+    Both the percentile and the BCa (bias-corrected and accelerated)
+    intervals are saved in bootstrap_intervals.csv:
+
+        python bootstrap.py --resamples 10000 --confidence 0.95
+
+    Note that the predictions themselves are not refitted, so the intervals
+    of the accuracy only cover the variation of the 2019 races.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import concurrent.futures
+import functools
+import numpy as np
+import pandas as pd
+from scipy import stats
+import instrumentation
+from accuracy import APPROX_TOLERANCE, PREDICTIONS_PATH, prediction_lookup
+from numeric_results import write_block
+from pearson_correlation import (_group_ids, correlation_from_moments,
+                                 race_correlations)
+from race_store import GRID_SIZE, TEST_SEASONS, TRAIN_SEASONS, load_store
+
+INPUT_PATH = "data/race_store.npy"
+OUTPUT_PATH = "results"
+RESAMPLES = 10_000
+BATCH_SIZE = 1_000
+CONFIDENCE = 0.95
+SEED = 2014
+
+
+def mean_race_correlation(totals):
+    # totals has the columns sum of r and number of races with an r
+    return totals[:, :1] / totals[:, 1:]
+
+
+def mean_position_correlation(totals, grid_size=GRID_SIZE):
+    # totals has the finishes and the sums of the finishing positions of
+    # every FP3 position; positions which never finished are left out
+    counts, sums = totals[:, :grid_size], totals[:, grid_size:]
+    finished = counts > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(finished, sums / counts, 0.0)
+    positions = np.where(finished, np.arange(1, grid_size + 1), 0.0)
+    moments = np.stack([finished.sum(axis=1), positions.sum(axis=1),
+                        means.sum(axis=1), (positions**2).sum(axis=1),
+                        (means**2).sum(axis=1),
+                        (positions * means).sum(axis=1)])
+    r, _ = correlation_from_moments(moments)
+    return r[:, np.newaxis]
+
+
+def prediction_accuracy(totals, method_count, grid_size, tolerance_count):
+    # totals has the number of races, the finishes of every FP3 position,
+    # the summed differences of every method and position, and the hits of
+    # every method, position and tolerance. The averages are taken over the
+    # positions, like in accuracy.py.
+    race_count = totals[:, 0]
+    finishes = totals[:, 1:1 + grid_size]
+    offset = 1 + grid_size
+    differences = totals[:, offset:offset + method_count * grid_size]
+    differences = differences.reshape(-1, method_count, grid_size)
+    hits = totals[:, offset + method_count * grid_size:].reshape(
+        -1, method_count, grid_size, tolerance_count)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_diff = np.nanmean(differences / finishes[:, np.newaxis], axis=2)
+        prob_finish = np.nanmean(
+            hits / finishes[:, np.newaxis, :, np.newaxis], axis=2)
+    prob_no_finish = (hits / race_count[:, np.newaxis, np.newaxis,
+                                        np.newaxis]).mean(axis=2)
+    # One column per method: the avg. difference, then the probabilities
+    # for every tolerance
+    values = np.concatenate((avg_diff[..., np.newaxis], prob_finish,
+                             prob_no_finish), axis=2)
+    return values.reshape(len(totals), -1)
+
+
+def correlation_statistics(races):
+    correlations = race_correlations(races)["pearson_corr"].values
+    valid = ~np.isnan(correlations)
+    features = np.column_stack((np.where(valid, correlations, 0.0), valid))
+    return (["FP3 Pos & Race Pos Pearson Corr"], features,
+            mean_race_correlation)
+
+
+def position_statistics(races, grid_size=GRID_SIZE):
+    race_numbers, ids = _group_ids(races.race_no)
+    cells = ids * grid_size + np.asarray(races.fp3_pos, dtype=np.intp) - 1
+    size = len(race_numbers) * grid_size
+    counts = np.bincount(cells, minlength=size)
+    sums = np.bincount(cells, np.asarray(races.race_pos, dtype=np.float64),
+                       size)
+    features = np.concatenate((counts.reshape(-1, grid_size),
+                               sums.reshape(-1, grid_size)), axis=1)
+    return (["FP3 Pos & Mean Race Pos Pearson Corr"], features,
+            functools.partial(mean_position_correlation,
+                              grid_size=grid_size))
+
+
+def accuracy_statistics(predictions, races, tolerances=(0, APPROX_TOLERANCE)):
+    names, lookup = prediction_lookup(predictions)
+    grid_size = lookup.shape[1] - 1
+    race_numbers, ids = _group_ids(races.race_no)
+    fp3_pos = np.asarray(races.fp3_pos, dtype=np.intp)
+    cells = ids * grid_size + fp3_pos - 1
+    size = len(race_numbers) * grid_size
+
+    def per_race(weights=None):
+        return np.bincount(cells, weights, size).reshape(-1, grid_size)
+
+    differences = np.abs(lookup[:, fp3_pos] - np.asarray(races.race_pos))
+    features = [np.ones((len(race_numbers), 1)), per_race()]
+    features += [per_race(method_differences)
+                 for method_differences in differences]
+    # The hits are laid out by method, position and then tolerance
+    hits = np.stack([np.stack([per_race(method_differences <= tolerance)
+                               for tolerance in tolerances], axis=-1)
+                     for method_differences in differences], axis=1)
+    features.append(hits.reshape(len(race_numbers), -1))
+
+    labels = []
+    for name in names:
+        labels.append(f"{name} Avg. Difference")
+        for value in ("finish", "no_finish"):
+            for tolerance in tolerances:
+                labels.append(f"{name} Prob. Within {tolerance} ({value})")
+    return (labels, np.concatenate(features, axis=1),
+            functools.partial(prediction_accuracy, method_count=len(names),
+                              grid_size=grid_size,
+                              tolerance_count=len(tolerances)))
+
+
+def resample_counts(rng, resample_count, race_count):
+    # counts[i, j] is how many times the i-th resample picked race j
+    picks = rng.integers(0, race_count, (resample_count, race_count))
+    picks += np.arange(resample_count)[:, np.newaxis] * race_count
+    return np.bincount(picks.ravel(), minlength=resample_count *
+                       race_count).reshape(resample_count, race_count)
+
+
+def bootstrap_batch(seed, resample_count, statistics):
+    # Every statistic is resampled on its own races (training or test), but
+    # they all use the same random generator of the batch
+    rng = np.random.default_rng(seed)
+    values = []
+    for _, features, function in statistics:
+        counts = resample_counts(rng, resample_count, len(features))
+        values.append(function(counts @ features))
+    return np.concatenate(values, axis=1)
+
+
+def bootstrap(statistics, resamples=RESAMPLES, batch_size=BATCH_SIZE,
+              seed=SEED, max_workers=None):
+    # Returns the value of every statistic for every resample
+    batches = [min(batch_size, resamples - start)
+               for start in range(0, resamples, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        results = executor.map(bootstrap_batch, seeds, batches,
+                               [statistics] * len(batches))
+        return np.concatenate(list(results))
+
+
+def estimates(statistics):
+    # The statistics on the original races
+    return np.concatenate([
+        function(features.sum(axis=0, keepdims=True))[0]
+        for _, features, function in statistics])
+
+
+def jackknife(statistics):
+    # The statistics with each race left out in turn, for every statistic.
+    # Different statistics may use different races, so a list is returned.
+    values = []
+    for _, features, function in statistics:
+        leave_one_out = features.sum(axis=0) - features
+        values.extend(function(leave_one_out).T)
+    return values
+
+
+def intervals(names, estimate, samples, jackknife_values,
+              confidence=CONFIDENCE):
+    alpha = (1 - confidence) / 2
+    rows = []
+    for i, name in enumerate(names):
+        sample = samples[:, i]
+        sample = sample[~np.isnan(sample)]
+        percentile = np.percentile(sample, [100 * alpha, 100 * (1 - alpha)])
+
+        # BCa: the bias correction z0 comes from the share of resamples
+        # below the estimate, the acceleration from the jackknife
+        z0 = stats.norm.ppf((np.sum(sample < estimate[i]) +
+                             np.sum(sample == estimate[i]) / 2) / len(sample))
+        deviations = np.nanmean(jackknife_values[i]) - jackknife_values[i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            acceleration = (np.nansum(deviations**3) /
+                            (6 * np.nansum(deviations**2)**1.5))
+        acceleration = np.nan_to_num(acceleration)
+        z = stats.norm.ppf([alpha, 1 - alpha])
+        adjusted = stats.norm.cdf(z0 + (z0 + z) / (1 - acceleration *
+                                                   (z0 + z)))
+        if np.all(np.isfinite(adjusted)):
+            bca = np.percentile(sample, 100 * adjusted)
+        else:
+            bca = [np.nan, np.nan]
+
+        for method, (lower, upper) in (("percentile", percentile),
+                                       ("bca", bca)):
+            rows.append({"statistic": name, "estimate": estimate[i],
+                         "method": method, "confidence": confidence,
+                         "lower": lower, "upper": upper})
+    return pd.DataFrame(rows)
+
+
+def save_intervals(intervals_df):
+    intervals_df.to_csv(f"{OUTPUT_PATH}/bootstrap_intervals.csv",
+                        index=False)
+
+    confidence = intervals_df["confidence"].iloc[0]
+    lines = [f"Bootstrap {confidence:.0%} Confidence Intervals "
+             "(percentile & BCa):"]
+    metrics = {}
+    for name, rows in intervals_df.groupby("statistic", sort=False):
+        percentile, bca = rows.iloc[0], rows.iloc[1]
+        lines.append(f"- {name}: {percentile['estimate']} "
+                     f"[{percentile['lower']}, {percentile['upper']}] & "
+                     f"[{bca['lower']}, {bca['upper']}]")
+        metrics[f"{name}.estimate"] = percentile["estimate"]
+        for row in (percentile, bca):
+            for bound in ("lower", "upper"):
+                metrics[f"{name}.{row['method']}_{bound}"] = row[bound]
+    write_block("bootstrap.py", lines, OUTPUT_PATH, metrics)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resamples", type=int, default=RESAMPLES)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with instrumentation.stage("bootstrap",
+                               resamples=args.resamples) as stage:
+        store = load_store(INPUT_PATH)
+        train_races = store.select(seasons=TRAIN_SEASONS)
+        test_races = store.select(seasons=TEST_SEASONS)
+        stage["rows"] = len(train_races) + len(test_races)
+        statistics = [correlation_statistics(train_races),
+                      position_statistics(train_races),
+                      accuracy_statistics(pd.read_csv(PREDICTIONS_PATH),
+                                          test_races)]
+        names = [name for statistic in statistics for name in statistic[0]]
+
+        samples = bootstrap(statistics, args.resamples, args.batch_size,
+                            args.seed, args.max_workers)
+        save_intervals(intervals(names, estimates(statistics), samples,
+                                 jackknife(statistics), args.confidence))
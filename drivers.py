@@ -0,0 +1,246 @@
+"""
+    This script contains the driver table and the per-driver statistics.
+    The driver strings on the website look like "Lewis  Hamilton  HAM" (with
+    two spaces between the words), so the table keeps the cleaned up name
+    (Lewis Hamilton) and the three letter code of every driver, and gives
+    each driver a small integer ID. A driver is identified by the name and
+    the code together, since the code alone is shared by some drivers (e.g.
+    Max Verstappen and Jean-Eric Vergne are both VER). The IDs are given in
+    the order the drivers first appear and never change, so new drivers are
+    added at the end of data/drivers.csv. The race store keeps these IDs in
+    its driver column.
+
+    The race store is sorted by race, so finding the races of one driver
+    would mean going through every race. The DriverIndex keeps the rows of
+    the race store sorted by driver instead, with the offsets of every
+    driver's rows (like a CSR matrix), so the rows of any driver are a
+    single slice.
+
+    Running this script updates the driver table from the race CSVs and the
+    race store, and saves the statistics of every driver: the positions
+    gained between FP3 and the race, how often the FP3 position was held or
+    improved on (and the longest streak of it), how often a Top 10 FP3
+    position was converted into a Top 10 finish, and the same per-position
+    statistics as position_summary.py, for every driver.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import csv
+import os
+import numpy as np
+import pandas as pd
+import instrumentation
+from atomic_write import atomic_write
+from position_summary import PositionAccumulator
+from race_store import (CSV_FOLDERS, DRIVERS_PATH, GRID_SIZE, STORE_PATH,
+                        load_store)
+
+OUTPUT_PATH = "results"
+# A Top 10 finish scores points
+POINTS_POSITIONS = 10
+
+
+def normalize_name(driver):
+    # Returns the name and the code of a driver string from the website,
+    # e.g. "Lewis  Hamilton  HAM" -> ("Lewis Hamilton", "HAM")
+    words = driver.split()
+    return " ".join(words[:-1]), words[-1].upper()
+
+
+class DriverTable:
+
+    """
+        The DriverTable class interns the drivers. codes and names hold the
+        code and the name of every driver in the order of the IDs, so
+        codes[driver_id] is the code of the driver.
+    """
+
+    def __init__(self, codes=(), names=()):
+        self.codes = []
+        self.names = []
+        self._ids = {}
+        for code, name in zip(codes, names):
+            self.add(name, code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def add(self, name, code):
+        # The ID of the driver, which is interned if it is not in the table
+        key = (name, code)
+        if key not in self._ids:
+            self._ids[key] = len(self.codes)
+            self.codes.append(code)
+            self.names.append(name)
+        return self._ids[key]
+
+    def add_drivers(self, drivers):
+        # Interns driver strings from the website, in the order they first
+        # appear
+        for driver in dict.fromkeys(drivers):
+            self.add(*normalize_name(driver))
+        return self
+
+    def ids(self, drivers):
+        # The IDs of driver strings from the website, e.g. the driver column
+        # of a scraped race. Raises a KeyError for drivers which are not in
+        # the table.
+        ids = {driver: self._ids[normalize_name(driver)]
+               for driver in dict.fromkeys(drivers)}
+        return np.array([ids[driver] for driver in drivers], dtype=np.int64)
+
+    def code(self, driver_id):
+        return self.codes[driver_id]
+
+    def driver(self, driver_id):
+        # The driver string of the website, e.g. "Lewis  Hamilton  HAM"
+        return "  ".join(self.names[driver_id].split() +
+                         [self.codes[driver_id]])
+
+    def to_frame(self):
+        return pd.DataFrame({"driver_id": np.arange(len(self)),
+                             "code": self.codes,
+                             "name": self.names})
+
+    def save(self, path=DRIVERS_PATH):
+        with atomic_write(path) as temp_path:
+            self.to_frame().to_csv(temp_path, index=False)
+
+    @classmethod
+    def load(cls, path=DRIVERS_PATH):
+        if not os.path.exists(path):
+            return cls()
+        frame = pd.read_csv(path, keep_default_na=False)
+        return cls(frame["code"], frame["name"])
+
+
+def update_driver_table(frames, path=DRIVERS_PATH):
+    # Adds the drivers of scraped races (DataFrames with a driver column)
+    table = DriverTable.load(path)
+    for frame in frames:
+        table.add_drivers(frame["driver"])
+    table.save(path)
+    return table
+
+
+def read_csv_drivers(folders=CSV_FOLDERS):
+    # The driver strings of the race CSVs, in race order
+    drivers = []
+    files = [(int(file_name[:-4]), f"{folder}/{file_name}")
+             for folder in folders if os.path.isdir(folder)
+             for file_name in os.listdir(folder)]
+    for _, file_path in sorted(files):
+        with open(file_path, "r") as f:
+            drivers += [row["driver"] for row in csv.DictReader(f)]
+    return drivers
+
+
+class DriverIndex:
+
+    """
+        The DriverIndex class keeps the rows of a race store grouped by
+        driver: the rows of the driver with ID i are
+        rows[offsets[i]:offsets[i + 1]], in race order.
+    """
+
+    def __init__(self, races, table):
+        self.races = races
+        self.table = table
+        # The driver column of the race store holds the IDs of the table
+        self.driver_ids = np.asarray(races.driver, dtype=np.int64)
+        # A stable sort keeps the races of each driver in order
+        self.rows = np.argsort(self.driver_ids, kind="stable")
+        counts = np.bincount(self.driver_ids, minlength=len(table))
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def driver_rows(self, driver_id):
+        return self.rows[self.offsets[driver_id]:self.offsets[driver_id + 1]]
+
+    def driver(self, driver_id):
+        # The race store rows of a single driver
+        return self.races.data[:, self.driver_rows(driver_id)]
+
+    def grouped(self, column):
+        # A column of the race store in driver order, together with the ID
+        # of the driver of every value
+        return (np.asarray(getattr(self.races, column))[self.rows],
+                self.driver_ids[self.rows])
+
+
+def longest_streaks(flags, group_ids, group_count):
+    # The longest run of True values within every group, where the values
+    # of each group are next to each other
+    flags = np.asarray(flags, dtype=bool)
+    # A run starts after every False value and at the start of every group
+    starts = np.ones(len(flags), dtype=bool)
+    starts[1:] = (~flags[:-1]) | (group_ids[1:] != group_ids[:-1])
+    run_ids = np.cumsum(starts) - 1
+    run_lengths = np.bincount(run_ids, flags)
+    streaks = np.zeros(group_count)
+    np.maximum.at(streaks, group_ids[starts], run_lengths)
+    return streaks.astype(np.int64)
+
+
+def driver_summary(index):
+    fp3_pos, driver_ids = index.grouped("fp3_pos")
+    race_pos, _ = index.grouped("race_pos")
+    fp3_pos = fp3_pos.astype(np.float64)
+    race_pos = race_pos.astype(np.float64)
+    driver_count = len(index.table)
+
+    def total(values):
+        return np.bincount(driver_ids, values, driver_count)
+
+    races = np.bincount(driver_ids, minlength=driver_count)
+    held = race_pos <= fp3_pos
+    top_10 = fp3_pos <= POINTS_POSITIONS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame({
+            "driver_id": np.arange(driver_count),
+            "code": [index.table.code(i) for i in range(driver_count)],
+            "name": index.table.names,
+            "races": races,
+            "mean_fp3_position": total(fp3_pos) / races,
+            "mean_race_position": total(race_pos) / races,
+            "mean_positions_gained": total(fp3_pos - race_pos) / races,
+            "held_rate": total(held) / races,
+            "longest_held_streak": longest_streaks(held, driver_ids,
+                                                   driver_count),
+            "top_10_conversion": (total(top_10 &
+                                        (race_pos <= POINTS_POSITIONS)) /
+                                  total(top_10)),
+        })
+
+
+def driver_position_summary(index, grid_size=GRID_SIZE):
+    # The same statistics as position_summary.py, for every driver and FP3
+    # position; every (driver, FP3 position) pair is a cell of a single
+    # accumulator
+    driver_count = len(index.table)
+    cells = (index.driver_ids * grid_size +
+             np.asarray(index.races.fp3_pos, dtype=np.int64))
+    accumulator = PositionAccumulator(driver_count * grid_size)
+    accumulator.update(cells, index.races.race_pos)
+    shape = (driver_count, grid_size)
+    return pd.DataFrame({
+        "driver_id": np.repeat(np.arange(driver_count), grid_size),
+        "position": np.tile(np.arange(1, grid_size + 1), driver_count),
+        "races": accumulator.count,
+        "mean_finish_position": accumulator.mean.reshape(shape).ravel(),
+        "std_finish_position": accumulator.std.reshape(shape).ravel(),
+    }).query("races > 0").reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    with instrumentation.stage("drivers") as stage:
+        races = load_store(STORE_PATH)
+        stage["rows"] = len(races)
+        table = DriverTable.load().add_drivers(read_csv_drivers())
+        table.save()
+
+        index = DriverIndex(races, table)
+        driver_summary(index).to_csv(f"{OUTPUT_PATH}/driver_summary.csv",
+                                     index=False)
+        driver_position_summary(index).to_csv(
+            f"{OUTPUT_PATH}/driver_position_summary.csv", index=False)
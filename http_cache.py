@@ -0,0 +1,203 @@
+"""
+    This script contains the response cache used by the scrapers. The results
+    of past races never change, so there is no reason to download the same
+    pages every time the data is scraped.
+
+    Every page is saved in the cache directory under the hash of its URL,
+    together with its ETag and Last-Modified headers. When a page is needed
+    again, the cache is used in one of two ways:
+    - pages of finished seasons are returned straight from the cache, without
+      asking the website at all;
+    - other pages are revalidated with a conditional request
+      (If-None-Match / If-Modified-Since), so the page is only downloaded
+      again if it has changed (otherwise the website answers 304).
+
+    The cache is limited in size; as soon as storing a page makes it too
+    big, the pages which were used the longest time ago are removed first.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import instrumentation
+from race_store import parse_link
+
+CACHE_PATH = "data/http_cache"
+# 256 MB is enough for several thousand result pages
+MAX_BYTES = 256 * 1024 * 1024
+
+
+def current_season_finished(season):
+    # A season is treated as finished once the next year has started
+    return season < datetime.date.today().year
+
+
+class ResponseCache:
+
+    """
+        The ResponseCache class keeps the pages on disk. It can be shared by
+        several threads; the files are replaced atomically, so a page is
+        never read halfway through being written.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES,
+                 season_finished=current_season_finished):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.season_finished = season_finished
+        self.lock = threading.Lock()
+        # Counts of how each request was answered, for reporting
+        self.stats = {"local": 0, "revalidated": 0, "downloaded": 0}
+        # The size of the pages after the last eviction plus the pages
+        # stored since (None until the cache directory has been scanned)
+        self.size = None
+        os.makedirs(path, exist_ok=True)
+
+    def _entry_path(self, url):
+        return f"{self.path}/{hashlib.sha256(url.encode()).hexdigest()}"
+
+    def _count(self, outcome, url, start, body):
+        with self.lock:
+            self.stats[outcome] += 1
+        instrumentation.record("request", outcome, url=url,
+                               seconds=time.perf_counter() - start,
+                               bytes=len(body))
+
+    def lookup(self, url):
+        # Returns the saved headers of the URL and its body, or None
+        entry_path = self._entry_path(url)
+        try:
+            with open(f"{entry_path}.json", "r") as f:
+                meta = json.load(f)
+            with open(f"{entry_path}.body", "rb") as f:
+                body = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return meta, body
+
+    def is_final(self, url):
+        # Pages of finished seasons are never revalidated
+        try:
+            season, _ = parse_link(url)
+        except ValueError:
+            return False
+        return self.season_finished(season)
+
+    def conditional_headers(self, meta):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def _write(self, entry_path, suffix, content, mode):
+        temp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, mode) as f:
+            f.write(content)
+        os.replace(temp_path, f"{entry_path}.{suffix}")
+
+    def store(self, url, body, headers):
+        entry_path = self._entry_path(url)
+        meta = {"url": url, "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "size": len(body), "stored_at": time.time()}
+        self._write(entry_path, "body", body, "wb")
+        self._write(entry_path, "json", json.dumps(meta), "w")
+        # A replaced page is counted twice, which at worst makes the cache
+        # scan its directory a little early
+        with self.lock:
+            if self.size is not None:
+                self.size += len(body)
+            full = self.size is None or self.size > self.max_bytes
+        if full:
+            self.evict()
+
+    def touch(self, url):
+        # The access time of the metadata file decides the eviction order
+        try:
+            os.utime(f"{self._entry_path(url)}.json")
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        # Removes the least recently used pages until the cache fits in
+        # max_bytes
+        with self.lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.path):
+                if entry.name.endswith(".body"):
+                    meta_path = entry.path[:-len(".body")] + ".json"
+                    try:
+                        last_used = os.stat(meta_path).st_mtime
+                    except FileNotFoundError:
+                        last_used = 0
+                    size = entry.stat().st_size
+                    entries.append((last_used, size, entry.path))
+                    total += size
+            for last_used, size, body_path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                entry_path = body_path[:-len(".body")]
+                for suffix in (".body", ".json"):
+                    try:
+                        os.remove(entry_path + suffix)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+            self.size = total
+
+    def get(self, session, url):
+        # Fetches the URL with a requests session, using the cache
+        start = time.perf_counter()
+        cached = self.lookup(url)
+        headers = {}
+        if cached is not None:
+            meta, body = cached
+            if self.is_final(url):
+                self.touch(url)
+                self._count("local", url, start, body)
+                return body
+            headers = self.conditional_headers(meta)
+
+        response = session.get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.touch(url)
+            self._count("revalidated", url, start, cached[1])
+            return cached[1]
+        response.raise_for_status()
+        self.store(url, response.content, response.headers)
+        self._count("downloaded", url, start, response.content)
+        return response.content
+
+    async def get_async(self, session, url):
+        # The same as get, for an aiohttp session
+        start = time.perf_counter()
+        cached = self.lookup(url)
+        headers = {}
+        if cached is not None:
+            meta, body = cached
+            if self.is_final(url):
+                self.touch(url)
+                self._count("local", url, start, body)
+                return body
+            headers = self.conditional_headers(meta)
+
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                self.touch(url)
+                self._count("revalidated", url, start, cached[1])
+                return cached[1]
+            response.raise_for_status()
+            body = await response.read()
+            self.store(url, body, response.headers)
+        self._count("downloaded", url, start, body)
+        return body
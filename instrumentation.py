@@ -0,0 +1,172 @@
+"""
+    This script contains the instrumentation used to find out where the time
+    goes: how long every request and parse of the scrapers takes, and how
+    long every analysis script runs, how many rows it processes and how much
+    memory it needs at most.
+
+    The instrumentation is switched on by setting the F1_INSTRUMENTATION
+    environment variable to the file the measurements should be saved in
+    (one JSON object per line). When it is not set, the timers do nothing
+    and nothing is recorded. pipeline.py sets it with --instrument:
+
+        python pipeline.py --force --instrument results/instrumentation.jsonl
+
+    and running this script prints a summary table of a file:
+
+        python instrumentation.py results/instrumentation.jsonl
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+from contextlib import contextmanager, nullcontext
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, so the peak memory is not reported there
+    resource = None
+
+ENV_VARIABLE = "F1_INSTRUMENTATION"
+OUTPUT_PATH = "results/instrumentation.jsonl"
+
+_path = os.environ.get(ENV_VARIABLE)
+enabled = bool(_path)
+_events = []
+_counters = {}
+_lock = threading.Lock()
+
+
+def enable(path=OUTPUT_PATH):
+    # Switches the instrumentation on for this process and for the scripts
+    # it starts
+    global _path, enabled
+    if not enabled:
+        atexit.register(flush)
+    _path = path
+    enabled = True
+    os.environ[ENV_VARIABLE] = path
+
+
+def record(kind, name, **fields):
+    if not enabled:
+        return
+    event = {"kind": kind, "name": name, "pid": os.getpid(),
+             "time": time.time(), **fields}
+    with _lock:
+        _events.append(event)
+
+
+def count(name, value=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def peak_memory():
+    # The most memory the process has used so far, in bytes. On Linux this
+    # is read from /proc, since ru_maxrss is carried over from the parent
+    # process by fork and exec, so a script started by a process which used
+    # more memory would report the memory of its parent.
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def _timed(kind, name, fields):
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        fields["seconds"] = time.perf_counter() - start
+        if kind == "stage":
+            fields["peak_memory"] = peak_memory()
+        record(kind, name, **fields)
+
+
+def timer(name, **fields):
+    # Times the block and records it, together with the fields. More fields
+    # can be added to the dictionary returned by the with statement.
+    if not enabled:
+        return nullcontext({})
+    return _timed("timer", name, fields)
+
+
+def stage(name, **fields):
+    # The same as timer, for a whole analysis script; the peak memory of
+    # the process is recorded as well
+    if not enabled:
+        return nullcontext({})
+    return _timed("stage", name, fields)
+
+
+def flush():
+    # Appends everything recorded so far to the output file
+    if not enabled:
+        return
+    with _lock:
+        events = list(_events)
+        events += [{"kind": "counter", "name": name, "pid": os.getpid(),
+                    "time": time.time(), "value": value}
+                   for name, value in _counters.items()]
+        _events.clear()
+        _counters.clear()
+    if not events:
+        return
+    # A single write per flush, so the lines of processes which finish at
+    # the same time are not mixed up
+    with open(_path, "a") as f:
+        f.write("".join(json.dumps(event) + "\n" for event in events))
+
+
+def summary(path=OUTPUT_PATH):
+    # One row for every kind of measurement
+    with open(path, "r") as f:
+        events = pd.DataFrame([json.loads(line) for line in f])
+    for column in ("seconds", "rows", "bytes", "value", "peak_memory"):
+        if column not in events:
+            events[column] = float("nan")
+
+    def total(values):
+        # Empty for measurements which do not have the field
+        return values.sum(min_count=1)
+
+    table = events.groupby(["kind", "name"]).agg(
+        count=("name", "size"),
+        total_seconds=("seconds", total),
+        mean_seconds=("seconds", "mean"),
+        p95_seconds=("seconds", lambda seconds: seconds.quantile(0.95)),
+        max_seconds=("seconds", "max"),
+        rows=("rows", total),
+        total_bytes=("bytes", total),
+        value=("value", total),
+        peak_memory=("peak_memory", "max"))
+    return table.sort_values("total_seconds", ascending=False)
+
+
+if _path:
+    atexit.register(flush)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else OUTPUT_PATH
+    with pd.option_context("display.width", 200,
+                           "display.max_columns", None):
+        print(summary(path))
@@ -1,53 +1,156 @@
 """
     This script calculates the probability of an FP3 position finishing in
     different race positions using the Central Limit Theorem. The probabilities
-    are first calculated using z-score increments and saved in the
-    probabilities_increments directory; the data there will be used to plot
-    the probability curve. Afterwards, the probabilities are calculated for
-    each finishing position individually and are saved in the
-    probabilities_positions directory; this data is used to make the
-    predictions.
+    are first calculated using z-score increments and saved in
+    probabilities_increments.npz; the data there will be used to plot the
+    probability curve. Afterwards, the probabilities are calculated for each
+    finishing position individually and are saved in
+    probabilities_positions.npz; this data is used to make the predictions.
+
+    Both grids are calculated with a single call to stats.norm.pdf, by
+    broadcasting the FP3 positions against the increments (or the race
+    positions). The z-score step, the z-score range and the grid size can be
+    changed from the command line, e.g.
+
+        python normal_distribution_probability.py --step 0.01 --z-range 4
+
+    The old layout of one CSV per FP3 position (in the
+    probabilities_increments and probabilities_positions directories) can
+    still be exported with --csv.
 
     If you have any suggestions on how I can improve this code, feel free to
     open an issue on GitHub. I would love to hear your insight!
 """
+import argparse
 import os
 import numpy as np
 import pandas as pd
 from scipy import stats
+import instrumentation
+from atomic_write import atomic_write
 
 INPUT_PATH = "results"
 OUTPUT_PATH = "results"
-position_data = pd.read_csv(f"{INPUT_PATH}/position_summary.csv", index_col=0)
-# Getting the z-score increments:
-increments = np.arange(-3.0, 3.1, 0.1)
-
-if not os.path.isdir(f"{OUTPUT_PATH}/probabilities_increments"):
-    os.mkdir(f"{OUTPUT_PATH}/probabilities_increments")
-
-if not os.path.isdir(f"{OUTPUT_PATH}/probabilities_positions"):
-    os.mkdir(f"{OUTPUT_PATH}/probabilities_positions")
-
-for pos in position_data.index:
-    increment_result = pd.DataFrame(columns=["std_increments", "aprox_pos",
-                                             "probability"])
-    pos_result = pd.DataFrame(columns=["position", "probability"])
-    pos_row = position_data.loc[pos]
-    mean_finish = pos_row["mean_finish_position"]
-    cl_var = pos_row["cl_var_finish_position"]
-    # Getting predictions for z-score increments
-    for increment in increments:
-        increment_pos = mean_finish + increment * cl_var
-        increment_prob = stats.norm(mean_finish, cl_var).pdf(increment_pos)
-        increment_row = [increment, increment_pos, increment_prob]
-        increment_result.loc[len(increment_result)] = increment_row
-    increment_result.to_csv(f"{INPUT_PATH}/probabilities_increments/{pos}.csv",
-                            index=False)
-
-    # Getting predictions for each position
-    for pos_race in position_data.index:
-        pos_prob = stats.norm(mean_finish, cl_var).pdf(pos_race)
-        pos_row = [pos_race, pos_prob]
-        pos_result.loc[len(pos_result)] = pos_row
-    pos_result.to_csv(f"results/probabilities_positions/{pos}.csv",
-                      index=False)
+INCREMENTS_PATH = f"{OUTPUT_PATH}/probabilities_increments.npz"
+POSITIONS_PATH = f"{OUTPUT_PATH}/probabilities_positions.npz"
+Z_STEP = 0.1
+Z_RANGE = 3.0
+
+
+def z_increments(step=Z_STEP, z_range=Z_RANGE):
+    # np.arange(-3.0, 3.1, 0.1) for the default step and range, like the
+    # original script. The stop is half a step past the range, so the last
+    # increment is always included and never one step too many.
+    return np.arange(-z_range, z_range + step / 2, step)
+
+
+def increment_grid(means, scales, step=Z_STEP, z_range=Z_RANGE):
+    # Returns the increments and the (FP3 position x increment) grids of the
+    # approximate positions and their probabilities
+    increments = z_increments(step, z_range)
+    means = np.asarray(means, dtype=np.float64)[:, np.newaxis]
+    scales = np.asarray(scales, dtype=np.float64)[:, np.newaxis]
+    positions = means + increments * scales
+    probabilities = stats.norm.pdf(positions, means, scales)
+    return increments, positions, probabilities
+
+
+def position_grid(means, scales, grid_size=None):
+    # Returns the race positions and the (FP3 position x race position) grid
+    # of probabilities
+    means = np.asarray(means, dtype=np.float64)[:, np.newaxis]
+    scales = np.asarray(scales, dtype=np.float64)[:, np.newaxis]
+    if grid_size is None:
+        grid_size = len(means)
+    race_positions = np.arange(1, grid_size + 1, dtype=np.float64)
+    probabilities = stats.norm.pdf(race_positions, means, scales)
+    return race_positions, probabilities
+
+
+def export_csvs(fp3_positions, increments, increment_positions,
+                increment_probabilities, race_positions,
+                position_probabilities):
+    # Writes the grids in the old layout: one file per FP3 position in each
+    # of the two directories
+    for folder in ("probabilities_increments", "probabilities_positions"):
+        if not os.path.isdir(f"{OUTPUT_PATH}/{folder}"):
+            os.mkdir(f"{OUTPUT_PATH}/{folder}")
+
+    for i, pos in enumerate(fp3_positions):
+        increment_result = pd.DataFrame({
+            "std_increments": increments,
+            "aprox_pos": increment_positions[i],
+            "probability": increment_probabilities[i]})
+        increment_result.to_csv(
+            f"{OUTPUT_PATH}/probabilities_increments/{float(pos)}.csv",
+            index=False)
+
+        pos_result = pd.DataFrame({"position": race_positions,
+                                   "probability": position_probabilities[i]})
+        pos_result.to_csv(
+            f"{OUTPUT_PATH}/probabilities_positions/{float(pos)}.csv",
+            index=False)
+
+
+def run(summary_df, step=Z_STEP, z_range=Z_RANGE, grid_size=None,
+        save=True, csv=False):
+    # The probability grids of the positions in summary_df (the output of
+    # position_summary.py). With save, they are also written to the .npz
+    # files, and with csv in the old layout as well.
+    if grid_size is not None:
+        # The grid has to be square, since every race position is assigned
+        # to an FP3 position
+        if grid_size > len(summary_df):
+            raise ValueError(f"The grid size {grid_size} is larger than the "
+                             f"{len(summary_df)} positions in the summary")
+        summary_df = summary_df.iloc[:grid_size]
+    fp3_positions = summary_df["position"].values
+    mean_finish = summary_df["mean_finish_position"].values
+    cl_var = summary_df["cl_var_finish_position"].values
+
+    increments, increment_positions, increment_probabilities = \
+        increment_grid(mean_finish, cl_var, step, z_range)
+    race_positions, position_probabilities = \
+        position_grid(mean_finish, cl_var, grid_size)
+    grids = {"fp3_positions": fp3_positions, "increments": increments,
+             "increment_positions": increment_positions,
+             "increment_probabilities": increment_probabilities,
+             "race_positions": race_positions,
+             "probabilities": position_probabilities}
+
+    if save:
+        with atomic_write(INCREMENTS_PATH) as temp_path:
+            np.savez(temp_path, fp3_positions=fp3_positions,
+                     increments=increments, positions=increment_positions,
+                     probability=increment_probabilities)
+        with atomic_write(POSITIONS_PATH) as temp_path:
+            np.savez(temp_path, fp3_positions=fp3_positions,
+                     race_positions=race_positions,
+                     probability=position_probabilities)
+    if csv:
+        export_csvs(fp3_positions, increments, increment_positions,
+                    increment_probabilities, race_positions,
+                    position_probabilities)
+    return grids
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--step", type=float, default=Z_STEP,
+                        help="z-score step of the probability curve")
+    parser.add_argument("--z-range", type=float, default=Z_RANGE,
+                        help="the curve goes from -z-range to +z-range")
+    parser.add_argument("--grid-size", type=int, default=None,
+                        help="number of positions (default: all positions "
+                             "in position_summary.csv)")
+    parser.add_argument("--csv", action="store_true",
+                        help="also export one CSV per FP3 position")
+    args = parser.parse_args()
+
+    with instrumentation.stage("normal_distribution_probability") as stage:
+        # round_trip reads back exactly the floats that were written
+        position_data = pd.read_csv(f"{INPUT_PATH}/position_summary.csv",
+                                    float_precision="round_trip")
+        stage["rows"] = len(position_data)
+        run(position_data, args.step, args.z_range, args.grid_size,
+            csv=args.csv)
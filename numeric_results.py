@@ -0,0 +1,95 @@
+"""
+    This script contains the code for saving figures in the numeric_results
+    text file. Every script has its own block in the file, which ends with
+    the "Obtained from ..." line. Saving a block replaces the previous block
+    of the same script instead of appending a new one, so running a script
+    again does not duplicate its results. Every block (and its figures, as
+    separate metrics) is also saved in the run history of results_store.py,
+    which can regenerate this file.
+
+    The scripts can be run at the same time by pipeline.py, which is why the
+    file is locked while it is being rewritten.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+from contextlib import contextmanager
+import os
+import time
+import results_store
+from atomic_write import atomic_write
+
+OUTPUT_PATH = "results"
+HEADER = "These are the results obtained during analysis:"
+SOURCE_PREFIX = "Obtained from "
+# A lock older than this is assumed to be left over from a crashed run
+LOCK_TIMEOUT = 10
+
+
+@contextmanager
+def _locked(path):
+    lock_path = f"{path}.lock"
+    waiting_since = time.monotonic()
+    while True:
+        try:
+            lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            # The lock is only broken if it has been held for longer than
+            # LOCK_TIMEOUT, and not just waited for that long. It may be
+            # released (or broken by another process) at any moment.
+            try:
+                stale = (time.time() - os.stat(lock_path).st_mtime >
+                         LOCK_TIMEOUT)
+                if stale and \
+                        time.monotonic() - waiting_since > LOCK_TIMEOUT:
+                    os.remove(lock_path)
+                    waiting_since = time.monotonic()
+            except FileNotFoundError:
+                pass
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(lock)
+        os.remove(lock_path)
+
+
+def read_blocks(path):
+    # Returns the lines of every block, keyed by the script it came from. If
+    # a script has more than one block, only the last one is kept.
+    blocks = {}
+    if not os.path.exists(path):
+        return blocks
+    lines = []
+    with open(path, "r") as results_file:
+        for line in results_file:
+            line = line.strip()
+            if not line or line == HEADER:
+                continue
+            if line.startswith(SOURCE_PREFIX):
+                blocks[line[len(SOURCE_PREFIX):].strip()] = lines
+                lines = []
+            else:
+                lines.append(line)
+    return blocks
+
+
+def format_blocks(blocks):
+    text = HEADER + "\n"
+    for source, lines in blocks.items():
+        text += "\n" + "\n".join(lines) + f"\n{SOURCE_PREFIX}{source}\n"
+    return text
+
+
+def write_block(source, lines, output_path=OUTPUT_PATH, metrics=None):
+    # metrics is a dictionary of the figures in the lines, by metric name
+    results_store.save_block(source, lines, metrics,
+                             f"{output_path}/results.sqlite")
+    path = f"{output_path}/numeric_results.txt"
+    with _locked(path):
+        blocks = read_blocks(path)
+        blocks[source] = lines
+        with atomic_write(path) as temp_path:
+            with open(temp_path, "w") as results_file:
+                results_file.write(format_blocks(blocks))
@@ -5,37 +5,161 @@
     calcualate the average Pearson Correlation across all races and save it
     in the numeric_results text file.
 
+    The correlations for all of the races are calculated at once: the sums
+    needed for the Pearson Correlation are accumulated per race with
+    np.bincount, so no Python loop over the races is needed. The same sums
+    are used for the per-season and the rolling-window correlations, which
+    are saved in pearson_season_table.csv and pearson_rolling_table.csv:
+
+        python pearson_correlation.py --per-season --window 10
+
     If you have any suggestions on how I can improve this code, feel free to
     open an issue on GitHub. I would love to hear your insight!
 """
-import os
+import argparse
+import numpy as np
 import pandas as pd
 from scipy import stats
-pearson_corr_df = pd.DataFrame(columns=["race_no",
-                                        "pearson_corr",
-                                        "p_value"])
-INPUT_PATH = "data/2014-2018"
+import instrumentation
+from numeric_results import write_block
+from race_store import TRAIN_SEASONS, load_store
+
+INPUT_PATH = "data/race_store.npy"
 OUTPUT_PATH = "results"
+SEASONS = TRAIN_SEASONS
+
+
+def _group_ids(keys):
+    # Returns the unique keys and the group id of every row. The race store
+    # is sorted by race number, in which case the ids can be found without
+    # sorting the keys again.
+    keys = np.asarray(keys)
+    if len(keys) and np.all(keys[1:] >= keys[:-1]):
+        new_group = np.concatenate(([True], keys[1:] != keys[:-1]))
+        return keys[new_group], np.cumsum(new_group) - 1
+    return np.unique(keys, return_inverse=True)
+
+
+def segment_moments(ids, x, y, group_count):
+    # Sums of x, y, x^2, y^2 and xy for every group. The positions are small
+    # integers, so these sums are exact in float64.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return np.stack([
+        np.bincount(ids, minlength=group_count).astype(np.float64),
+        np.bincount(ids, x, group_count),
+        np.bincount(ids, y, group_count),
+        np.bincount(ids, x * x, group_count),
+        np.bincount(ids, y * y, group_count),
+        np.bincount(ids, x * y, group_count),
+    ])
+
+
+def correlation_from_moments(moments):
+    # moments has the rows n, sum_x, sum_y, sum_xx, sum_yy, sum_xy, and any
+    # number of columns. Returns the Pearson Correlation and its two sided
+    # p-value (the same one as stats.pearsonr) for every column.
+    n, sum_x, sum_y, sum_xx, sum_yy, sum_xy = moments
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = n * sum_xy - sum_x * sum_y
+        var_x = n * sum_xx - sum_x * sum_x
+        var_y = n * sum_yy - sum_y * sum_y
+        r = np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0)
+
+        # Under the null hypothesis r follows a beta distribution on
+        # [-1, 1], which is how stats.pearsonr calculates the p-value
+        shape = n / 2 - 1
+        p = 2 * stats.beta.sf(np.abs(r), shape, shape, loc=-1, scale=2)
+        dof = n - 2
+    # With two points the correlation is always perfect, and stats.pearsonr
+    # reports a p-value of 1
+    p = np.where(dof == 0, 1.0, p)
+    p = np.where(dof < 0, np.nan, p)
+    return r, p
+
+
+def grouped_pearson(keys, x, y):
+    # Calculates the Pearson Correlation of x and y within each group of keys
+    groups, ids = _group_ids(keys)
+    r, p = correlation_from_moments(segment_moments(ids, x, y, len(groups)))
+    return groups, r, p
+
+
+def race_correlations(races):
+    race_numbers, r, p = grouped_pearson(races.race_no, races.fp3_pos,
+                                         races.race_pos)
+    return pd.DataFrame({"race_no": race_numbers, "pearson_corr": r,
+                         "p_value": p})
+
+
+def season_correlations(races):
+    # For every season I calculate the correlation of all of its rows
+    # together, as well as the average of the correlations of its races
+    seasons, r, p = grouped_pearson(races.season, races.fp3_pos,
+                                    races.race_pos)
+    race_numbers, race_r, _ = grouped_pearson(races.race_no, races.fp3_pos,
+                                              races.race_pos)
+    race_seasons = races.season[np.searchsorted(races.race_no,
+                                                race_numbers)]
+    race_ids = np.searchsorted(seasons, race_seasons)
+    mean_race_r = (np.bincount(race_ids, race_r, len(seasons)) /
+                   np.bincount(race_ids, minlength=len(seasons)))
+    return pd.DataFrame({"season": seasons, "pearson_corr": r, "p_value": p,
+                         "mean_race_corr": mean_race_r})
+
+
+def rolling_correlations(races, window):
+    # The correlation of all rows of each window of consecutive races. The
+    # window sums are differences of the cumulative per-race sums.
+    race_numbers, ids = _group_ids(races.race_no)
+    if not 0 < window <= len(race_numbers):
+        raise ValueError(f"The window has to be 1 to {len(race_numbers)} "
+                         f"races, got {window}")
+    moments = segment_moments(ids, races.fp3_pos, races.race_pos,
+                              len(race_numbers))
+    cumulative = np.concatenate((np.zeros((len(moments), 1)),
+                                 np.cumsum(moments, axis=1)), axis=1)
+    window_moments = cumulative[:, window:] - cumulative[:, :-window]
+    r, p = correlation_from_moments(window_moments)
+    return pd.DataFrame({"first_race_no": race_numbers[:len(r)],
+                         "last_race_no": race_numbers[window - 1:],
+                         "pearson_corr": r, "p_value": p})
+
 
-for file_name in os.listdir(f"{INPUT_PATH}"):
-    fp3_race = pd.read_csv(f"{INPUT_PATH}/{file_name}", index_col=0)
-    fp3_positions = fp3_race["fp3_pos"].tolist()
-    race_positions = fp3_race["race_pos"].tolist()
-    r, p = stats.pearsonr(fp3_positions, race_positions)
-    # int(file_name[:-4]) gets the race number
-    pearson_corr_df.loc[len(pearson_corr_df)] = [int(file_name[:-4]), r, p]
+def run(races, save=True, per_season=False, window=None):
+    # The correlation of every race in the analysed seasons. With save, the
+    # table and its average are also written to the output files, as well
+    # as the per-season and the rolling correlations if they are asked for.
+    races = races.select(seasons=SEASONS)
+    pearson_corr_df = race_correlations(races)
+    tables = {}
+    if per_season:
+        tables["pearson_season_table"] = season_correlations(races)
+    if window is not None:
+        tables["pearson_rolling_table"] = rolling_correlations(races, window)
+    if save:
+        pearson_corr_df.to_csv(f"{OUTPUT_PATH}/pearson_corr_table.csv",
+                               index=False)
+        for name, table in tables.items():
+            table.to_csv(f"{OUTPUT_PATH}/{name}.csv", index=False)
 
-pearson_corr_df.sort_values("race_no", inplace=True)
-pearson_corr_df.to_csv(f"{OUTPUT_PATH}/pearson_corr_table.csv", index=False)
+        average_corr = pearson_corr_df["pearson_corr"].mean()
+        write_block("pearson_correlation.py",
+                    ["FP3 Pos & Race Pos Pearson Corr: " + str(average_corr)],
+                    OUTPUT_PATH, {"pearson_corr": average_corr})
+    return pearson_corr_df
 
-average_corr = pearson_corr_df["pearson_corr"].mean()
 
-if not os.path.exists(f"{OUTPUT_PATH}/numeric_results.txt"):
-    with open(f"{OUTPUT_PATH}/numeric_results.txt", "w") as results_file:
-        results_file.write("These are the results obtained during analysis:\n")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--per-season", action="store_true",
+                        help="also save the correlation of every season")
+    parser.add_argument("--window", type=int, default=None,
+                        help="also save the correlations of every window "
+                             "of this many consecutive races")
+    args = parser.parse_args()
 
-with open(f"{OUTPUT_PATH}/numeric_results.txt", "a") as results_file:
-    results_file.write("\n\n")
-    results_file.write("FP3 Pos & Race Pos Pearson Corr: " + str(average_corr))
-    results_file.write("\n")
-    results_file.write("Obtained from pearson_correlation.py")
+    with instrumentation.stage("pearson_correlation") as stage:
+        races = load_store(INPUT_PATH).select(seasons=SEASONS)
+        stage["rows"] = len(races)
+        run(races, per_season=args.per_season, window=args.window)
@@ -0,0 +1,302 @@
+"""
+    This script runs the whole analysis in the right order:
+
+        position_summary -> normal_distribution_probability -> predictions
+        -> accuracy
+
+    and pearson_correlation, which does not depend on any of the others and
+    is therefore run at the same time as them. bootstrap runs once the
+    predictions are ready, race_simulation once position_summary is done,
+    and backtest (which runs the whole chain for every fold in memory) only
+    depends on the race store, like sweep (which evaluates the chain for
+    many different settings). The predictions and accuracy of the
+    simulated (race_simulation) and empirical (transition_model) models
+    are run as separate stages.
+
+    Every stage lists its inputs and outputs; the modules of this repository
+    which its script imports (directly or not) are found by scanning the
+    import statements, and are inputs as well. Before running a stage, its
+    inputs are fingerprinted by hashing their content, and the stage is
+    skipped if the fingerprint and its outputs are the same as after the
+    last run. The inputs can also be parts of the race store (e.g. only the
+    2019 races), so changing a 2019 race only re-runs the stages that use
+    the 2019 race positions. The fingerprints are kept in
+    results/pipeline_cache.json. The results of every run are saved in the
+    run history of results_store.py under one run ID.
+
+        python pipeline.py            (runs the stages that are out of date)
+        python pipeline.py --force    (runs every stage)
+        python pipeline.py --instrument   (also saves the timings, see
+                                           instrumentation.py)
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import ast
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+import instrumentation
+import results_store
+from atomic_write import atomic_write
+from race_store import (COLUMNS, STORE_PATH, TEST_SEASONS, TRAIN_SEASONS,
+                        load_store)
+
+CACHE_PATH = "results/pipeline_cache.json"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_imports(script):
+    # The modules of this repository imported by the script, by the modules
+    # it imports, and so on (including the imports inside functions)
+    directory = os.path.dirname(script)
+    found = set()
+    pending = [script]
+    while pending:
+        with open(pending.pop(), "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = os.path.join(directory, f"{name.split('.')[0]}.py")
+                if (path != script and path not in found and
+                        os.path.exists(path)):
+                    found.add(path)
+                    pending.append(path)
+    return sorted(found)
+
+
+class StoreSlice:
+
+    """
+        The StoreSlice class is an input which is only a part of the race
+        store: some of the columns of the races in the given seasons (every
+        season if seasons is None).
+    """
+
+    def __init__(self, seasons=None, columns=COLUMNS, path=STORE_PATH):
+        self.seasons = None if seasons is None else list(seasons)
+        self.columns = list(columns)
+        self.path = path
+
+    def __repr__(self):
+        return f"{self.path}[{self.seasons}, {self.columns}]"
+
+    def fingerprint(self):
+        races = load_store(self.path).select(seasons=self.seasons)
+        rows = races.data[[COLUMNS.index(name) for name in self.columns]]
+        return hashlib.sha256(rows.tobytes()).hexdigest()
+
+
+class Stage:
+
+    """
+        The Stage class describes how to run one of the scripts and which
+        files (or parts of the race store) it reads and writes.
+    """
+
+    def __init__(self, name, script, inputs, outputs, args=()):
+        self.name = name
+        self.script = script
+        # The script itself is an input, so changing the code re-runs it
+        self.inputs = [script] + list(inputs)
+        self.outputs = list(outputs)
+        self.args = list(args)
+
+    def file_inputs(self):
+        return [item for item in self.inputs if isinstance(item, str)]
+
+    def fingerprint(self):
+        digest = hashlib.sha256(" ".join(self.args).encode())
+        # The modules the script imports are inputs as well. They are only
+        # looked up now, since the paths are relative to where it is run.
+        for item in self.inputs + local_imports(self.script):
+            if isinstance(item, str):
+                digest.update(file_hash(item).encode())
+            else:
+                digest.update(item.fingerprint().encode())
+        return digest.hexdigest()
+
+    def output_hashes(self):
+        return {path: file_hash(path) if os.path.exists(path) else None
+                for path in self.outputs}
+
+    def run(self):
+        subprocess.run([sys.executable, self.script] + self.args, check=True)
+
+
+STAGES = [
+    Stage("pearson_correlation", "pearson_correlation.py",
+          inputs=[StoreSlice(TRAIN_SEASONS)],
+          outputs=["results/pearson_corr_table.csv"]),
+    Stage("position_summary", "position_summary.py",
+          inputs=[StoreSlice(TRAIN_SEASONS),
+                  # Only how many times each FP3 position finished is used
+                  StoreSlice(TEST_SEASONS, ["race_no", "fp3_pos"])],
+          outputs=["results/position_summary.csv",
+                   "results/position_accumulator.npz"]),
+    Stage("normal_distribution_probability",
+          "normal_distribution_probability.py",
+          inputs=["results/position_summary.csv"],
+          outputs=["results/probabilities_increments.npz",
+                   "results/probabilities_positions.npz"]),
+    Stage("race_simulation", "race_simulation.py",
+          inputs=["results/position_summary.csv"],
+          outputs=["results/probabilities_simulated.npz",
+                   "results/simulated_points.csv"]),
+    Stage("predictions", "predictions.py",
+          inputs=["results/probabilities_positions.npz"],
+          outputs=["results/predictions/predictions.csv"]),
+    Stage("accuracy", "accuracy.py",
+          inputs=["results/predictions/predictions.csv",
+                  StoreSlice(TEST_SEASONS,
+                             ["race_no", "fp3_pos", "race_pos"])],
+          outputs=["results/accuracy_files/metrics.csv",
+                   "results/accuracy_files/avg_diff.csv",
+                   "results/accuracy_files/corr_prob.csv",
+                   "results/accuracy_files/approx_prob.csv"]),
+    Stage("bootstrap", "bootstrap.py",
+          inputs=["results/predictions/predictions.csv",
+                  StoreSlice(TRAIN_SEASONS),
+                  StoreSlice(TEST_SEASONS,
+                             ["race_no", "fp3_pos", "race_pos"])],
+          outputs=["results/bootstrap_intervals.csv"]),
+    Stage("transition_model", "transition_model.py",
+          # The counts of every season are saved, not only of the training
+          # seasons
+          inputs=[StoreSlice(columns=["race_no", "season", "fp3_pos",
+                                      "race_pos"])],
+          outputs=["results/transition_counts.npz",
+                   "results/probabilities_empirical.npz"]),
+    Stage("drivers", "drivers.py",
+          inputs=["data/drivers.csv",
+                  StoreSlice(list(TRAIN_SEASONS) + TEST_SEASONS)],
+          outputs=["results/driver_summary.csv",
+                   "results/driver_position_summary.csv"]),
+    Stage("backtest", "backtest.py",
+          inputs=[StoreSlice(list(TRAIN_SEASONS) + TEST_SEASONS)],
+          outputs=["results/backtest_folds.csv",
+                   "results/backtest_summary.csv"]),
+    Stage("sweep", "sweep.py",
+          inputs=[StoreSlice(list(TRAIN_SEASONS) + TEST_SEASONS)],
+          outputs=["results/sweep_results.csv"]),
+]
+# The predictions and accuracy of the other models
+for model in ("simulated", "empirical"):
+    STAGES += [
+        Stage(f"predictions_{model}", "predictions.py",
+              inputs=[f"results/probabilities_{model}.npz"],
+              outputs=[f"results/predictions/predictions_{model}.csv"],
+              args=["--model", model]),
+        Stage(f"accuracy_{model}", "accuracy.py",
+              inputs=[f"results/predictions/predictions_{model}.csv",
+                      StoreSlice(TEST_SEASONS,
+                                 ["race_no", "fp3_pos", "race_pos"])],
+              outputs=[f"results/accuracy_files/{name}_{model}.csv"
+                       for name in ("metrics", "avg_diff", "corr_prob",
+                                    "approx_prob")],
+              args=["--model", model]),
+    ]
+
+
+def load_cache(path=CACHE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_cache(cache, path=CACHE_PATH):
+    with atomic_write(path) as temp_path:
+        with open(temp_path, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def run_stage(stage, cache, force=False):
+    fingerprint = stage.fingerprint()
+    previous = cache.get(stage.name, {})
+    if (not force and previous.get("inputs") == fingerprint and
+            previous.get("outputs") == stage.output_hashes()):
+        return "up to date"
+
+    start = time.perf_counter()
+    stage.run()
+    cache[stage.name] = {"inputs": fingerprint,
+                         "outputs": stage.output_hashes()}
+    seconds = time.perf_counter() - start
+    # The time of the whole script, including starting Python
+    instrumentation.record("pipeline", stage.name, seconds=seconds)
+    return f"ran in {seconds:.2f}s"
+
+
+def dependencies(stages):
+    # A stage depends on every stage that writes one of its inputs
+    producers = {output: stage.name for stage in stages
+                 for output in stage.outputs}
+    return {stage.name: {producers[item] for item in stage.file_inputs()
+                         if item in producers}
+            for stage in stages}
+
+
+def run(stages=STAGES, force=False, max_workers=None):
+    # Stages are started as soon as all of the stages they depend on have
+    # finished, so independent stages run at the same time
+    cache = load_cache()
+    required = dependencies(stages)
+    finished = set()
+    running = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            while len(finished) < len(stages):
+                for stage in stages:
+                    if (stage.name not in finished and
+                            stage not in running.values() and
+                            required[stage.name] <= finished):
+                        future = executor.submit(run_stage, stage, cache,
+                                                 force)
+                        running[future] = stage
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    print(f"{stage.name}: {future.result()}")
+                    finished.add(stage.name)
+    finally:
+        save_cache(cache)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force", action="store_true",
+                        help="run every stage, even if it is up to date")
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--instrument", nargs="?", metavar="PATH",
+                        const=instrumentation.OUTPUT_PATH,
+                        help="save the timings of every stage (JSON lines) "
+                             "and print a summary")
+    args = parser.parse_args()
+    if args.instrument:
+        instrumentation.enable(args.instrument)
+    # Every stage of this run saves its results under the same run ID
+    results_store.start_run()
+    run(force=args.force, max_workers=args.max_workers)
+    if args.instrument:
+        instrumentation.flush()
+        print(instrumentation.summary(args.instrument).to_string())
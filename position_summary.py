@@ -5,64 +5,221 @@
     the FP3 position and its mean finishing position, and save the figure in
     the numeric_results text file.
 
+    The statistics for each FP3 position are kept in an accumulator, which
+    stores the count, sum and sum of squared differences (M2) of the
+    finishing positions. The positions are small integers, so their sum is
+    exact and the mean is the same as np.mean's. The accumulator is saved
+    next to the summary, so a new race can be added without going through
+    all of the previous races again:
+
+        python position_summary.py            (rebuilds from the race store)
+        python position_summary.py --ingest 1021
+
     If you have any suggestions on how I can improve this code, feel free to
     open an issue on GitHub. I would love to hear your insight!
 """
+import argparse
 import os
 import pandas as pd
 import numpy as np
 from scipy import stats
+import instrumentation
+from atomic_write import atomic_write
+from numeric_results import write_block
+from race_store import GRID_SIZE, TEST_SEASONS, TRAIN_SEASONS, load_store
 
-INPUT_PATH = "data"
+INPUT_PATH = "data/race_store.npy"
 OUTPUT_PATH = "results"
+ACCUMULATOR_PATH = f"{OUTPUT_PATH}/position_accumulator.npz"
+
+
+class PositionAccumulator:
+
+    """
+        The PositionAccumulator class keeps the count, sum and M2 of the
+        finishing positions for every FP3 position, using Welford's method
+        for M2.
+        Races are added in batches, and two accumulators (e.g. for two
+        different seasons) can be merged into one.
+    """
+
+    def __init__(self, grid_size=GRID_SIZE):
+        self.count = np.zeros(grid_size, dtype=np.int64)
+        self.total = np.zeros(grid_size)
+        self.m2 = np.zeros(grid_size)
+
+    @property
+    def grid_size(self):
+        return len(self.count)
+
+    @property
+    def mean(self):
+        # Positions without any finishes have a mean of 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.nan_to_num(self.total / self.count)
+
+    @property
+    def std(self):
+        # np.std, i.e. the population standard deviation
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(self.m2 / self.count)
+
+    def update(self, fp3_pos, race_pos):
+        # The statistics of the new rows are calculated for every position at
+        # once with np.bincount, and then merged into the accumulator
+        batch = PositionAccumulator(self.grid_size)
+        index = np.asarray(fp3_pos, dtype=np.intp) - 1
+        race_pos = np.asarray(race_pos, dtype=np.float64)
+        batch.count = np.bincount(index, minlength=self.grid_size)
+        batch.total = np.bincount(index, race_pos, self.grid_size)
+        deviations = race_pos - batch.mean[index]
+        batch.m2 = np.bincount(index, deviations**2, self.grid_size)
+        return self.merge(batch)
+
+    def merge(self, other):
+        # Chan et al.'s formula for combining the mean and M2 of two sets
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        with np.errstate(divide="ignore", invalid="ignore"):
+            other_share = np.where(count > 0, other.count / count, 0.0)
+        self.m2 = (self.m2 + other.m2 +
+                   delta**2 * self.count * other_share)
+        self.total = self.total + other.total
+        self.count = count
+        return self
+
+    def to_arrays(self, prefix):
+        return {f"{prefix}_count": self.count, f"{prefix}_total": self.total,
+                f"{prefix}_m2": self.m2}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        accumulator = cls(len(arrays[f"{prefix}_count"]))
+        accumulator.count = arrays[f"{prefix}_count"]
+        accumulator.total = arrays[f"{prefix}_total"]
+        accumulator.m2 = arrays[f"{prefix}_m2"]
+        return accumulator
+
+
+class PositionState:
+
+    """
+        The PositionState class holds everything that position_summary.csv
+        is calculated from: the accumulator of the training races, the
+        accumulator of the test races (only the counts are used) and the
+        race numbers that have already been added, so a race is never
+        counted twice.
+    """
+
+    def __init__(self, grid_size=GRID_SIZE):
+        self.train = PositionAccumulator(grid_size)
+        self.test = PositionAccumulator(grid_size)
+        self.race_numbers = np.empty(0, dtype=np.int64)
+
+    def ingest(self, races, train_seasons=TRAIN_SEASONS,
+               test_seasons=TEST_SEASONS):
+        # Adds the races of a race store that have not been added yet. Races
+        # of seasons which are neither training nor test seasons are not
+        # counted, and are not marked as added either, so they can still be
+        # added if the seasons change.
+        new_rows = ~np.isin(races.race_no, self.race_numbers)
+        counted = np.zeros(len(new_rows), dtype=bool)
+        for seasons, accumulator in ((train_seasons, self.train),
+                                     (test_seasons, self.test)):
+            rows = new_rows & np.isin(races.season, list(seasons))
+            accumulator.update(races.fp3_pos[rows], races.race_pos[rows])
+            counted |= rows
+        self.race_numbers = np.union1d(self.race_numbers,
+                                       races.race_no[counted])
+        return self
+
+    def merge(self, other):
+        self.train.merge(other.train)
+        self.test.merge(other.test)
+        self.race_numbers = np.union1d(self.race_numbers, other.race_numbers)
+        return self
+
+    def save(self, path=ACCUMULATOR_PATH):
+        with atomic_write(path) as temp_path:
+            np.savez(temp_path, race_numbers=self.race_numbers,
+                     **self.train.to_arrays("train"),
+                     **self.test.to_arrays("test"))
+
+    @classmethod
+    def load(cls, path=ACCUMULATOR_PATH):
+        with np.load(path) as arrays:
+            state = cls(len(arrays["train_count"]))
+            state.train = PositionAccumulator.from_arrays(arrays, "train")
+            state.test = PositionAccumulator.from_arrays(arrays, "test")
+            state.race_numbers = arrays["race_numbers"]
+        return state
+
+
+def build_state(races, grid_size=GRID_SIZE, train_seasons=TRAIN_SEASONS,
+                test_seasons=TEST_SEASONS):
+    # Every season is accumulated on its own and the seasons are then merged,
+    # which gives the same result as adding all of the races at once
+    state = PositionState(grid_size)
+    for season in races.seasons():
+        season_state = PositionState(grid_size)
+        season_state.ingest(races.select(seasons=season), train_seasons,
+                            test_seasons)
+        state.merge(season_state)
+    return state
+
+
+def summarise(state):
+    # The test race amount is how many times the FP3 position finished the
+    # race in 2019, since we do not consider the position when the driver
+    # crashes or is disqualified.
+    race_amount = state.test.count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cl_var = state.train.std**2 / race_amount
+    return pd.DataFrame({
+        "position": np.arange(1, state.train.grid_size + 1),
+        "mean_finish_position": state.train.mean,
+        "std_finish_position": state.train.std,
+        "race_amount": race_amount,
+        "cl_var_finish_position": cl_var,
+    }, dtype=float)
+
+
+def save_summary(summary_df):
+    with atomic_write(f"{OUTPUT_PATH}/position_summary.csv") as temp_path:
+        summary_df.to_csv(temp_path, index=False)
+
+    fp3_position_list = summary_df["position"].values.tolist()
+    avg_race_position = summary_df["mean_finish_position"].values.tolist()
+    corr, _ = stats.pearsonr(fp3_position_list, avg_race_position)
+
+    write_block("position_summary.py",
+                ["FP3 Pos & Mean Race Pos Pearson Corr: " + str(corr)],
+                OUTPUT_PATH, {"mean_position_corr": corr})
+
+
+def run(state, save=True):
+    # The summary of the accumulated races. With save, the state is saved
+    # for --ingest and the summary is written to position_summary.csv.
+    summary_df = summarise(state)
+    if save:
+        state.save()
+        save_summary(summary_df)
+    return summary_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ingest", type=int, nargs="+", metavar="RACE_NO",
+                        help="add these races to the saved accumulator "
+                             "instead of rebuilding it")
+    args = parser.parse_args()
 
-# Dictionairy where we will store the data
-data_dict = {}
-
-result_columns = ["position", "mean_finish_position", "std_finish_position",
-                  "race_amount", "cl_var_finish_position"]
-summary_df = pd.DataFrame(columns=result_columns)
-
-for position in range(1, 21):
-    # The first item in the list will contain all of the finishing positions
-    # The second item in the list will contain how many times the FP3 position
-    # finished the race in 2019, since we do not consider the position
-    # when the driver crashes or is disqualified.
-    data_dict[position] = [[], 0]
-
-for file in os.listdir(f"{INPUT_PATH}/2014-2018"):
-    # Getting the finishing positions:
-    fp3_race = pd.read_csv(f"{INPUT_PATH}/2014-2018/{file}", index_col=0)
-    for fp3_pos, race_pos in zip(fp3_race["fp3_pos"].values,
-                                 fp3_race["race_pos"].values):
-        data_dict[fp3_pos][0].append(race_pos)
-
-for file in os.listdir(f"{INPUT_PATH}/2019"):
-    # Getting how many times the position finished in 2019
-    fp3_race = pd.read_csv(f"{INPUT_PATH}/2019/{file}", index_col=0)
-    for fp3_pos in fp3_race["fp3_pos"].values:
-        data_dict[fp3_pos][1] += 1
-
-for position, data in data_dict.items():
-    # Calculating the data to be saved
-    avg_race_position = np.mean(data[0])
-    race_std = np.std(data[0])
-    race_cl_var = race_std**2 / data[1]
-    row = [position, avg_race_position, race_std, data[1], race_cl_var]
-    summary_df.loc[len(summary_df)] = row
-
-summary_df.to_csv(f"{OUTPUT_PATH}/position_summary.csv", index=False)
-
-fp3_position_list = summary_df["position"].values.tolist()
-avg_race_position = summary_df["mean_finish_position"].values.tolist()
-corr, _ = stats.pearsonr(fp3_position_list, avg_race_position)
-
-if not os.path.exists(f"{OUTPUT_PATH}/numeric_results.txt"):
-    with open(f"{OUTPUT_PATH}/numeric_results.txt", "w") as results_file:
-        results_file.write("These are the results obtained during analysis:\n")
-
-with open(f"{OUTPUT_PATH}/numeric_results.txt", "a") as results_file:
-    results_file.write("\n")
-    results_file.write("FP3 Pos & Mean Race Pos Pearson Corr: " + str(corr))
-    results_file.write("\n")
-    results_file.write("Obtained from position_summary.py \n")
+    with instrumentation.stage("position_summary") as stage:
+        races = load_store(INPUT_PATH)
+        stage["rows"] = len(races)
+        if args.ingest and os.path.exists(ACCUMULATOR_PATH):
+            state = PositionState.load().ingest(
+                races.select(races=args.ingest))
+        else:
+            state = build_state(races)
+        run(state)
@@ -0,0 +1,243 @@
+"""
+    This script keeps the predictions in memory, so what-if scenarios can be
+    answered without running the scripts again. The probabilities of the
+    chosen model (see predictions.py) and position_summary.csv are loaded
+    once, and the race order predicted by every method is worked out once
+    for each grid size. A scenario is then only a lookup: given the FP3
+    classification (the drivers in FP3 order), the service returns the
+    predicted race order of every method and the distribution of the race
+    position of every driver.
+
+    Many scenarios with the same number of drivers are answered at once, by
+    indexing an array with one row per scenario. When the model files
+    change (e.g. after pipeline.py has run), they are loaded again before
+    the next request.
+
+    The service can be used from Python:
+
+        service = PredictionService()
+        service.predict(["VER", "HAM", "BOT", ...])
+
+    or over HTTP on a local port:
+
+        python prediction_service.py --port 8050
+        curl -d '{"fp3": ["VER", "HAM", "BOT"]}' localhost:8050/predict
+        curl -d '{"scenarios": [["VER", ...], ...]}' localhost:8050/predict
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import http.server
+import json
+import os
+import threading
+import zipfile
+import numpy as np
+import pandas as pd
+from predictions import (DEFAULT_MODEL, MODELS, PREDICTORS,
+                         load_probabilities, predict)
+
+SUMMARY_PATH = "results/position_summary.csv"
+HOST = "127.0.0.1"
+PORT = 8050
+
+
+class ModelState:
+
+    """
+        The ModelState class holds everything loaded from the model files.
+        It is never changed after it is created; a reload creates a new one,
+        so a request always sees a consistent model.
+    """
+
+    def __init__(self, probabilities_path, summary_path, predictors):
+        self.paths = (probabilities_path, summary_path)
+        self.modified = [os.stat(path).st_mtime_ns for path in self.paths]
+        self.probabilities = load_probabilities(probabilities_path)
+        self.mean_finish = pd.read_csv(
+            summary_path, float_precision="round_trip")[
+            "mean_finish_position"].values
+        if len(self.mean_finish) != len(self.probabilities):
+            raise ValueError(f"{summary_path} has {len(self.mean_finish)} "
+                             f"positions, the probabilities have "
+                             f"{len(self.probabilities)}")
+        self.predictors = predictors
+        self.grids = {}
+        self.lock = threading.Lock()
+
+    def is_stale(self):
+        try:
+            return [os.stat(path).st_mtime_ns
+                    for path in self.paths] != self.modified
+        except FileNotFoundError:
+            # The files are being replaced; keep using the loaded ones
+            return False
+
+    def grid(self, driver_count):
+        # Returns the probabilities of a grid of driver_count drivers, and
+        # for every method the FP3 position index of each race position.
+        # These only depend on the number of drivers, so they are worked out
+        # once per grid size.
+        with self.lock:
+            if driver_count not in self.grids:
+                self.grids[driver_count] = self._build_grid(driver_count)
+            return self.grids[driver_count]
+
+    def _build_grid(self, driver_count):
+        if not 0 < driver_count <= len(self.probabilities):
+            raise ValueError(f"Expected 1 to {len(self.probabilities)} "
+                             f"drivers, got {driver_count}")
+        probabilities = self.probabilities[:driver_count, :driver_count]
+        # The distributions are normalized over the race positions of the
+        # grid
+        distributions = probabilities / probabilities.sum(axis=1,
+                                                          keepdims=True)
+        orders = {}
+        for name, predictions in predict(probabilities,
+                                         self.predictors).items():
+            if name == "f(x)":
+                # f(x) is indexed by race position already
+                orders[name] = predictions - 1
+            else:
+                # Sorting the FP3 positions by their predicted race position;
+                # ties are broken by the FP3 position
+                orders[name] = np.argsort(predictions, kind="stable")
+        return distributions, orders
+
+
+class PredictionService:
+
+    """
+        The PredictionService class answers the scenarios. It can be shared
+        by several threads.
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, summary_path=SUMMARY_PATH,
+                 predictors=PREDICTORS, probabilities_path=None):
+        # The probabilities of the model are read from MODELS[model], unless
+        # another path is given
+        if probabilities_path is None:
+            probabilities_path = MODELS[model]
+        self.probabilities_path = probabilities_path
+        self.summary_path = summary_path
+        self.predictors = predictors
+        self.state = self._load()
+
+    def _load(self):
+        return ModelState(self.probabilities_path, self.summary_path,
+                          self.predictors)
+
+    def reload_if_changed(self):
+        # If the new files cannot be loaded (e.g. a script is still writing
+        # them), the loaded model is kept, and loading is tried again on the
+        # next request
+        if self.state.is_stale():
+            try:
+                self.state = self._load()
+            except (OSError, EOFError, ValueError, KeyError,
+                    zipfile.BadZipFile):
+                pass
+        return self.state
+
+    def predict_batch(self, scenarios):
+        # scenarios has one row per scenario, with the drivers in FP3 order.
+        # Returns the distributions (row i belongs to the driver in FP3
+        # position i + 1 of every scenario) and, for every method, an array
+        # with the drivers of each scenario in predicted race order.
+        scenarios = np.asarray(scenarios)
+        if scenarios.ndim != 2:
+            raise ValueError("Every scenario needs the same number of "
+                             "drivers")
+        state = self.reload_if_changed()
+        distributions, orders = state.grid(scenarios.shape[1])
+        race_orders = {name: scenarios[:, order]
+                       for name, order in orders.items()}
+        return distributions, race_orders
+
+    def predict(self, fp3_classification):
+        # The answer for a single scenario, as plain Python objects
+        state = self.reload_if_changed()
+        drivers = list(fp3_classification)
+        distributions, orders = state.grid(len(drivers))
+        return {
+            "race_order": {name: [drivers[i] for i in order]
+                           for name, order in orders.items()},
+            "drivers": {driver: {
+                "fp3_position": i + 1,
+                "mean_finish_position": float(state.mean_finish[i]),
+                "distribution": distributions[i].tolist()}
+                for i, driver in enumerate(drivers)},
+        }
+
+    def predict_many(self, scenarios):
+        # The answers for many scenarios, as plain Python objects. Scenarios
+        # with the same number of drivers are predicted together, and share
+        # their distributions, which are returned once per number of drivers
+        # (row i belongs to the driver in FP3 position i + 1).
+        answers = [None] * len(scenarios)
+        by_size = {}
+        for i, scenario in enumerate(scenarios):
+            by_size.setdefault(len(scenario), []).append(i)
+        distributions = {}
+        for size, indexes in by_size.items():
+            batch = np.empty((len(indexes), size), dtype=object)
+            batch[:] = [scenarios[i] for i in indexes]
+            size_distributions, race_orders = self.predict_batch(batch)
+            distributions[size] = size_distributions.tolist()
+            race_orders = {name: orders.tolist()
+                           for name, orders in race_orders.items()}
+            for row, i in enumerate(indexes):
+                answers[i] = {name: orders[row]
+                              for name, orders in race_orders.items()}
+        return answers, distributions
+
+
+def make_server(service, host=HOST, port=PORT):
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/predict":
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                if "scenarios" in request:
+                    race_orders, distributions = service.predict_many(
+                        request["scenarios"])
+                    answer = {"race_orders": race_orders,
+                              "distributions": distributions}
+                else:
+                    answer = service.predict(request["fp3"])
+            except (ValueError, KeyError, TypeError) as error:
+                self.send_error(400, str(error))
+                return
+            body = json.dumps(answer).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=MODELS, default=DEFAULT_MODEL)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    server = make_server(PredictionService(args.model), args.host, args.port)
+    print(f"Serving predictions on http://{args.host}:{args.port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,58 +1,151 @@
 """
-    The script below assigns predictions based on the probability in the
-    results/probabilities_positions directory. The predictions are assigned
+    The script below assigns predictions based on the probabilities in the
+    results/probabilities_positions.npz file. The predictions are assigned
     using three methods, denoted as s(x), f(x), and g(x). You can find the
     descriptions for each of the methods in the paper.
 
+    I have also added a fourth method, h(x), which assigns every FP3 position
+    a different race position so that the total log-probability of the
+    assignment is as high as possible (the linear sum assignment problem).
+    Unlike f(x), which picks the positions greedily one at a time, h(x) finds
+    the best assignment overall.
+
+    Every method works on a probability matrix of any size, where
+    probabilities[..., fp3_pos - 1, race_pos - 1] is the probability of the
+    FP3 position finishing in race_pos. Any leading dimensions are treated as
+    a batch of matrices, so predictions for thousands of grids are one call.
+
+    The probabilities can come from the normal model (the default), the
+    simulated races of race_simulation.py or the counts of
+    transition_model.py:
+
+        python predictions.py --model empirical
+
+    The predictions of any model other than the normal one are saved in
+    predictions_<model>.csv.
+
     If you have any suggestions on how I can improve this code, feel free to
     open an issue on GitHub. I would love to hear your insight!
 """
+import argparse
+import numpy as np
 import pandas as pd
 import os
+from scipy import optimize
+import instrumentation
 
-INPUT_PATH = "results/probabilities_positions"
-predictions_df = pd.DataFrame(columns=["position", "s(x)", "f(x)", "g(x)"])
+INPUT_PATH = "results/probabilities_positions.npz"
 OUTPUT_PATH = "results"
+# The probability files of every model
+MODELS = {
+    "normal": INPUT_PATH,
+    "simulated": "results/probabilities_simulated.npz",
+    "empirical": "results/probabilities_empirical.npz",
+}
+DEFAULT_MODEL = "normal"
+
+
+def sx_predictions(probabilities):
+    # s(x): every FP3 position is predicted to finish where it started
+    probabilities = np.asarray(probabilities)
+    positions = np.arange(1, probabilities.shape[-2] + 1)
+    return np.broadcast_to(positions, probabilities.shape[:-1]).copy()
+
+
+def fx_predictions(probabilities):
+    # f(x): going through the race positions in order, the available FP3
+    # position which is the likeliest to finish in that race position is
+    # picked and removed. Note that the result is indexed by race position:
+    # predictions[..., race_pos - 1] is the FP3 position assigned to it.
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    batch_shape = probabilities.shape[:-2]
+    fp3_count, race_count = probabilities.shape[-2:]
+    available = np.ones(batch_shape + (fp3_count,), dtype=bool)
+    predictions = np.zeros(batch_shape + (race_count,), dtype=np.int64)
+    for race_pos in range(race_count):
+        candidates = np.where(available, probabilities[..., race_pos],
+                              -np.inf)
+        # np.argmax picks the smallest FP3 position in case of a tie
+        best_position = np.argmax(candidates, axis=-1)
+        np.put_along_axis(available, best_position[..., np.newaxis], False,
+                          axis=-1)
+        predictions[..., race_pos] = best_position + 1
+    return predictions
+
+
+def gx_predictions(probabilities):
+    # g(x): every FP3 position is predicted to finish in its likeliest race
+    # position, even if other FP3 positions are predicted there as well
+    return np.argmax(probabilities, axis=-1) + 1
+
+
+def hx_predictions(probabilities):
+    # h(x): the assignment of FP3 positions to different race positions with
+    # the highest total log-probability
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    # Probabilities of zero are clipped so that the logarithm stays finite
+    log_probabilities = np.log(np.maximum(probabilities,
+                                          np.finfo(np.float64).tiny))
+    matrices = log_probabilities.reshape((-1,) + probabilities.shape[-2:])
+    predictions = np.zeros(matrices.shape[:2], dtype=np.int64)
+    for i, matrix in enumerate(matrices):
+        fp3_index, race_index = optimize.linear_sum_assignment(matrix,
+                                                               maximize=True)
+        predictions[i, fp3_index] = race_index + 1
+    return predictions.reshape(probabilities.shape[:-1])
+
+
+PREDICTORS = {
+    "s(x)": sx_predictions,
+    "f(x)": fx_predictions,
+    "g(x)": gx_predictions,
+    "h(x)": hx_predictions,
+}
+
+
+def predict(probabilities, predictors=PREDICTORS):
+    # Returns the predictions of each method for a matrix, or for a batch of
+    # matrices
+    return {name: predictor(probabilities)
+            for name, predictor in predictors.items()}
+
 
-if not os.path.isdir(f"{OUTPUT_PATH}/predictions"):
-    os.mkdir(f"{OUTPUT_PATH}/predictions")
+def predictions_frame(probabilities, predictors=PREDICTORS):
+    predictions = predict(probabilities, predictors)
+    positions = np.arange(1, np.shape(probabilities)[-2] + 1)
+    return pd.DataFrame({"position": positions, **predictions})
 
-available_positions = list(range(1, 21))
-fx_predictions = []
 
-for race_pos in range(1, 21):
-    # Getting f(x) predictions
-    maximum_probability = 0
-    best_position = 0
+def load_probabilities(path=INPUT_PATH):
+    with np.load(path) as probabilities_file:
+        return probabilities_file["probability"]
 
-    # Calculating which available fp3 position is the likeliest to finish
-    # in race_pos
-    for fp3_pos in available_positions:
-        probabilities_df = pd.read_csv(f"{INPUT_PATH}/{fp3_pos}.0.csv")
-        pos_df = probabilities_df[probabilities_df["position"] == race_pos]
-        probability = pos_df["probability"].values.tolist()[0]
-        if probability > maximum_probability:
-            maximum_probability = probability
-            best_position = fp3_pos
 
-    available_positions.remove(best_position)
-    fx_predictions.append(best_position)
+def predictions_path(model=DEFAULT_MODEL):
+    if model == DEFAULT_MODEL:
+        return f"{OUTPUT_PATH}/predictions/predictions.csv"
+    return f"{OUTPUT_PATH}/predictions/predictions_{model}.csv"
 
-gx_predictions = []
 
-for fp3_position in range(1, 21):
-    # Getting g(x) predictions
-    probabilities_df = pd.read_csv(f"{INPUT_PATH}/{fp3_position}.0.csv",
-                                   index_col=0)
-    probabilities = probabilities_df["probability"].values.tolist()
-    highest_probability = max(probabilities)
-    gx_prediction = probabilities.index(highest_probability) + 1
-    gx_predictions.append(gx_prediction)
+def run(probabilities, model=DEFAULT_MODEL, save=True):
+    # The predictions of every method. With save, they are also written to
+    # the predictions file of the model.
+    predictions_df = predictions_frame(probabilities)
+    if save:
+        if not os.path.isdir(f"{OUTPUT_PATH}/predictions"):
+            os.mkdir(f"{OUTPUT_PATH}/predictions")
+        predictions_df.to_csv(predictions_path(model), index=False)
+    return predictions_df
 
 
-for sx, fx, gx in zip(range(1, 21), fx_predictions, gx_predictions):
-    # Populating the dataframe for each position
-    predictions_df.loc[len(predictions_df)] = [sx, sx, fx, gx]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=MODELS, default=DEFAULT_MODEL,
+                        help="which probabilities to make the predictions "
+                             "from")
+    args = parser.parse_args()
 
-predictions_df.to_csv(f"{OUTPUT_PATH}/predictions/predictions.csv",
-                      index=False)
+    with instrumentation.stage("predictions") as stage:
+        probabilities = load_probabilities(MODELS[args.model])
+        stage["rows"] = len(probabilities)
+        run(probabilities, args.model)
@@ -0,0 +1,118 @@
+"""
+    This script simulates complete races using the statistics in
+    position_summary.csv. The normal model in
+    normal_distribution_probability.py gives every FP3 position its own
+    probabilities, without taking into account that two drivers cannot
+    finish in the same position. Here, every simulated race draws a score
+    for each FP3 position from a normal distribution with the mean and
+    standard deviation of its finishing positions, and the finishing order
+    is the order of the scores. Each simulated race is therefore a proper
+    finishing order.
+
+    The races are simulated in chunks, so the memory used does not depend
+    on the number of simulations: every chunk is an array of scores with
+    one row per race, which is sorted with a single np.argsort, and the
+    finishing positions are counted with np.bincount. The chunks can also be
+    spread across several processes; every chunk has its own seed, so the
+    result does not depend on the number of processes.
+
+    The probabilities are saved in probabilities_simulated.npz (in the same
+    layout as probabilities_positions.npz), and the expected points of every
+    FP3 position in simulated_points.csv.
+
+        python race_simulation.py --simulations 1000000 --processes 4
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import instrumentation
+from atomic_write import atomic_write
+
+INPUT_PATH = "results"
+OUTPUT_PATH = "results"
+SIMULATIONS = 1_000_000
+CHUNK_SIZE = 100_000
+SEED = 2019
+# The points for the Top 10 positions since 2010
+POINTS = np.array([25, 18, 15, 12, 10, 8, 6, 4, 2, 1])
+
+
+def simulate_chunk(seed, race_count, means, stds):
+    # Returns counts[fp3_pos - 1, race_pos - 1] for race_count simulated
+    # races
+    rng = np.random.default_rng(seed)
+    position_count = len(means)
+    scores = rng.normal(means, stds, (race_count, position_count))
+    # order[i, race_pos - 1] is the FP3 position (- 1) finishing in race_pos
+    order = np.argsort(scores, axis=1)
+    cells = order * position_count + np.arange(position_count)
+    counts = np.bincount(cells.ravel(), minlength=position_count**2)
+    return counts.reshape(position_count, position_count)
+
+
+def simulate(means, stds, simulations=SIMULATIONS, chunk_size=CHUNK_SIZE,
+             seed=SEED, processes=1):
+    # Returns the (FP3 position x race position) probability matrix
+    means = np.asarray(means, dtype=np.float64)
+    stds = np.asarray(stds, dtype=np.float64)
+    chunks = [min(chunk_size, simulations - start)
+              for start in range(0, simulations, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    arguments = (seeds, chunks, [means] * len(chunks), [stds] * len(chunks))
+    if processes > 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            counts = sum(executor.map(simulate_chunk, *arguments))
+    else:
+        counts = sum(map(simulate_chunk, *arguments))
+    return counts / simulations
+
+
+def expected_points(probabilities, points=POINTS):
+    # The expected points of every FP3 position
+    points = np.concatenate((points, np.zeros(
+        max(0, probabilities.shape[-1] - len(points)))))
+    return probabilities @ points[:probabilities.shape[-1]]
+
+
+def points_table(probabilities, points=POINTS):
+    return pd.DataFrame({
+        "position": np.arange(1, len(probabilities) + 1),
+        "expected_points": expected_points(probabilities, points),
+        "prob_win": probabilities[:, 0],
+        "prob_podium": probabilities[:, :3].sum(axis=1),
+        "prob_points": probabilities[:, :len(points)].sum(axis=1),
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--simulations", type=int, default=SIMULATIONS)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="number of races simulated at a time")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    with instrumentation.stage("race_simulation",
+                               simulations=args.simulations) as stage:
+        position_data = pd.read_csv(f"{INPUT_PATH}/position_summary.csv",
+                                    float_precision="round_trip")
+        stage["rows"] = len(position_data)
+        probabilities = simulate(
+            position_data["mean_finish_position"].values,
+            position_data["std_finish_position"].values, args.simulations,
+            args.chunk_size, args.seed, args.processes)
+
+        fp3_positions = position_data["position"].values
+        with atomic_write(f"{OUTPUT_PATH}/probabilities_simulated.npz"
+                          ) as temp_path:
+            np.savez(temp_path, fp3_positions=fp3_positions,
+                     race_positions=np.arange(1, len(fp3_positions) + 1,
+                                              dtype=np.float64),
+                     probability=probabilities)
+        points_table(probabilities).to_csv(
+            f"{OUTPUT_PATH}/simulated_points.csv", index=False)
@@ -0,0 +1,248 @@
+"""
+    This script contains the race store, which keeps the FP3 and race results
+    of every race in a single file instead of one CSV per race. Every row is
+    stored as five small integer columns (race_no, season, driver, fp3_pos,
+    race_pos), and the columns are laid out one after another in a single
+    .npy file, so the whole history can be loaded with one read or memory
+    mapped.
+
+    The driver is stored as its ID in the driver table (data/drivers.csv,
+    see drivers.py), which keeps the full name and the three letter code of
+    every driver. The code alone is not enough, since different drivers can
+    share it (e.g. Max Verstappen and Jean-Eric Vergne are both VER). Rows
+    are kept sorted by race number, which lets me find the rows of any race
+    or season with a binary search instead of a scan.
+
+    Running this script imports the existing per-race CSVs in data/2014-2018
+    and data/2019 into the store. This only has to be done once; after that
+    the scrapers update the store directly.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import csv
+import os
+import numpy as np
+import pandas as pd
+from atomic_write import atomic_write
+
+# Constants:
+STORE_PATH = "data/race_store.npy"
+DRIVERS_PATH = "data/drivers.csv"
+LINKS_PATH = "data/links.csv"
+CSV_FOLDERS = ("data/2014-2018", "data/2019")
+# The 2014-2018 seasons are used for analysis, while the 2019 season is used
+# in order to evaluate the predictions
+TRAIN_SEASONS = range(2014, 2019)
+TEST_SEASONS = [2019]
+# There were only 20 racers in the 2019 season
+GRID_SIZE = 20
+
+COLUMNS = ("race_no", "season", "driver", "fp3_pos", "race_pos")
+DTYPE = np.int16
+# Used instead of DTYPE if a value (e.g. a race number) does not fit in it
+WIDE_DTYPE = np.int32
+
+
+def parse_link(link):
+    # The links look like .../results.html/2014/races/898/australia/, so the
+    # season and the race number are the two numbers around "races/". The
+    # race numbers are not strictly consistent on the website, which is why
+    # I read them from the links instead of creating a range.
+    parts = link.rstrip("/").split("/")
+    races_index = parts.index("races")
+    return int(parts[races_index - 1]), int(parts[races_index + 1])
+
+
+def read_seasons(path_to_links=LINKS_PATH):
+    # Maps every race number in the links file to its season
+    seasons = {}
+    with open(path_to_links, "r") as f:
+        for row in csv.reader(f):
+            season, race_number = parse_link(row[0])
+            seasons[race_number] = season
+    return seasons
+
+
+class RaceStore:
+
+    """
+        The RaceStore class wraps the columns of the store. The columns are
+        plain NumPy arrays (or memory maps), so they can be used directly in
+        vectorized code. The race and season indexes are computed from the
+        sorted race_no column when they are first needed.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._race_index = None
+        self._season_index = None
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __getattr__(self, name):
+        # Allows store.fp3_pos, store.race_pos, etc.
+        if name in COLUMNS:
+            return self.data[COLUMNS.index(name)]
+        raise AttributeError(name)
+
+    @classmethod
+    def from_frames(cls, frames, seasons, drivers):
+        # frames maps a race number to a DataFrame with the driver, fp3_pos
+        # and race_pos columns, like the ones produced by the scrapers.
+        # Drivers which are not in the driver table yet are added to it.
+        columns = [[] for _ in COLUMNS]
+        for race_number in sorted(frames):
+            frame = frames[race_number]
+            row_count = len(frame)
+            columns[0].append(np.full(row_count, race_number))
+            columns[1].append(np.full(row_count, seasons[race_number]))
+            columns[2].append(drivers.add_drivers(frame["driver"]).ids(
+                frame["driver"]))
+            columns[3].append(frame["fp3_pos"].values)
+            columns[4].append(frame["race_pos"].values)
+        data = np.empty((len(COLUMNS), sum(map(len, columns[0]))),
+                        np.int64)
+        for i, column in enumerate(columns):
+            if column:
+                data[i] = np.concatenate(column)
+        return cls(data.astype(store_dtype(data)))
+
+    @property
+    def race_index(self):
+        # Returns the race numbers and the offsets of their rows; the rows of
+        # races[i] are data[:, offsets[i]:offsets[i + 1]]
+        if self._race_index is None:
+            self._race_index = self._build_index(self.race_no)
+        return self._race_index
+
+    @property
+    def season_index(self):
+        if self._season_index is None:
+            self._season_index = self._build_index(self.season)
+        return self._season_index
+
+    @staticmethod
+    def _build_index(column):
+        column = np.asarray(column)
+        starts = np.flatnonzero(np.diff(column)) + 1
+        offsets = np.concatenate(([0], starts, [len(column)]))
+        keys = column[offsets[:-1]] if len(column) else column[:0]
+        return keys, offsets
+
+    def races(self):
+        return self.race_index[0]
+
+    def seasons(self):
+        return self.season_index[0]
+
+    def race(self, race_number):
+        races, offsets = self.race_index
+        i = np.searchsorted(races, race_number)
+        if i == len(races) or races[i] != race_number:
+            raise KeyError(race_number)
+        return RaceStore(self.data[:, offsets[i]:offsets[i + 1]])
+
+    def select(self, seasons=None, races=None):
+        # Returns a store holding only the given seasons and/or races. Since
+        # the rows are sorted by race number, a contiguous season range is a
+        # slice of the data and does not copy it.
+        selected = self
+        if seasons is not None:
+            keys, offsets = self.season_index
+            found = np.flatnonzero(np.isin(keys, np.atleast_1d(seasons)))
+            if len(found) == 0:
+                selected = RaceStore(self.data[:, :0])
+            elif found[-1] - found[0] + 1 == len(found):
+                start, stop = offsets[found[0]], offsets[found[-1] + 1]
+                selected = RaceStore(self.data[:, start:stop])
+            else:
+                mask = np.isin(self.season, np.atleast_1d(seasons))
+                selected = RaceStore(self.data[:, mask])
+        if races is not None:
+            mask = np.isin(selected.race_no, np.atleast_1d(races))
+            selected = RaceStore(selected.data[:, mask])
+        return selected
+
+    def iter_races(self):
+        races, offsets = self.race_index
+        for i, race_number in enumerate(races):
+            yield race_number, RaceStore(
+                self.data[:, offsets[i]:offsets[i + 1]])
+
+    def to_frame(self, drivers=None):
+        # With the driver table, the driver IDs are replaced by the driver
+        # strings of the website
+        frame = pd.DataFrame({name: self.data[i]
+                              for i, name in enumerate(COLUMNS)})
+        if drivers is not None:
+            frame["driver"] = [drivers.driver(driver_id)
+                               for driver_id in frame["driver"]]
+        return frame
+
+    def replace_races(self, other):
+        # Returns a new store with the races of other added, replacing any
+        # races that are already present
+        keep = ~np.isin(self.race_no, other.races())
+        data = np.concatenate((self.data[:, keep], other.data), axis=1)
+        # A stable sort keeps the order of the rows within each race
+        order = np.argsort(data[0], kind="stable")
+        return RaceStore(data[:, order])
+
+
+def store_dtype(data):
+    # DTYPE, unless one of the values does not fit in it. Converting to a
+    # type which is too small would silently wrap the values around.
+    if data.size == 0:
+        return DTYPE
+    low, high = data.min(), data.max()
+    for dtype in (DTYPE, WIDE_DTYPE):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    raise OverflowError(f"The values from {low} to {high} do not fit in "
+                        f"the race store")
+
+
+def load_store(path=STORE_PATH, mmap=True):
+    # Loading the whole history is a single read (or a memory map)
+    return RaceStore(np.load(path, mmap_mode="r" if mmap else None))
+
+
+def save_store(store, path=STORE_PATH):
+    with atomic_write(path) as temp_path:
+        np.save(temp_path, np.ascontiguousarray(
+            store.data, dtype=store_dtype(store.data)))
+
+
+def update_store(frames, seasons, drivers, path=STORE_PATH):
+    # Adds the scraped races to the store, replacing older copies of them.
+    # The driver table has to be saved as well if new drivers were added.
+    new_races = RaceStore.from_frames(frames, seasons, drivers)
+    if os.path.exists(path):
+        new_races = load_store(path, mmap=False).replace_races(new_races)
+    save_store(new_races, path)
+    return new_races
+
+
+def import_csvs(folders=CSV_FOLDERS, path_to_links=LINKS_PATH,
+                path=STORE_PATH, drivers_path=DRIVERS_PATH):
+    # Imported here, since drivers imports this module
+    from drivers import DriverTable
+    seasons = read_seasons(path_to_links)
+    frames = {}
+    for folder in folders:
+        for file_name in os.listdir(folder):
+            # int(file_name[:-4]) gets the race number
+            frames[int(file_name[:-4])] = pd.read_csv(f"{folder}/{file_name}")
+    drivers = DriverTable.load(drivers_path)
+    store = RaceStore.from_frames(frames, seasons, drivers)
+    drivers.save(drivers_path)
+    save_store(store, path)
+    return store
+
+
+if __name__ == '__main__':
+    store = import_csvs()
+    print(f"Imported {len(store.races())} races ({len(store)} rows) "
+          f"into {STORE_PATH}")
@@ -0,0 +1,232 @@
+"""
+    This script contains the run history of the analysis: every block that
+    is saved in the numeric_results text file is also saved in a SQLite
+    database (results/results.sqlite), together with its figures as
+    separate metrics, so the runs can be compared with each other without
+    diffing text.
+
+    Every row is keyed by the run ID, the stage (the script), the hash of
+    its configuration (the arguments in the "Obtained from ..." line) and
+    the metric name. The scripts run by the same pipeline.py run share a
+    run ID through the F1_RUN_ID environment variable; a script run on its
+    own gets a run ID of its own. Everything a stage saves is inserted in a
+    single transaction.
+
+        python results_store.py history "g(x).avg_diff" --last 50
+        python results_store.py report       (rewrites numeric_results.txt
+                                              from the latest blocks)
+        python results_store.py report --run 20191201-120000-1a2b3c4d
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+import uuid
+import pandas as pd
+from atomic_write import atomic_write
+
+OUTPUT_PATH = "results"
+DATABASE_PATH = f"{OUTPUT_PATH}/results.sqlite"
+RUN_ID_VARIABLE = "F1_RUN_ID"
+# Seconds to wait for a stage which is saving at the same time
+TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    source TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    lines TEXT NOT NULL,
+    PRIMARY KEY (run_id, stage, config_hash)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, stage, config_hash, metric)
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE INDEX IF NOT EXISTS blocks_source ON blocks (source, saved_at);
+CREATE INDEX IF NOT EXISTS metrics_metric
+    ON metrics (metric, stage, config_hash, run_id);
+"""
+
+_run_id = None
+
+
+def new_run_id():
+    # The date and time of the start of the run, followed by a random part;
+    # the order of the runs is kept by their started_at
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def run_id():
+    # The run ID of this process: the one of the pipeline.py run it is part
+    # of, or a new one
+    global _run_id
+    if _run_id is None:
+        _run_id = os.environ.get(RUN_ID_VARIABLE) or new_run_id()
+    return _run_id
+
+
+def start_run(path=DATABASE_PATH):
+    # Used by pipeline.py, so every script it runs saves under the same ID.
+    # The run is recorded with the time it started, before any stage saves.
+    global _run_id
+    _run_id = new_run_id()
+    os.environ[RUN_ID_VARIABLE] = _run_id
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute("INSERT INTO runs VALUES (?, ?)",
+                               (_run_id, time.time()))
+    finally:
+        connection.close()
+    return _run_id
+
+
+def split_source(source):
+    # "accuracy.py --model empirical" -> stage "accuracy", the arguments
+    # and the hash of the arguments
+    script, _, config = source.partition(" ")
+    stage = os.path.splitext(script)[0]
+    config_hash = hashlib.sha256(config.strip().encode()).hexdigest()[:16]
+    return stage, config.strip(), config_hash
+
+
+def connect(path=DATABASE_PATH):
+    connection = sqlite3.connect(path, timeout=TIMEOUT)
+    # Write-ahead logging, so reading does not block the stages saving
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def save_block(source, lines, metrics=None, path=DATABASE_PATH):
+    stage, _, config_hash = split_source(source)
+    current_run = run_id()
+    now = time.time()
+    connection = connect(path)
+    try:
+        with connection:
+            # A script run on its own (and not by pipeline.py) starts its
+            # run with its first block
+            connection.execute(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?)", (current_run, now))
+            connection.execute(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                (current_run, stage, config_hash, source, now,
+                 "\n".join(lines)))
+            connection.executemany(
+                "INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?)",
+                [(current_run, stage, config_hash, name, float(value))
+                 for name, value in (metrics or {}).items()])
+    finally:
+        connection.close()
+
+
+def history(metric, stage=None, config=None, last=50, path=DATABASE_PATH):
+    # The values of a metric in the last runs which saved anything, newest
+    # first
+    query = ("SELECT metrics.run_id, runs.started_at, blocks.source, "
+             "metrics.value FROM metrics "
+             "JOIN runs ON runs.run_id = metrics.run_id "
+             "JOIN blocks USING (run_id, stage, config_hash) "
+             "WHERE metrics.metric = ? AND metrics.run_id IN "
+             "(SELECT run_id FROM runs WHERE run_id IN "
+             "(SELECT run_id FROM blocks) ORDER BY started_at DESC LIMIT ?)")
+    parameters = [metric, last]
+    if stage is not None:
+        query += " AND metrics.stage = ?"
+        parameters.append(stage)
+    if config is not None:
+        query += " AND metrics.config_hash = ?"
+        parameters.append(split_source(f"_ {config}")[2])
+    query += " ORDER BY runs.started_at DESC, blocks.source"
+    connection = connect(path)
+    try:
+        table = pd.read_sql_query(query, connection, params=parameters)
+    finally:
+        connection.close()
+    table["started_at"] = pd.to_datetime(table["started_at"], unit="s")
+    return table
+
+
+def latest_blocks(run=None, path=DATABASE_PATH):
+    # The lines of the newest block of every source (up to and including the
+    # given run, i.e. of the runs started no later than it), in the order
+    # the sources were first saved
+    query = ("SELECT source, lines FROM blocks AS block "
+             "WHERE saved_at = (SELECT MAX(saved_at) FROM blocks "
+             "JOIN runs USING (run_id) WHERE source = block.source{}) "
+             "ORDER BY (SELECT MIN(saved_at) FROM blocks "
+             "WHERE source = block.source)")
+    parameters = []
+    if run is not None:
+        query = query.format(" AND runs.started_at <= ?")
+    else:
+        query = query.format("")
+    connection = connect(path)
+    try:
+        if run is not None:
+            started_at = connection.execute(
+                "SELECT started_at FROM runs WHERE run_id = ?",
+                (run,)).fetchone()
+            if started_at is None:
+                raise ValueError(f"Unknown run {run}")
+            parameters.append(started_at[0])
+        rows = connection.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+    return {source: lines.split("\n") for source, lines in rows}
+
+
+def write_report(run=None, path=DATABASE_PATH, output_path=OUTPUT_PATH):
+    # Imported here, since numeric_results imports this module
+    from numeric_results import format_blocks, read_blocks
+    report_path = f"{output_path}/numeric_results.txt"
+    if run is not None:
+        # Only what was saved up to the run, and nothing of the later runs
+        blocks = latest_blocks(run, path)
+    else:
+        # The blocks already in the report keep their place, and are kept
+        # as they are if they are not in the run history
+        blocks = read_blocks(report_path)
+        blocks.update(latest_blocks(path=path))
+    with atomic_write(report_path) as temp_path:
+        with open(temp_path, "w") as results_file:
+            results_file.write(format_blocks(blocks))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    history_parser = subparsers.add_parser("history")
+    history_parser.add_argument("metric")
+    history_parser.add_argument("--stage")
+    history_parser.add_argument("--config",
+                                help="the arguments of the stage, e.g. "
+                                     "\"--model empirical\"")
+    history_parser.add_argument("--last", type=int, default=50)
+    report_parser = subparsers.add_parser("report")
+    report_parser.add_argument("--run", help="the run to report (the "
+                                             "latest blocks by default)")
+    args = parser.parse_args()
+
+    if args.command == "history":
+        print(history(args.metric, args.stage, args.config,
+                      args.last).to_string(index=False))
+    else:
+        write_report(args.run)
@@ -0,0 +1,119 @@
+"""
+    This script contains the extractor for the results table of a page on the
+    Formula 1 website. pd.read_html parses the whole page and builds a
+    DataFrame for every table on it, while the scrapers only need the Driver
+    and Pos columns of the first table.
+
+    The extractor jumps straight to the first table of the page and streams
+    through its table, row and cell tags with a regular expression, keeping
+    only the driver and the position of every row. The positions go straight
+    into an integer array, and the rows which are not classified (NC, DQ,
+    EX) are left out, as are rows without a driver and a position (such as
+    spacer rows). Parsing stops as soon as the table ends.
+
+    The driver names are cleaned up in the same way as pd.read_html does it,
+    so the result is identical to the one of process_data in
+    scraping_race_data.py; scraper_benchmark.py --check-extractor compares
+    the two on every page, and tests/test_results_table.py on the pages in
+    tests/pages.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import html
+import re
+import numpy as np
+import pandas as pd
+
+INVALID_POSITIONS = frozenset({"NC", "DQ", "EX"})
+# The same whitespace clean up as pd.read_html
+WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+# Only the Top 20 positions are considered, since there were only 20 racers
+# in the 2019 season
+MAX_POSITION = 20
+TAG = re.compile(r"<[^>]*>")
+TABLE_TAG = re.compile(r"<(/?)(table|tr|td|th)\b[^>]*>", re.IGNORECASE)
+
+
+def _cell_text(cell_html):
+    # The text of a cell without its tags, cleaned up like pd.read_html
+    text = html.unescape(TAG.sub("", cell_html))
+    return WHITESPACE.sub(" ", text.strip())
+
+
+def extract_results(page, invalid_positions=INVALID_POSITIONS):
+    # Returns the drivers and their positions in the first table of the page.
+    # Only the table, row and cell tags are looked at, one after the other,
+    # and the page after the end of the table is never parsed.
+    start = page.find(b"<table")
+    if start == -1:
+        raise ValueError("No table found")
+    text = page[start:].decode("utf-8", errors="replace")
+
+    depth = 0
+    rows = []
+    row = None
+    cell_start = None
+    for tag in TABLE_TAG.finditer(text):
+        closing, name = tag.group(1), tag.group(2).lower()
+        if name == "table":
+            depth += -1 if closing else 1
+            if depth == 0:
+                break
+            continue
+        if depth != 1:
+            # Nested tables are skipped
+            continue
+        if cell_start is not None:
+            # A cell ends at its closing tag, or at the next cell or row
+            row.append(_cell_text(text[cell_start:tag.start()]))
+            cell_start = None
+        if name == "tr":
+            # A row ends at its closing tag, or at the next row
+            if row:
+                rows.append(row)
+            row = None if closing else []
+        elif not closing and row is not None:
+            cell_start = tag.end()
+    if row:
+        rows.append(row)
+
+    if not rows:
+        raise ValueError("No results table found")
+    # The first row is the header
+    driver_column, pos_column = rows[0].index("Driver"), rows[0].index("Pos")
+    drivers = []
+    positions = []
+    for row in rows[1:]:
+        # Rows which are too short to hold both columns (e.g. spacer rows,
+        # or a single cell spanning the table) are not results
+        if len(row) <= max(driver_column, pos_column):
+            continue
+        if row[pos_column] not in invalid_positions:
+            drivers.append(row[driver_column])
+            positions.append(int(row[pos_column]))
+    return drivers, np.array(positions, dtype=np.int16)
+
+
+def extract_race(fp3_page, race_page, invalid_positions=INVALID_POSITIONS):
+    # The FP3 and race positions of every driver who was classified in both
+    # sessions, in the FP3 order (like merging the two tables on the driver)
+    fp3_drivers, fp3_positions = extract_results(fp3_page,
+                                                 invalid_positions)
+    race_drivers, race_positions = extract_results(race_page,
+                                                   invalid_positions)
+    race_index = {}
+    for i, driver in enumerate(race_drivers):
+        race_index.setdefault(driver, []).append(i)
+
+    drivers, fp3_pos, race_pos = [], [], []
+    for driver, fp3_position in zip(fp3_drivers, fp3_positions):
+        for i in race_index.get(driver, ()):
+            if fp3_position <= MAX_POSITION and \
+                    race_positions[i] <= MAX_POSITION:
+                drivers.append(driver)
+                fp3_pos.append(fp3_position)
+                race_pos.append(race_positions[i])
+    return pd.DataFrame({"driver": drivers,
+                         "fp3_pos": np.array(fp3_pos, dtype=np.int16),
+                         "race_pos": np.array(race_pos, dtype=np.int16)})
@@ -0,0 +1,98 @@
+"""
+    This script contains the scrape manifest, which records what happened to
+    every race the last time it was scraped: whether it succeeded or failed,
+    a checksum of the rows saved in the race store and when it was scraped.
+
+    The scrapers use it to only fetch the races which are new, which failed
+    last time or whose rows in the race store do not match their checksum
+    any more. The manifest is saved after every batch of races written to
+    the race store, so a scrape which crashes halfway through carries on
+    from where it stopped the next time it is run. Adding the next race
+    weekend to links.csv therefore only costs the two pages of that race.
+
+    If there is no manifest yet, the races which are already in the race
+    store are treated as scraped successfully.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from atomic_write import atomic_write
+
+MANIFEST_PATH = "data/scrape_manifest.json"
+OK = "ok"
+FAILED = "failed"
+
+
+def race_checksum(race):
+    # The checksum of the rows of a race in the race store
+    data = np.ascontiguousarray(race.data)
+    return hashlib.sha256(data.tobytes()).hexdigest()
+
+
+def store_checksums(store):
+    return {int(race_number): race_checksum(race)
+            for race_number, race in store.iter_races()}
+
+
+class ScrapeManifest:
+
+    """
+        The ScrapeManifest class keeps one entry per race number. Every
+        change is only kept in memory until save() is called, which replaces
+        the file atomically.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                # JSON keys are strings, the race numbers are integers
+                self.entries = {int(race_number): entry
+                                for race_number, entry in json.load(f).items()}
+
+    def status(self, race_number):
+        return self.entries.get(race_number, {}).get("status")
+
+    def mark_ok(self, race_number, checksum):
+        self.entries[race_number] = {"status": OK, "checksum": checksum,
+                                     "scraped_at": time.time()}
+
+    def mark_failed(self, race_number, error):
+        # The checksum of the last successful scrape is kept, if any
+        entry = self.entries.get(race_number, {})
+        self.entries[race_number] = {"status": FAILED,
+                                     "checksum": entry.get("checksum"),
+                                     "scraped_at": time.time(),
+                                     "error": str(error)}
+
+    def pending(self, race_numbers, checksums):
+        # Returns the race numbers which have to be scraped. checksums maps
+        # the races in the race store to the checksums of their rows.
+        pending = []
+        for race_number in race_numbers:
+            entry = self.entries.get(race_number)
+            if entry is None and race_number in checksums:
+                # Scraped before the manifest existed
+                self.mark_ok(race_number, checksums[race_number])
+            elif (entry is None or entry["status"] != OK or
+                    entry["checksum"] != checksums.get(race_number)):
+                pending.append(race_number)
+        return pending
+
+    def failed(self):
+        return sorted(race_number
+                      for race_number, entry in self.entries.items()
+                      if entry["status"] == FAILED)
+
+    def save(self):
+        with atomic_write(self.path) as temp_path:
+            with open(temp_path, "w") as f:
+                json.dump({str(race_number): self.entries[race_number]
+                           for race_number in sorted(self.entries)},
+                          f, indent=2)
@@ -0,0 +1,445 @@
+"""
+    This script benchmarks the scrapers in scraping_race_data.py against a
+    local stand-in for the Formula 1 website, so that the scrapers can be
+    compared without depending on (or hammering) the real website.
+
+    The stand-in server serves the result pages recorded with --record (in
+    data/recorded_pages). For races which were not recorded, a page in the
+    same layout is generated from the race store. Every response can be
+    delayed (--latency, --jitter), and a share of the requests can be
+    answered with an error (--error-rate). Like the real website, every
+    page has an ETag, and a request with a matching If-None-Match header is
+    answered with a 304.
+
+    Each scraper runs in its own process, so that its peak memory can be
+    measured on its own. For every run I report:
+    - pages/sec over the whole run, counting only the pages of the races
+      which were scraped, and how many races failed;
+    - the p50 and p99 latency of a race, from the first request for its
+      pages until the last response (measured by the server);
+    - the peak RSS of the scraper process (including its child processes).
+    The time it takes to parse a page is measured separately, and
+    --check-extractor checks that the results table extractor gives the
+    same results as pd.read_html on every page.
+
+    Every scraper run starts with an empty response cache which treats
+    every season as unfinished, so every page is downloaded; the local hits
+    and revalidations of the cache are not part of the benchmark (they are
+    covered by tests/test_http_cache.py).
+
+    The results are saved as JSON lines, and can be compared to a previous
+    run with --baseline, which fails if any scraper got noticeably slower:
+
+        python scraper_benchmark.py --latency 0.05 --workers 1 5 10 20
+        python scraper_benchmark.py --baseline results/scraper_benchmark.jsonl
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import collections
+import csv
+import hashlib
+import http.server
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+from drivers import DriverTable
+from race_store import (DRIVERS_PATH, LINKS_PATH, STORE_PATH, load_store,
+                        parse_link)
+import scraping_race_data
+
+PAGES_PATH = "data/recorded_pages"
+OUTPUT_PATH = "results/scraper_benchmark.jsonl"
+SESSIONS = ("practice-3.html", "race-result.html")
+# A run is a regression if its throughput drops by more than this share
+REGRESSION_TOLERANCE = 0.2
+
+
+def record_pages(path_to_links=LINKS_PATH, pages_path=PAGES_PATH):
+    # Downloads the real result pages once, so the benchmark can serve them
+    session = requests.Session()
+    with open(path_to_links, "r") as f:
+        links = [row[0] for row in csv.reader(f)]
+    for link in links:
+        _, race_number = parse_link(link)
+        os.makedirs(f"{pages_path}/{race_number}", exist_ok=True)
+        for extension in SESSIONS:
+            response = session.get(link + extension)
+            response.raise_for_status()
+            with open(f"{pages_path}/{race_number}/{extension}", "wb") as f:
+                f.write(response.content)
+
+
+def render_page(race, extension, drivers, padding=100_000):
+    # Generates a result page in the layout of the Formula 1 website. The
+    # classified drivers are followed by a driver who was not classified,
+    # and the page is padded with markup to roughly the size of a real page.
+    positions = race.fp3_pos if extension == SESSIONS[0] else race.race_pos
+    rows = []
+    for position, driver in sorted(zip(positions.tolist(),
+                                       race.driver.tolist())):
+        first_name, _, last_name = drivers.names[driver].partition(" ")
+        code = drivers.code(driver)
+        rows.append(
+            f"<tr><td class=\"limiter\"></td><td class=\"dark\">{position}"
+            f"</td><td class=\"dark hide-for-mobile\">{driver % 100}</td>"
+            f"<td class=\"dark bold\">\n<span class=\"hide-for-tablet\">"
+            f"{first_name}</span>\n<span class=\"hide-for-mobile\">"
+            f"{last_name}</span>\n<span class=\"uppercase "
+            f"hide-for-desktop\">{code}</span>\n</td><td class=\"semi-bold "
+            f"uppercase hide-for-tablet\">Team</td><td class=\"dark bold\">"
+            f"1:23.456</td><td class=\"limiter\"></td></tr>")
+    rows.append("<tr><td class=\"limiter\"></td><td class=\"dark\">NC</td>"
+                "<td>99</td><td>\n<span>Not</span>\n<span>Classified</span>"
+                "\n<span>NCL</span>\n</td><td>Team</td><td>DNF</td>"
+                "<td class=\"limiter\"></td></tr>")
+    filler = "<li><a href=\"/en/latest.html\">Latest</a></li>" * (
+        padding // 45)
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        "<title>Results</title></head><body>"
+        f"<nav><ul>{filler}</ul></nav>"
+        "<table class=\"resultsarchive-table\"><thead><tr>"
+        "<th class=\"limiter\"></th><th>Pos</th><th>No</th><th>Driver</th>"
+        "<th>Car</th><th>Time</th><th class=\"limiter\"></th></tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table></body></html>").encode()
+
+
+class StandInServer:
+
+    """
+        The StandInServer class serves the result pages on a local port. It
+        runs in a background thread, and every request is handled in its own
+        thread, so that the delays of concurrent requests overlap like they
+        would on the real website.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 pages_path=PAGES_PATH, store_path=STORE_PATH,
+                 drivers_path=DRIVERS_PATH, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pages_path = pages_path
+        self.store = load_store(store_path)
+        self.drivers = DriverTable.load(drivers_path)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pages = {}
+        # How many responses were sent with each status code
+        self.status_counts = collections.Counter()
+        # For every race, the time of its first request and last response
+        self.race_times = {}
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                     Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def page(self, race_number, extension):
+        key = (race_number, extension)
+        if key not in self.pages:
+            recorded = f"{self.pages_path}/{race_number}/{extension}"
+            if os.path.exists(recorded):
+                with open(recorded, "rb") as f:
+                    self.pages[key] = f.read()
+            else:
+                self.pages[key] = render_page(self.store.race(race_number),
+                                              extension, self.drivers)
+        return self.pages[key]
+
+    def handle(self, request):
+        start = time.perf_counter()
+        try:
+            path = request.path.rstrip("/")
+            _, race_number = parse_link(path)
+            extension = path.rsplit("/", 1)[1]
+            body = self.page(race_number, extension)
+        except (ValueError, KeyError):
+            request.send_error(404)
+            return
+
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+            first, last = self.race_times.get(race_number, (start, start))
+            self.race_times[race_number] = (min(first, start), last)
+        time.sleep(delay)
+        etag = f"\"{hashlib.md5(body).hexdigest()}\""
+        if failed:
+            status = 503
+        elif request.headers.get("If-None-Match") == etag:
+            status = 304
+        else:
+            status = 200
+        # Counted before the response is sent, so the count is up to date
+        # as soon as the client has its response
+        with self.lock:
+            self.status_counts[status] += 1
+        if status == 503:
+            request.send_error(status)
+        else:
+            request.send_response(status)
+            request.send_header("ETag", etag)
+            if status == 200:
+                request.send_header("Content-Type", "text/html")
+                request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            if status == 200:
+                request.wfile.write(body)
+        with self.lock:
+            first, last = self.race_times[race_number]
+            self.race_times[race_number] = (first,
+                                            max(last, time.perf_counter()))
+
+    def race_latencies(self):
+        with self.lock:
+            times = list(self.race_times.values())
+            self.race_times = {}
+        return np.array([last - first for first, last in times])
+
+
+def write_links(path, base_url, path_to_links=LINKS_PATH):
+    # The links of the real website, pointed at the stand-in server
+    with open(path_to_links, "r") as f:
+        links = [row[0] for row in csv.reader(f)]
+    with open(path, "w") as f:
+        for link in links:
+            f.write(link.replace("https://www.formula1.com", base_url) + "\n")
+    return len(links)
+
+
+def run_scraper(name, links_path, output_path, workers):
+    # Runs in a separate process; prints the wall time and peak RSS.
+    # Every run starts with an empty cache, and no season counts as
+    # finished, so every page is downloaded and then always revalidated
+    cache = scraping_race_data.ResponseCache(
+        f"{output_path}/http_cache", season_finished=lambda season: False)
+    scraper_class = getattr(scraping_race_data, name)
+    if name == "ThreadingScraper":
+        scraper = scraper_class(links_path, output_path, cache,
+                                max_workers=workers)
+    elif name == "AsyncScraper":
+        scraper = scraper_class(links_path, output_path, cache,
+                                max_concurrency=workers)
+    else:
+        scraper = scraper_class(links_path, output_path, cache)
+    start = time.perf_counter()
+    scraper.scrape()
+    wall_time = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Only the pages of the races which were scraped count, since the pages
+    # of the failed races were not (all) downloaded
+    failed_races = len(scraper.failed)
+    print(json.dumps({"wall_time": wall_time, "peak_rss_kb": peak_rss,
+                      "pages": 2 * (len(scraper.links) - failed_races),
+                      "failed_races": failed_races}))
+
+
+def parse_time(server, repeats=3):
+    # The average time it takes to parse the two pages of a race
+    races = server.store.races()
+    pages = [(server.page(race, SESSIONS[0]), server.page(race, SESSIONS[1]))
+             for race in races]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for fp3_data, race_data in pages:
+            scraping_race_data.parse_pages(fp3_data, race_data,
+                                           {"NC", "DQ", "EX"})
+    return (time.perf_counter() - start) / (repeats * len(pages))
+
+
+def check_extractor(server):
+    # Checks that the results table extractor gives the same result as
+    # pd.read_html on every page, and compares how long the two take
+    invalid_positions = {"NC", "DQ", "EX"}
+    times = {"read_html": 0.0, "extractor": 0.0}
+    mismatches = []
+    for race in server.store.races():
+        pages = (server.page(race, SESSIONS[0]),
+                 server.page(race, SESSIONS[1]))
+        start = time.perf_counter()
+        expected = scraping_race_data.read_html_pages(*pages,
+                                                      invalid_positions)
+        times["read_html"] += time.perf_counter() - start
+        start = time.perf_counter()
+        extracted = scraping_race_data.parse_pages(*pages, invalid_positions)
+        times["extractor"] += time.perf_counter() - start
+
+        expected = expected.reset_index(drop=True)
+        same = (expected["driver"].tolist() == extracted["driver"].tolist()
+                and np.array_equal(expected["fp3_pos"], extracted["fp3_pos"])
+                and np.array_equal(expected["race_pos"],
+                                   extracted["race_pos"]))
+        if not same:
+            mismatches.append(race)
+    race_count = len(server.store.races())
+    print(f"read_html: {times['read_html'] / race_count * 1000:.2f} ms/race, "
+          f"extractor: {times['extractor'] / race_count * 1000:.2f} ms/race")
+    if mismatches:
+        print(f"Different results for races: {mismatches}")
+    return not mismatches
+
+
+def benchmark(configurations, latency, jitter, error_rate):
+    results = []
+    with StandInServer(latency, jitter, error_rate) as server, \
+            tempfile.TemporaryDirectory() as temp_path:
+        links_path = f"{temp_path}/links.csv"
+        write_links(links_path, server.url)
+        race_parse_time = parse_time(server)
+        for name, workers in configurations:
+            output_path = f"{temp_path}/{name}_{workers}"
+            os.makedirs(output_path)
+            completed = subprocess.run(
+                [sys.executable, __file__, "--run-scraper", name,
+                 "--links", links_path, "--scraper-output", output_path,
+                 "--workers", str(workers)],
+                capture_output=True, text=True)
+            latencies = server.race_latencies()
+            result = {"scraper": name, "workers": workers,
+                      "latency": latency, "jitter": jitter,
+                      "error_rate": error_rate,
+                      "race_parse_time": race_parse_time,
+                      "timestamp": time.time()}
+            results.append(result)
+            if completed.returncode != 0:
+                # The scraper itself crashed (a race which could not be
+                # downloaded or parsed only counts as a failed race)
+                result["error"] = completed.stderr.strip().splitlines()[-1]
+                print(f"{name} ({workers} workers): failed, "
+                      f"{result['error']}")
+                continue
+
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            result.update({
+                "pages": run["pages"], "failed_races": run["failed_races"],
+                "wall_time": run["wall_time"],
+                "pages_per_sec": run["pages"] / run["wall_time"],
+                "race_latency_p50": float(np.percentile(latencies, 50)),
+                "race_latency_p99": float(np.percentile(latencies, 99)),
+                "peak_rss_kb": run["peak_rss_kb"],
+            })
+            print(f"{name} ({workers} workers): "
+                  f"{results[-1]['pages_per_sec']:.1f} pages/sec, "
+                  f"{run['failed_races']} failed races, "
+                  f"p50 {results[-1]['race_latency_p50'] * 1000:.0f} ms, "
+                  f"p99 {results[-1]['race_latency_p99'] * 1000:.0f} ms, "
+                  f"{run['peak_rss_kb'] / 1024:.0f} MB")
+    return results
+
+
+def regressions(results, baseline_path, tolerance=REGRESSION_TOLERANCE):
+    # Compares the throughput to the last baseline run with the same settings
+    baseline = {}
+    with open(baseline_path, "r") as f:
+        for line in f:
+            run = json.loads(line)
+            key = (run["scraper"], run["workers"], run["latency"],
+                   run["jitter"], run["error_rate"])
+            if "error" not in run:
+                baseline[key] = run["pages_per_sec"]
+    slower = []
+    for run in results:
+        key = (run["scraper"], run["workers"], run["latency"],
+               run["jitter"], run["error_rate"])
+        if "error" in run:
+            slower.append((key, baseline.get(key, 0.0), 0.0))
+        elif key in baseline and \
+                run["pages_per_sec"] < (1 - tolerance) * baseline[key]:
+            slower.append((key, baseline[key], run["pages_per_sec"]))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="delay of every response in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="random extra delay of up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of the requests answered with a 503")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 5, 10, 20],
+                        help="worker counts for ThreadingScraper and "
+                             "concurrency limits for AsyncScraper")
+    parser.add_argument("--scrapers", nargs="+",
+                        default=["StandardScraper", "ThreadingScraper",
+                                 "AsyncScraper"])
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--baseline", default=None,
+                        help="JSON lines of an earlier run to compare to")
+    parser.add_argument("--record", action="store_true",
+                        help="download the real pages into " + PAGES_PATH)
+    parser.add_argument("--check-extractor", action="store_true",
+                        help="compare the results table extractor to "
+                             "pd.read_html on every page")
+    parser.add_argument("--run-scraper", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--links", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--scraper-output", default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scraper:
+        run_scraper(args.run_scraper, args.links, args.scraper_output,
+                    args.workers[0])
+        sys.exit()
+    if args.record:
+        record_pages()
+        sys.exit()
+    if args.check_extractor:
+        with StandInServer() as server:
+            sys.exit(0 if check_extractor(server) else 1)
+
+    configurations = []
+    for name in args.scrapers:
+        if name == "StandardScraper":
+            configurations.append((name, 1))
+        else:
+            configurations += [(name, workers) for workers in args.workers]
+    results = benchmark(configurations, args.latency, args.jitter,
+                        args.error_rate)
+
+    with open(args.output, "a") as f:
+        for run in results:
+            f.write(json.dumps(run) + "\n")
+
+    if args.baseline:
+        slower = regressions(results, args.baseline)
+        for key, before, after in slower:
+            print(f"Regression in {key}: {before:.1f} -> {after:.1f} "
+                  f"pages/sec")
+        if slower:
+            sys.exit(1)
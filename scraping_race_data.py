@@ -6,29 +6,91 @@
     the beginning of the turbo hybrid era (2014) until 2019 inclusive.
 
     The 2014-2018 data will be used for analysis, while the 2019 data will
-    be used in order to evaluate my predictions models; this is why the data
-    for the two time periods is stored in separate folders.
+    be used in order to evaluate my predictions models. All of the races are
+    saved in the race store (see race_store.py) together with their season,
+    so the two time periods can be selected from there.
+
+    Every scrape is recorded in the scrape manifest (see scrape_manifest.py),
+    so only the races which are new or failed last time are fetched, and an
+    interrupted scrape carries on where it stopped.
 
     If you have any suggestions on how I can improve this code, feel free to
     open an issue on GitHub. I would love to hear your insight!
 """
 from abc import ABC, abstractmethod
+import argparse
 import requests
 import pandas as pd
 import csv
+import io
 import aiohttp
 import asyncio
-import concurrent
+import concurrent.futures
+import random
+import os
 import threading
+import time
+import instrumentation
+from drivers import update_driver_table
+from http_cache import ResponseCache
+from race_store import load_store, parse_link, update_store
+from results_table import extract_race
+from scrape_manifest import ScrapeManifest, race_checksum, store_checksums
 
 # Constants:
 INPUT_PATH = "data/links.csv"
 OUTPUT_PATH = "data"
+# The number of scraped races written to the race store at a time
+FLUSH_EVERY = 10
+
+
+def process_data(fp3_df, race_df, invalid_positions):
+    # The function processes the data to only contain what that we require
+    fp3_df = fp3_df[["Driver", "Pos"]]
+    fp3_df = fp3_df[~fp3_df["Pos"].isin(invalid_positions)]
+    fp3_df["Pos"] = fp3_df["Pos"].astype(int)
+
+    race_df = race_df[["Driver", "Pos"]]
+    race_df = race_df[~race_df["Pos"].isin(invalid_positions)]
+    race_df["Pos"] = race_df["Pos"].astype(int)
+
+    fp3_race = fp3_df.merge(race_df, on="Driver")
+    fp3_race.columns = ["driver", "fp3_pos", "race_pos"]
+
+    fp3_race = fp3_race[(fp3_race["fp3_pos"] <= 20) &
+                        (fp3_race["race_pos"] <= 20)]
+    # The reason why I am only considering the Top 20 positions is because
+    # there were only 20 racers in the 2019 season.
+    return fp3_race
+
+
+def read_html_pages(fp3_data, race_data, invalid_positions):
+    # Parses the pages with pd.read_html, which is how the data used to be
+    # scraped; scraper_benchmark.py compares it to parse_pages
+    fp3_df = pd.read_html(io.BytesIO(fp3_data))[0]
+    race_df = pd.read_html(io.BytesIO(race_data))[0]
+    return process_data(fp3_df, race_df, invalid_positions)
+
+
+def parse_pages(fp3_data, race_data, invalid_positions):
+    # Parses the downloaded FP3 and race pages. Only the results tables are
+    # read (see results_table.py). This is a module level function so that
+    # it can be run in a separate process.
+    return extract_race(fp3_data, race_data, frozenset(invalid_positions))
+
+
+def timed_parse_pages(fp3_data, race_data, invalid_positions):
+    # parse_pages together with how long it took, measured in the process
+    # which did the parsing
+    start = time.perf_counter()
+    processed_data = parse_pages(fp3_data, race_data, invalid_positions)
+    return processed_data, time.perf_counter() - start
 
 
 class AbstractScraper(ABC):
 
-    def __init__(self, path_to_links, output_path):
+    def __init__(self, path_to_links, output_path, cache=None,
+                 refresh=False):
         self.links = []
         with open(path_to_links, "r") as f:
             reader = csv.reader(f)
@@ -37,20 +99,15 @@ class AbstractScraper(ABC):
                 self.links.append(row[0])
 
         self.race_count = []
+        self.seasons = {}
         for link in self.links:
-            # The links contain the race number, which I am finding in this
-            # for loop. The reason why I am doing this and not simply
-            # creating a range is because the race numbers are not strictly
-            # consistent on the website for an unknown reason.
-            try:
-                race_number_pos = link.find("races/") + len("races/")
-                race_number_str = link[race_number_pos:race_number_pos + 4]
-                race_number = int(race_number_str)
-            except ValueError:
-                race_number_pos = link.find("races/") + len("races/")
-                race_number_str = link[race_number_pos:race_number_pos + 3]
-                race_number = int(race_number_str)
+            # The links contain the season and the race number. The reason
+            # why I am reading the race numbers and not simply creating a
+            # range is because the race numbers are not strictly consistent
+            # on the website for an unknown reason.
+            season, race_number = parse_link(link)
             self.race_count.append(race_number)
+            self.seasons[race_number] = season
 
         self.output_path = output_path
         self.extensions = ("practice-3.html", "race-result.html")
@@ -58,29 +115,102 @@ class AbstractScraper(ABC):
         # Positions which will not be considered:
         self.invalid_positions = {"NC", "DQ", "EX"}
 
+        # Pages are fetched through the response cache, so the results of
+        # past races are not downloaded again on every run
+        if cache is None:
+            cache = ResponseCache(f"{output_path}/http_cache")
+        self.cache = cache
+
+        # Processed races are collected here and written to the race store
+        # every FLUSH_EVERY races, together with the manifest
+        self.store_path = f"{output_path}/race_store.npy"
+        self.manifest = ScrapeManifest(f"{output_path}/scrape_manifest.json")
+        self.refresh = refresh
+        self.scraped = {}
+        # Race numbers which could not be scraped
+        self.failed = []
+        self.lock = threading.Lock()
+
     @abstractmethod
     def scrape():
         # To be implemented in the child classes
         pass
 
-    def _process_data(self, fp3_df, race_df):
-        # The function processes the data to only contain what that we require
-        fp3_df = fp3_df[["Driver", "Pos"]]
-        fp3_df = fp3_df[~fp3_df["Pos"].isin(self.invalid_positions)]
-        fp3_df["Pos"] = fp3_df["Pos"].astype(int)
-
-        race_df = race_df[["Driver", "Pos"]]
-        race_df = race_df[~race_df["Pos"].isin(self.invalid_positions)]
-        race_df["Pos"] = race_df["Pos"].astype(int)
-
-        fp3_race = fp3_df.merge(race_df, on="Driver")
-        fp3_race.columns = ["driver", "fp3_pos", "race_pos"]
+    def _pending(self):
+        # Returns the links and race numbers which have to be scraped: all
+        # of them if refresh is set, otherwise only the races which are not
+        # in the race store, failed last time or do not match the manifest
+        if self.refresh:
+            return list(zip(self.links, self.race_count))
+        checksums = {}
+        if os.path.exists(self.store_path):
+            checksums = store_checksums(load_store(self.store_path))
+        pending = set(self.manifest.pending(self.race_count, checksums))
+        self.manifest.save()
+        return [(link, race_number)
+                for link, race_number in zip(self.links, self.race_count)
+                if race_number in pending]
 
-        fp3_race = fp3_race[(fp3_race["fp3_pos"] <= 20) &
-                            (fp3_race["race_pos"] <= 20)]
-        # The reason why I am only considering the Top 20 positions is because
-        # there were only 20 racers in the 2019 season.
-        return fp3_race
+    def _process_data(self, fp3_df, race_df):
+        return process_data(fp3_df, race_df, self.invalid_positions)
+
+    def _parsed(self, race_number, result):
+        processed_data, seconds = result
+        instrumentation.record("parse", "parse_pages",
+                               race_no=int(race_number), seconds=seconds,
+                               rows=len(processed_data))
+        return processed_data
+
+    def _parse(self, race_number, fp3_data, race_data):
+        # Returns the parsed race, or None if the pages could not be parsed.
+        # Any error while parsing (e.g. a page in an unexpected layout) is a
+        # failure of that race only.
+        try:
+            return self._parsed(race_number, timed_parse_pages(
+                fp3_data, race_data, self.invalid_positions))
+        except Exception as error:
+            self._save_failure(race_number, error)
+            return None
+
+    def _save_data(self, race_number, processed_data):
+        with self.lock:
+            self.scraped[race_number] = processed_data
+            if len(self.scraped) >= FLUSH_EVERY:
+                self._flush()
+
+    def _save_failure(self, race_number, error):
+        with self.lock:
+            self.failed.append(race_number)
+            self.manifest.mark_failed(race_number, error)
+            self.manifest.save()
+
+    def _flush(self):
+        # The races are written to the race store before they are marked as
+        # done in the manifest, so a crash in between only means that they
+        # are scraped again (from the response cache)
+        if not self.scraped:
+            return
+        with instrumentation.timer("save_races", races=len(self.scraped)):
+            # New drivers get an ID in the driver table, which the race
+            # store refers to
+            drivers = update_driver_table(
+                [self.scraped[race_number]
+                 for race_number in sorted(self.scraped)],
+                f"{self.output_path}/drivers.csv")
+            store = update_store(self.scraped, self.seasons, drivers,
+                                 self.store_path)
+        for race_number in self.scraped:
+            self.manifest.mark_ok(race_number,
+                                  race_checksum(store.race(race_number)))
+        self.manifest.save()
+        self.scraped = {}
+
+    def _finish(self):
+        with self.lock:
+            self._flush()
+        self.cache.evict()
+        if self.failed:
+            print(f"Failed to scrape races: {sorted(self.failed)}")
 
 
 class StandardScraper(AbstractScraper):
@@ -92,22 +222,34 @@ class StandardScraper(AbstractScraper):
 
     def scrape(self):
         session = requests.Session()
-        for link, race_number in zip(self.links, self.race_count):
-            fp3_response = session.get(link + self.extensions[0])
-            race_response = session.get(link + self.extensions[1])
-
-            fp3_df = pd.read_html(fp3_response.content)[0]
-            race_df = pd.read_html(race_response.content)[0]
+        # The races scraped so far are saved even if scraping stops halfway
+        try:
+            for link, race_number in self._pending():
+                try:
+                    fp3_data = self.cache.get(session,
+                                              link + self.extensions[0])
+                    race_data = self.cache.get(session,
+                                               link + self.extensions[1])
+                except requests.RequestException as error:
+                    self._save_failure(race_number, error)
+                    continue
+                processed_data = self._parse(race_number, fp3_data,
+                                             race_data)
+                if processed_data is not None:
+                    self._save_data(race_number, processed_data)
+        finally:
+            self._finish()
+        print("Complete!")
 
-            processed_data = self._process_data(fp3_df, race_df)
-            folder_path = "2014-2018"
-            if race_number >= 1000:
-                # The 1000th race denoted the beginning of the 2019 season
-                folder_path = "2019"
-            save_path = f"{self.output_path}/{folder_path}/{race_number}.csv"
-            processed_data.to_csv(save_path, index=False)
 
-        print("Complete!")
+def is_transient(error):
+    # Whether a failed request might succeed when tried again: client errors
+    # (4xx) will not, but dropped connections, timeouts and server errors
+    # (5xx) may
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (aiohttp.ClientConnectionError,
+                              asyncio.TimeoutError))
 
 
 class AsyncScraper(AbstractScraper):
@@ -115,38 +257,80 @@ class AsyncScraper(AbstractScraper):
     """
         The AsycnScraper class provides the interface for asynchrous scraping.
         It uses asyncio and aiohttp to asynchrosly scrape the provided links.
+
+        At most max_concurrency races are downloaded at the same time, and
+        the FP3 and race pages of a race are downloaded together. Requests
+        failing to connect, timing out or answered with a server error (5xx)
+        are retried up to retries times, waiting a little longer (with some
+        randomness) after every attempt; other errors, such as a 404, are not
+        retried. The pages are parsed in a pool of processes, and the races
+        are saved in a thread, so neither holds up the downloads.
     """
 
-    def scrape(self):
-        asyncio.get_event_loop().run_until_complete(self._scrape())
+    def __init__(self, path_to_links, output_path, cache=None,
+                 max_concurrency=8, retries=3, backoff=0.5,
+                 parse_workers=None, refresh=False):
+        super().__init__(path_to_links, output_path, cache, refresh)
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.parse_workers = parse_workers
 
-    async def _scrape(self):
+    def scrape(self):
+        pending = self._pending()
+        # The races scraped so far are saved even if scraping stops halfway
+        try:
+            if pending:
+                with concurrent.futures.ProcessPoolExecutor(
+                        self.parse_workers) as executor:
+                    asyncio.run(self._scrape(executor, pending))
+        finally:
+            self._finish()
+
+    async def _scrape(self, executor, pending):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
         async with aiohttp.ClientSession() as session:
             tasks = []
-            for link, race_number in zip(self.links, self.race_count):
+            for link, race_number in pending:
                 # Queueing the tasks
-                task = asyncio.ensure_future(self._get_data(session, link,
-                                                            race_number))
-                tasks.append(task)
-            await asyncio.gather(*tasks)
-
-    async def _get_data(self, session, link, race_number):
-        async with session.get(link + self.extensions[0]) as response:
-            fp3_data = await response.read()
+                tasks.append(self._get_data(session, semaphore, executor,
+                                            link, race_number))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
 
-        async with session.get(link + self.extensions[1]) as response:
-            race_data = await response.read()
+        for (_, race_number), result in zip(pending, results):
+            if isinstance(result, Exception):
+                self._save_failure(race_number, result)
 
-        fp3_df = pd.read_html(fp3_data)[0]
-        race_df = pd.read_html(race_data)[0]
-
-        processed_data = self._process_data(fp3_df, race_df)
-        if race_number >= 1000:
-            folder_path = "2019"
-        else:
-            folder_path = "2014-2018"
-        save_path = f"{self.output_path}/{folder_path}/{race_number}.csv"
-        processed_data.to_csv(save_path, index=False)
+    async def _fetch(self, session, url):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.cache.get_async(session, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt == self.retries or not is_transient(error):
+                    raise
+                instrumentation.count("retries")
+                instrumentation.record("retry", "fetch", url=url,
+                                       attempt=attempt + 1)
+                # Exponential backoff with jitter, so that the retries of
+                # different races do not all hit the website at once
+                delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+                await asyncio.sleep(delay)
+
+    async def _get_data(self, session, semaphore, executor, link,
+                        race_number):
+        async with semaphore:
+            fp3_data, race_data = await asyncio.gather(
+                self._fetch(session, link + self.extensions[0]),
+                self._fetch(session, link + self.extensions[1]))
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            executor, timed_parse_pages, fp3_data, race_data,
+            self.invalid_positions)
+        # Saving may flush the races to the race store, which would stop
+        # every download if it ran on the event loop
+        await loop.run_in_executor(None, self._save_data, race_number,
+                                   self._parsed(race_number, result))
 
 
 class ThreadingScraper(AbstractScraper):
@@ -157,35 +341,38 @@ class ThreadingScraper(AbstractScraper):
         libraries.
     """
 
-    def __init__(self, path_to_links, output_path):
-        super().__init__(path_to_links, output_path)
+    def __init__(self, path_to_links, output_path, cache=None,
+                 max_workers=5, refresh=False):
+        super().__init__(path_to_links, output_path, cache, refresh)
         # Required variable to ensure thread-safety:
         self.thread_local = threading.local()
+        # scraper_benchmark.py can be used to find the most optimal amount
+        # of workers for this task.
+        self.max_workers = max_workers
 
     def scrape(self):
-        # The max_workers can be played around with to find the most optimal
-        # amount of workers for this task.
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            executor.map(self._get_data, self.links, self.race_count)
+        # The races scraped so far are saved even if scraping stops halfway
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers) as executor:
+                # list() makes sure that any unexpected exceptions raised in
+                # the threads are not silently ignored
+                list(executor.map(lambda item: self._get_data(*item),
+                                  self._pending()))
+        finally:
+            self._finish()
 
     def _get_data(self, link, race_number):
         session = self._get_thread_session()
-        with session.get(link + self.extensions[0]) as response:
-            fp3_response = response
-        with session.get(link + self.extensions[1]) as response:
-            race_response = response
-
-        fp3_df = pd.read_html(fp3_response.content)[0]
-        race_df = pd.read_html(race_response.content)[0]
-
-        processed_data = self._process_data(fp3_df, race_df)
-
-        if race_number >= 1000:
-            folder_path = "2019"
-        else:
-            folder_path = "2014-2018"
-        save_path = f"{self.output_path}/{folder_path}/{race_number}.csv"
-        processed_data.to_csv(save_path, index=False)
+        try:
+            fp3_data = self.cache.get(session, link + self.extensions[0])
+            race_data = self.cache.get(session, link + self.extensions[1])
+        except requests.RequestException as error:
+            self._save_failure(race_number, error)
+            return
+        processed_data = self._parse(race_number, fp3_data, race_data)
+        if processed_data is not None:
+            self._save_data(race_number, processed_data)
 
     def _get_thread_session(self):
         # Each thread has its own session to make sure that we do not hit any
@@ -196,6 +383,11 @@ class ThreadingScraper(AbstractScraper):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--refresh", action="store_true",
+                        help="scrape every race, even if it is up to date")
+    args = parser.parse_args()
     # Start the scrapers here:
-    scraper = AsyncScraper(INPUT_PATH, OUTPUT_PATH)
-    scraper.scrape()
+    with instrumentation.stage("scraping_race_data"):
+        scraper = AsyncScraper(INPUT_PATH, OUTPUT_PATH, refresh=args.refresh)
+        scraper.scrape()
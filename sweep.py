@@ -0,0 +1,187 @@
+"""
+    This script evaluates the normal model for many different settings at
+    once, instead of changing the constants in the scripts by hand. Every
+    configuration is a combination of:
+    - the position cutoff: only the rows where both the FP3 and the race
+      position are at most this position are used (20 in process_data);
+    - the scale of the normal distributions: cl_var (std² / n, which is
+      what normal_distribution_probability.py uses), the standard deviation
+      (std) or the standard error (sem, std / sqrt(n));
+    - the first training season (the training seasons always end in 2018).
+    Every configuration is evaluated with accuracy.py's metrics for every
+    tolerance (how many positions a prediction may be off by to count as
+    approximately right), since these come from the same counts.
+
+    The race store is copied into shared memory once, and the configurations
+    are spread across a pool of processes which all read from it. The
+    results are appended to sweep_results.csv as soon as each configuration
+    is done; at the end the table is ranked for every method, tolerance and
+    cutoff, by avg_diff (lowest first) unless --rank-by says otherwise, and
+    the best scale and first season of every cutoff are printed. The
+    configurations are only ranked against the others with the same cutoff:
+    a lower cutoff keeps fewer rows with fewer positions to choose from, so
+    every metric (avg_diff included) favours the smallest cutoff, and the
+    metrics of different cutoffs cannot be compared.
+
+        python sweep.py --cutoffs 10 15 20 --scales cl_var std sem
+
+    The invalid positions (NC, DQ, EX) cannot be part of the sweep, since
+    those rows are dropped before the races are saved in the race store.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import concurrent.futures
+import itertools
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import instrumentation
+from atomic_write import atomic_write
+from accuracy import evaluate
+from normal_distribution_probability import position_grid
+from position_summary import build_state, summarise
+from predictions import predictions_frame
+from race_store import TEST_SEASONS, TRAIN_SEASONS, RaceStore, load_store
+
+INPUT_PATH = "data/race_store.npy"
+OUTPUT_PATH = "results"
+RESULTS_PATH = f"{OUTPUT_PATH}/sweep_results.csv"
+CUTOFFS = list(range(10, 21))
+SCALES = ("cl_var", "std", "sem")
+FIRST_SEASONS = list(TRAIN_SEASONS)[:-1]
+TOLERANCES = list(range(0, 6))
+RANK_BY = "avg_diff"
+# The metrics the results can be ranked by, and whether higher is better
+RANK_METRICS = {"avg_diff": False, "prob_finish": True,
+                "prob_no_finish": True}
+
+# The race store of each worker process, in shared memory
+_races = None
+_memory = None
+
+
+def _attach(name, shape, dtype):
+    global _races, _memory
+    _memory = shared_memory.SharedMemory(name=name)
+    _races = RaceStore(np.ndarray(shape, dtype, buffer=_memory.buf))
+
+
+def configurations(cutoffs=CUTOFFS, scales=SCALES,
+                   first_seasons=FIRST_SEASONS):
+    return [{"cutoff": cutoff, "scale": scale, "first_season": first_season}
+            for cutoff, scale, first_season in itertools.product(
+                cutoffs, scales, first_seasons)]
+
+
+def scale_values(summary, scale):
+    std = summary["std_finish_position"].values
+    if scale == "std":
+        return std
+    if scale == "sem":
+        return std / np.sqrt(summary["race_amount"].values)
+    return summary["cl_var_finish_position"].values
+
+
+def evaluate_configuration(configuration, tolerances=TOLERANCES,
+                           races=None):
+    # The whole chain (position_summary -> normal_distribution_probability
+    # -> predictions -> accuracy) for one configuration, in memory
+    if races is None:
+        races = _races
+    cutoff = configuration["cutoff"]
+    train_seasons = [season for season in TRAIN_SEASONS
+                     if season >= configuration["first_season"]]
+    races = races.select(seasons=train_seasons + TEST_SEASONS)
+    kept = (races.fp3_pos <= cutoff) & (races.race_pos <= cutoff)
+    races = RaceStore(races.data[:, kept])
+    test_races = races.select(seasons=TEST_SEASONS)
+
+    summary = summarise(build_state(races, cutoff, train_seasons,
+                                    TEST_SEASONS))
+    _, probabilities = position_grid(summary["mean_finish_position"].values,
+                                     scale_values(summary,
+                                                  configuration["scale"]))
+    metrics = evaluate(predictions_frame(probabilities), test_races,
+                       tolerances)
+
+    averages = metrics.groupby(["method", "tolerance"], sort=False).mean(
+        numeric_only=True)[["avg_diff", "prob_finish", "prob_no_finish"]]
+    averages = averages.reset_index()
+    for i, (name, value) in enumerate(configuration.items()):
+        averages.insert(i, name, value)
+    return averages
+
+
+def sweep(configuration_list, tolerances=TOLERANCES, path=INPUT_PATH,
+          results_path=RESULTS_PATH, max_workers=None):
+    # Runs every configuration and appends its rows to results_path as soon
+    # as it is done. Returns all of the rows.
+    data = np.ascontiguousarray(load_store(path).data)
+    memory = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, data.dtype, buffer=memory.buf)[:] = data
+        if os.path.exists(results_path):
+            os.remove(results_path)
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers, initializer=_attach,
+                initargs=(memory.name, data.shape, data.dtype)) as executor:
+            futures = [executor.submit(evaluate_configuration, configuration,
+                                       tolerances)
+                       for configuration in configuration_list]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                result.to_csv(results_path, mode="a", index=False,
+                              header=not results)
+                results.append(result)
+    finally:
+        memory.close()
+        memory.unlink()
+    return pd.concat(results, ignore_index=True)
+
+
+def rank(results, rank_by=RANK_BY):
+    # The best configurations first, for every method, tolerance and cutoff
+    # (the cutoffs are not scored on the same rows, so they are not ranked
+    # against each other). Ties are ordered by the configuration, since the
+    # rows arrive in whatever order the processes finish.
+    results = results.sort_values(
+        ["method", "tolerance", "cutoff", rank_by, "scale", "first_season"],
+        ascending=[True, True, True, not RANK_METRICS[rank_by], True, True])
+    results.insert(0, "rank", results.groupby(
+        ["method", "tolerance", "cutoff"]).cumcount() + 1)
+    return results.reset_index(drop=True)
+
+
+def best(ranked):
+    # The best scale and first season of every method, tolerance and cutoff
+    return ranked[ranked["rank"] == 1].drop(columns="rank").reset_index(
+        drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cutoffs", type=int, nargs="+", default=CUTOFFS)
+    parser.add_argument("--scales", nargs="+", choices=SCALES,
+                        default=list(SCALES))
+    parser.add_argument("--first-seasons", type=int, nargs="+",
+                        default=FIRST_SEASONS)
+    parser.add_argument("--tolerances", type=int, nargs="+",
+                        default=TOLERANCES)
+    parser.add_argument("--rank-by", default=RANK_BY, choices=RANK_METRICS)
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    configuration_list = configurations(args.cutoffs, args.scales,
+                                        args.first_seasons)
+    with instrumentation.stage("sweep",
+                               configurations=len(configuration_list)):
+        results = sweep(configuration_list, args.tolerances,
+                        max_workers=args.max_workers)
+        ranked = rank(results, args.rank_by)
+        with atomic_write(RESULTS_PATH) as temp_path:
+            ranked.to_csv(temp_path, index=False)
+    print(best(ranked).to_string(index=False))
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts are imported as top-level modules, wherever pytest is run from
+sys.path.insert(0, REPOSITORY_PATH)
+
+from scraper_benchmark import StandInServer  # noqa: E402
+
+
+@pytest.fixture
+def server(tmp_path):
+    # Serves pages generated from the race store
+    with StandInServer(pages_path=str(tmp_path / "pages"),
+                       store_path=f"{REPOSITORY_PATH}/data/race_store.npy",
+                       drivers_path=f"{REPOSITORY_PATH}/data/drivers.csv"
+                       ) as server:
+        yield server
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from accuracy import APPROX_TOLERANCE, accuracy_files, evaluate
+from race_store import DTYPE, RaceStore
+
+
+def make_races(rows):
+    # rows holds the race number, FP3 position and race position of every
+    # finish
+    race_no, fp3_pos, race_pos = np.array(rows).T
+    return RaceStore(np.array([race_no, np.full(len(rows), 2019),
+                               np.zeros(len(rows)), fp3_pos, race_pos],
+                              dtype=DTYPE))
+
+
+def test_metrics_are_shares_of_the_test_races():
+    predictions = pd.DataFrame({"position": [1, 2, 3, 4, 5],
+                                "s(x)": [1, 2, 3, 4, 5]})
+    # FP3 positions 2 and 4 did not finish the second race
+    races = make_races([(1001, 1, 1), (1001, 2, 5), (1001, 3, 2),
+                        (1001, 4, 3), (1001, 5, 4),
+                        (1002, 1, 2), (1002, 3, 3), (1002, 5, 1)])
+    assert APPROX_TOLERANCE == 3
+    avg_diff, corr_prob, approx_prob = accuracy_files(
+        evaluate(predictions, races))
+
+    assert avg_diff["s(x)_diff"].tolist() == [0.5, 3, 0.5, 1, 2.5]
+    assert corr_prob["s(x)_prob_finish"].tolist() == [0.5, 0, 0.5, 0, 0]
+    # Out of the 2 races, and not the 21 races of 2019
+    assert corr_prob["s(x)_prob_no_finish"].tolist() == [0.5, 0, 0.5, 0, 0]
+    assert approx_prob["s(x)_prob_finish"].tolist() == [1, 1, 1, 1, 0.5]
+    assert approx_prob["s(x)_prob_no_finish"].tolist() == [
+        1, 0.5, 1, 0.5, 0.5]
@@ -0,0 +1,72 @@
+import os
+import requests
+from http_cache import ResponseCache
+
+PAGE = "/en/results.html/2014/races/898/australia/race-result.html"
+
+
+def make_cache(tmp_path, finished, max_bytes=2**20):
+    return ResponseCache(str(tmp_path / "cache"), max_bytes,
+                         season_finished=lambda season: finished)
+
+
+def test_pages_of_finished_seasons_are_local_hits(server, tmp_path):
+    cache = make_cache(tmp_path, finished=True)
+    with requests.Session() as session:
+        body = cache.get(session, server.url + PAGE)
+        assert cache.get(session, server.url + PAGE) == body
+    assert cache.stats == {"local": 1, "revalidated": 0, "downloaded": 1}
+    assert server.status_counts == {200: 1}
+
+
+def test_unchanged_pages_are_revalidated(server, tmp_path):
+    cache = make_cache(tmp_path, finished=False)
+    with requests.Session() as session:
+        body = cache.get(session, server.url + PAGE)
+        assert cache.get(session, server.url + PAGE) == body
+    assert cache.stats == {"local": 0, "revalidated": 1, "downloaded": 1}
+    assert server.status_counts == {200: 1, 304: 1}
+
+
+def test_changed_pages_replace_the_cached_page(server, tmp_path):
+    cache = make_cache(tmp_path, finished=False)
+    with requests.Session() as session:
+        old_body = cache.get(session, server.url + PAGE)
+        old_meta, _ = cache.lookup(server.url + PAGE)
+        new_body = old_body.replace(b"Results", b"Results (corrected)")
+        server.pages[(898, "race-result.html")] = new_body
+        assert cache.get(session, server.url + PAGE) == new_body
+    assert cache.stats == {"local": 0, "revalidated": 0, "downloaded": 2}
+    assert server.status_counts == {200: 2}
+    meta, body = cache.lookup(server.url + PAGE)
+    assert body == new_body
+    assert meta["etag"] != old_meta["etag"]
+
+
+def test_least_recently_used_pages_are_evicted(tmp_path):
+    cache = make_cache(tmp_path, finished=True)
+    urls = [f"https://www.formula1.com/{name}.html" for name in "abc"]
+    for i, url in enumerate(urls):
+        cache.store(url, b"x" * 100, {})
+        # The pages were last used in the order a, b, c
+        os.utime(f"{cache._entry_path(url)}.json", (i, i))
+    # Using a makes b the least recently used page
+    cache.touch(urls[0])
+    cache.max_bytes = 250
+    cache.evict()
+    assert cache.lookup(urls[0]) is not None
+    assert cache.lookup(urls[1]) is None
+    assert cache.lookup(urls[2]) is not None
+
+
+def test_the_size_is_limited_while_pages_are_stored(tmp_path):
+    cache = make_cache(tmp_path, finished=True, max_bytes=250)
+    urls = [f"https://www.formula1.com/{name}.html" for name in "abc"]
+    for i, url in enumerate(urls):
+        cache.store(url, b"x" * 100, {})
+        os.utime(f"{cache._entry_path(url)}.json", (i, i))
+    # Storing c went over max_bytes, so a was removed straight away
+    assert cache.lookup(urls[0]) is None
+    assert cache.lookup(urls[1]) is not None
+    assert cache.lookup(urls[2]) is not None
+    assert cache.size == 200
@@ -0,0 +1,42 @@
+import os
+import threading
+import time
+import numeric_results
+
+
+def test_stale_locks_are_broken(tmp_path, monkeypatch):
+    monkeypatch.setattr(numeric_results, "LOCK_TIMEOUT", 0.05)
+    path = str(tmp_path / "numeric_results.txt")
+    with open(f"{path}.lock", "w"):
+        pass
+    # Left over from a run an hour ago
+    os.utime(f"{path}.lock", (time.time() - 3600, time.time() - 3600))
+    with numeric_results._locked(path):
+        assert os.path.exists(f"{path}.lock")
+    assert not os.path.exists(f"{path}.lock")
+
+
+def test_held_locks_are_waited_for(tmp_path, monkeypatch):
+    monkeypatch.setattr(numeric_results, "LOCK_TIMEOUT", 0.1)
+    path = str(tmp_path / "numeric_results.txt")
+    ready = threading.Event()
+    released = threading.Event()
+
+    def hold_lock():
+        # Holds the lock for longer than LOCK_TIMEOUT, while keeping its
+        # modification time fresh
+        with open(f"{path}.lock", "w"):
+            pass
+        ready.set()
+        for _ in range(50):
+            os.utime(f"{path}.lock")
+            time.sleep(0.01)
+        released.set()
+        os.remove(f"{path}.lock")
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    ready.wait()
+    with numeric_results._locked(path):
+        assert released.is_set()
+    thread.join()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import REPOSITORY_PATH
+from pearson_correlation import race_correlations, rolling_correlations
+from race_store import load_store
+
+
+@pytest.fixture
+def races():
+    return load_store(f"{REPOSITORY_PATH}/data/race_store.npy").select(
+        seasons=[2018])
+
+
+@pytest.mark.parametrize("window", [0, -1, 22])
+def test_windows_outside_the_races_are_rejected(races, window):
+    assert len(races.races()) == 21
+    with pytest.raises(ValueError):
+        rolling_correlations(races, window)
+
+
+def test_windows_of_one_race_are_the_race_correlations(races):
+    rolling = rolling_correlations(races, 1)
+    expected = race_correlations(races)
+    assert np.array_equal(rolling["first_race_no"], expected["race_no"])
+    assert np.array_equal(rolling["pearson_corr"], expected["pearson_corr"])
+
+
+def test_season_and_rolling_tables_are_saved(tmp_path):
+    os.makedirs(tmp_path / "data")
+    os.makedirs(tmp_path / "results")
+    shutil.copy(f"{REPOSITORY_PATH}/data/race_store.npy", tmp_path / "data")
+    subprocess.run([sys.executable,
+                    f"{REPOSITORY_PATH}/pearson_correlation.py",
+                    "--per-season", "--window", "10"],
+                   cwd=tmp_path, check=True)
+
+    seasons = pd.read_csv(tmp_path / "results" / "pearson_season_table.csv")
+    assert seasons["season"].tolist() == list(range(2014, 2019))
+    rolling = pd.read_csv(tmp_path / "results" /
+                          "pearson_rolling_table.csv")
+    race_count = len(pd.read_csv(tmp_path / "results" /
+                                 "pearson_corr_table.csv"))
+    assert len(rolling) == race_count - 9
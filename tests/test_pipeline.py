@@ -0,0 +1,21 @@
+import os
+import pipeline
+from conftest import REPOSITORY_PATH
+
+
+def test_stages_depend_on_the_modules_they_import():
+    imports = pipeline.local_imports(f"{REPOSITORY_PATH}/accuracy.py")
+    names = {os.path.basename(path) for path in imports}
+    # predictions is imported by accuracy itself, the others indirectly
+    assert {"predictions.py", "race_store.py", "numeric_results.py",
+            "results_store.py", "instrumentation.py"} <= names
+    assert "accuracy.py" not in names
+    assert "pipeline.py" not in names
+
+
+def test_transition_model_depends_on_every_season():
+    stage, = [stage for stage in pipeline.STAGES
+              if stage.name == "transition_model"]
+    store_slice, = [item for item in stage.inputs
+                    if isinstance(item, pipeline.StoreSlice)]
+    assert store_slice.seasons is None
@@ -0,0 +1,40 @@
+import numpy as np
+from conftest import REPOSITORY_PATH
+from position_summary import PositionAccumulator, PositionState, build_state
+from race_store import GRID_SIZE, TRAIN_SEASONS, load_store
+
+
+def test_races_of_other_seasons_are_not_marked_as_added():
+    races = load_store(f"{REPOSITORY_PATH}/data/race_store.npy")
+    state = PositionState().ingest(races, train_seasons=[2014],
+                                   test_seasons=[2019])
+    assert set(races.select(seasons=[2015]).races()).isdisjoint(
+        state.race_numbers)
+
+    # With the usual seasons, the other races are added later on
+    state.ingest(races)
+    expected = build_state(races)
+    assert np.array_equal(state.race_numbers, races.races())
+    assert np.array_equal(state.train.count, expected.train.count)
+    assert np.array_equal(state.test.count, expected.test.count)
+
+
+def test_merged_seasons_match_one_pass_over_all_races():
+    races = load_store(f"{REPOSITORY_PATH}/data/race_store.npy").select(
+        seasons=TRAIN_SEASONS)
+    merged = PositionAccumulator()
+    for season in TRAIN_SEASONS:
+        season_races = races.select(seasons=[season])
+        merged.merge(PositionAccumulator().update(season_races.fp3_pos,
+                                                  season_races.race_pos))
+
+    # One pass over every race, position by position
+    for position in range(1, GRID_SIZE + 1):
+        finishes = races.race_pos[races.fp3_pos == position].astype(float)
+        assert merged.count[position - 1] == len(finishes)
+        # Sums of whole positions are exact
+        assert merged.total[position - 1] == finishes.sum()
+        # Merging only rounds M2 differently
+        assert np.isclose(merged.m2[position - 1],
+                          ((finishes - finishes.mean())**2).sum(),
+                          rtol=1e-12, atol=0)
@@ -0,0 +1,49 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+from conftest import REPOSITORY_PATH
+from prediction_service import PredictionService
+
+DRIVERS = [f"D{i:02d}" for i in range(20)]
+
+
+@pytest.fixture
+def service(tmp_path):
+    # A service reading copies of the model files, which the tests replace
+    for name in ("probabilities_positions.npz", "position_summary.csv"):
+        shutil.copy(f"{REPOSITORY_PATH}/results/{name}", tmp_path / name)
+    return PredictionService(
+        summary_path=str(tmp_path / "position_summary.csv"),
+        probabilities_path=str(tmp_path / "probabilities_positions.npz"))
+
+
+def touch(path, nanoseconds):
+    # Moves the modification time on, as a new version of the file would
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + nanoseconds))
+
+
+def test_keeps_the_model_when_the_probabilities_are_half_written(service):
+    expected = service.predict(DRIVERS)
+    state = service.state
+    with open(service.probabilities_path, "r+b") as f:
+        f.truncate(os.path.getsize(service.probabilities_path) // 2)
+    touch(service.probabilities_path, 10**9)
+    assert service.predict(DRIVERS) == expected
+    assert service.state is state
+
+
+def test_keeps_the_model_when_the_summary_is_half_written(service):
+    expected = service.predict(DRIVERS)
+    summary = pd.read_csv(service.summary_path, float_precision="round_trip")
+    summary.iloc[:10].to_csv(service.summary_path, index=False)
+    touch(service.summary_path, 10**9)
+    assert service.predict(DRIVERS) == expected
+
+    # Once the file is complete again, it is loaded
+    summary.to_csv(service.summary_path, index=False)
+    touch(service.summary_path, 2 * 10**9)
+    assert service.predict(DRIVERS) == expected
+    assert not service.state.is_stale()
+
@@ -0,0 +1,100 @@
+import itertools
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import predictions
+from conftest import REPOSITORY_PATH
+from position_summary import build_state, summarise
+from race_simulation import simulate
+from race_store import load_store
+from transition_model import TransitionCounts, transition_probabilities
+
+
+def baseline_fx(probabilities):
+    # How f(x) used to be worked out, one position at a time
+    available_positions = list(range(1, len(probabilities) + 1))
+    fx_predictions = []
+    for race_pos in range(1, probabilities.shape[1] + 1):
+        maximum_probability = 0
+        best_position = 0
+        for fp3_pos in available_positions:
+            probability = probabilities[fp3_pos - 1, race_pos - 1]
+            if probability > maximum_probability:
+                maximum_probability = probability
+                best_position = fp3_pos
+        available_positions.remove(best_position)
+        fx_predictions.append(best_position)
+    return fx_predictions
+
+
+def baseline_gx(probabilities):
+    gx_predictions = []
+    for row in probabilities.tolist():
+        gx_predictions.append(row.index(max(row)) + 1)
+    return gx_predictions
+
+
+def small_store():
+    races = load_store(f"{REPOSITORY_PATH}/data/race_store.npy")
+    return races.select(races=races.select(seasons=[2015]).races()[:3])
+
+
+def model_probabilities(model):
+    # The probabilities of a model built from three races, which have many
+    # ties between the FP3 positions
+    races = small_store()
+    if model == "empirical":
+        counts = TransitionCounts().ingest(races).weighted([2015])
+        return transition_probabilities(counts)
+    summary = summarise(build_state(races, train_seasons=[2015],
+                                    test_seasons=[]))
+    return simulate(summary["mean_finish_position"].values,
+                    summary["std_finish_position"].values, simulations=2000,
+                    chunk_size=500)
+
+
+@pytest.mark.parametrize("model", ["simulated", "empirical"])
+def test_model_predictions_match_the_baseline(model, tmp_path):
+    probabilities = model_probabilities(model)
+    results_path = tmp_path / "results"
+    results_path.mkdir()
+    np.savez(results_path / f"probabilities_{model}.npz",
+             probability=probabilities)
+    subprocess.run([sys.executable, f"{REPOSITORY_PATH}/predictions.py",
+                    "--model", model], cwd=tmp_path, check=True)
+
+    predictions_df = pd.read_csv(
+        results_path / "predictions" / f"predictions_{model}.csv")
+    assert not (results_path / "predictions" / "predictions.csv").exists()
+    assert predictions_df["s(x)"].tolist() == list(range(1, 21))
+    assert predictions_df["f(x)"].tolist() == baseline_fx(probabilities)
+    assert predictions_df["g(x)"].tolist() == baseline_gx(probabilities)
+    assert sorted(predictions_df["h(x)"]) == list(range(1, 21))
+
+
+def test_batches_match_every_matrix_on_its_own():
+    rng = np.random.default_rng(0)
+    # Rounded, so that there are ties (and none of them is zero)
+    batch = np.round(rng.dirichlet(np.ones(6), (4, 3, 6)), 1) + 0.05
+    batched = predictions.predict(batch)
+    for index in np.ndindex(batch.shape[:-2]):
+        matrix = batch[index]
+        assert batched["s(x)"][index].tolist() == list(range(1, 7))
+        assert batched["f(x)"][index].tolist() == baseline_fx(matrix)
+        assert batched["g(x)"][index].tolist() == baseline_gx(matrix)
+        assert np.array_equal(batched["h(x)"][index],
+                              predictions.hx_predictions(matrix))
+
+
+def test_hx_is_the_most_likely_assignment():
+    rng = np.random.default_rng(1)
+    for matrix in rng.dirichlet(np.ones(5), (20, 5)):
+        hx = predictions.hx_predictions(matrix)
+        # Every FP3 position gets a race position of its own
+        assert sorted(hx) == list(range(1, 6))
+        best = max(np.log(matrix[range(5), list(order)]).sum()
+                   for order in itertools.permutations(range(5)))
+        assert np.isclose(np.log(matrix[range(5), hx - 1]).sum(), best,
+                          rtol=1e-12, atol=0)
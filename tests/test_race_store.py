@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from race_store import COLUMNS, DTYPE, RaceStore, load_store, save_store
+
+
+def make_store(race_number):
+    data = np.array([[race_number], [2019], [0], [1], [1]], dtype=np.int64)
+    assert len(data) == len(COLUMNS)
+    return RaceStore(data)
+
+
+def test_small_values_are_saved_as_int16(tmp_path):
+    path = str(tmp_path / "race_store.npy")
+    save_store(make_store(1000), path)
+    assert load_store(path).data.dtype == DTYPE
+
+
+def test_large_race_numbers_are_not_wrapped_around(tmp_path):
+    path = str(tmp_path / "race_store.npy")
+    save_store(make_store(40000), path)
+    assert load_store(path).races().tolist() == [40000]
+
+
+def test_values_which_do_not_fit_are_rejected(tmp_path):
+    path = str(tmp_path / "race_store.npy")
+    with pytest.raises(OverflowError):
+        save_store(make_store(2**40), path)
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,61 @@
+import pytest
+import results_store
+
+
+def save_run(run_id, value, path, monkeypatch):
+    monkeypatch.setattr(results_store, "_run_id", run_id)
+    results_store.save_block("accuracy.py", [f"Avg. Difference: {value}"],
+                             {"avg_diff": value}, path)
+
+
+def test_runs_are_ordered_by_their_start(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.sqlite")
+    # Both runs started in the same second, and the random part of the
+    # later run sorts first
+    save_run("20191201-120000-ffffffff", 1.0, path, monkeypatch)
+    save_run("20191201-120000-00000000", 2.0, path, monkeypatch)
+
+    assert results_store.latest_blocks(
+        "20191201-120000-ffffffff", path) == {
+        "accuracy.py": ["Avg. Difference: 1.0"]}
+    assert results_store.latest_blocks(
+        "20191201-120000-00000000", path) == {
+        "accuracy.py": ["Avg. Difference: 2.0"]}
+    assert results_store.latest_blocks(path=path) == {
+        "accuracy.py": ["Avg. Difference: 2.0"]}
+
+
+def test_unknown_runs_are_rejected(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.sqlite")
+    save_run("20191201-120000-ffffffff", 1.0, path, monkeypatch)
+    with pytest.raises(ValueError):
+        results_store.latest_blocks("20191201-120000-00000000", path)
+
+
+def test_runs_are_recorded_when_they_start(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.sqlite")
+    monkeypatch.setattr(results_store, "_run_id", None)
+    monkeypatch.setenv(results_store.RUN_ID_VARIABLE, "")
+    run = results_store.start_run(path)
+    connection = results_store.connect(path)
+    try:
+        assert connection.execute("SELECT run_id FROM runs").fetchall() == [
+            (run,)]
+    finally:
+        connection.close()
+
+
+def test_reports_of_a_run_leave_out_the_later_runs(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.sqlite")
+    save_run("20191201-120000-00000000", 1.0, path, monkeypatch)
+    save_run("20191201-130000-00000000", 2.0, path, monkeypatch)
+    results_store.save_block("bootstrap.py", ["Avg. Difference: [1, 3]"],
+                             path=path)
+    results_store.write_report(path=path, output_path=str(tmp_path))
+    results_store.write_report("20191201-120000-00000000", path,
+                               str(tmp_path))
+
+    with open(tmp_path / "numeric_results.txt") as results_file:
+        report = results_file.read()
+    assert "Avg. Difference: 1.0" in report
+    assert "bootstrap.py" not in report
@@ -0,0 +1,79 @@
+import io
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from results_table import INVALID_POSITIONS, extract_race, extract_results
+from scraping_race_data import process_data
+
+PAGES_PATH = os.path.join(os.path.dirname(__file__), "pages")
+SESSIONS = ("practice-3.html", "race-result.html")
+
+
+def read_page(race, extension):
+    with open(os.path.join(PAGES_PATH, race, extension), "rb") as f:
+        return f.read()
+
+
+def read_html_race(fp3_page, race_page):
+    # How the races used to be scraped, with pd.read_html
+    return process_data(pd.read_html(io.BytesIO(fp3_page))[0],
+                        pd.read_html(io.BytesIO(race_page))[0],
+                        INVALID_POSITIONS).reset_index(drop=True)
+
+
+def render_table(rows):
+    # A results table in the layout of the website, where rows holds the
+    # position, the first name, the last name and the code of every driver
+    cells = "".join(
+        f"<tr><td class=\"limiter\"></td><td>{position}</td><td>1</td><td>"
+        f"\n<span>{first}</span>\n<span>{last}</span>\n<span>{code}</span>"
+        f"\n</td><td>Team</td><td class=\"limiter\"></td></tr>"
+        for position, first, last, code in rows)
+    return ("<html><head><meta charset=\"utf-8\"></head><body><table>"
+            "<thead><tr><th></th><th>Pos</th><th>No</th><th>Driver</th>"
+            "<th>Car</th><th></th></tr></thead>"
+            f"<tbody>{cells}</tbody></table></body></html>").encode()
+
+
+@pytest.mark.parametrize("race", sorted(os.listdir(PAGES_PATH)))
+def test_extract_race_matches_read_html(race):
+    fp3_page, race_page = (read_page(race, extension)
+                           for extension in SESSIONS)
+    pd.testing.assert_frame_equal(extract_race(fp3_page, race_page),
+                                  read_html_race(fp3_page, race_page),
+                                  check_dtype=False)
+
+
+def test_invalid_and_tied_positions():
+    fp3_page = render_table([
+        ("1", "Lewis", "Hamilton", "HAM"),
+        ("2", "Max", "Verstappen", "VER"),
+        ("2", "Jean-Eric", "Vergne", "VER"),
+        ("4", "Kimi", "Räikkönen", "RAI"),
+        ("5", "Romain", "Grosjean", "GRO"),
+        ("EX", "Nico", "Rosberg", "ROS")])
+    race_page = render_table([
+        ("1", "Jean-Eric", "Vergne", "VER"),
+        ("2", "Lewis", "Hamilton", "HAM"),
+        ("2", "Kimi", "Räikkönen", "RAI"),
+        ("NC", "Max", "Verstappen", "VER"),
+        ("DQ", "Romain", "Grosjean", "GRO"),
+        ("3", "Nico", "Rosberg", "ROS")])
+    extracted = extract_race(fp3_page, race_page)
+    assert extracted["driver"].tolist() == ["Lewis Hamilton HAM",
+                                            "Jean-Eric Vergne VER",
+                                            "Kimi Räikkönen RAI"]
+    pd.testing.assert_frame_equal(extracted,
+                                  read_html_race(fp3_page, race_page),
+                                  check_dtype=False)
+
+
+def test_short_rows_are_skipped():
+    page = render_table([("1", "Lewis", "Hamilton", "HAM")]).replace(
+        b"</tbody>", b"<tr><td colspan=\"6\"></td></tr><tr></tr>"
+                     b"<tr><td class=\"limiter\"></td><td>2</td></tr>"
+                     b"</tbody>")
+    drivers, positions = extract_results(page)
+    assert drivers == ["Lewis Hamilton HAM"]
+    assert np.array_equal(positions, [1])
@@ -0,0 +1,136 @@
+import asyncio
+import aiohttp
+import numpy as np
+import pytest
+import scraping_race_data
+from conftest import REPOSITORY_PATH
+from http_cache import ResponseCache
+from race_store import load_store
+from scraper_benchmark import write_links
+
+SCRAPERS = [scraping_race_data.StandardScraper,
+            scraping_race_data.ThreadingScraper]
+
+
+def make_scraper(scraper_class, server, tmp_path):
+    links_path = str(tmp_path / "links.csv")
+    write_links(links_path, server.url,
+                f"{REPOSITORY_PATH}/data/links.csv")
+    cache = ResponseCache(str(tmp_path / "http_cache"),
+                          season_finished=lambda season: False)
+    return scraper_class(links_path, str(tmp_path), cache)
+
+
+@pytest.mark.parametrize("scraper_class", SCRAPERS)
+def test_parse_errors_fail_only_their_race(scraper_class, server, tmp_path,
+                                           monkeypatch):
+    parse_pages = scraping_race_data.timed_parse_pages
+
+    def timed_parse_pages(fp3_data, race_data, invalid_positions):
+        if race_data == b"broken":
+            raise RuntimeError("Unexpected layout")
+        return parse_pages(fp3_data, race_data, invalid_positions)
+
+    monkeypatch.setattr(scraping_race_data, "timed_parse_pages",
+                        timed_parse_pages)
+    server.pages[(899, "race-result.html")] = b"broken"
+    scraper = make_scraper(scraper_class, server, tmp_path)
+    scraper.scrape()
+
+    assert scraper.failed == [899]
+    races = load_store(str(tmp_path / "race_store.npy"))
+    expected = [race for race in server.store.races() if race != 899]
+    assert np.array_equal(races.races(), expected)
+
+
+@pytest.mark.parametrize("scraper_class", SCRAPERS)
+def test_scraped_races_are_saved_when_scraping_stops(scraper_class, server,
+                                                     tmp_path):
+    scraper = make_scraper(scraper_class, server, tmp_path)
+    get = scraper.cache.get
+
+    def get_until_interrupted(session, url):
+        if "/races/905/" in url:
+            raise KeyboardInterrupt
+        return get(session, url)
+
+    scraper.cache.get = get_until_interrupted
+    with pytest.raises(KeyboardInterrupt):
+        scraper.scrape()
+
+    races = load_store(str(tmp_path / "race_store.npy")).races()
+    assert set(range(898, 905)) <= set(races.tolist())
+    assert 905 not in races
+
+
+@pytest.mark.parametrize("error_rate, race_number, status, attempts", [
+    # Race 1 is not in the store, so the server does not find its page
+    (0.0, 1, 404, 1),
+    (1.0, 898, 503, 3)])
+def test_only_transient_errors_are_retried(server, tmp_path, error_rate,
+                                           race_number, status, attempts):
+    server.error_rate = error_rate
+    scraper = make_scraper(scraping_race_data.AsyncScraper, server, tmp_path)
+    scraper.retries = 2
+    scraper.backoff = 0
+    get_async = scraper.cache.get_async
+    urls = []
+
+    async def counted_get_async(session, url):
+        urls.append(url)
+        return await get_async(session, url)
+
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            return await scraper._fetch(
+                session, f"{server.url}/en/results.html/2014/races/"
+                         f"{race_number}/australia/race-result.html")
+
+    scraper.cache.get_async = counted_get_async
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        asyncio.run(fetch())
+    assert error.value.status == status
+    assert len(urls) == attempts
+
+
+def test_async_downloads_are_limited_and_saved_off_the_loop(
+        server, tmp_path, monkeypatch):
+    monkeypatch.setattr(scraping_race_data, "FLUSH_EVERY", 4)
+    server.latency = 0.05
+    scraper = make_scraper(scraping_race_data.AsyncScraper, server, tmp_path)
+    scraper.max_concurrency = 3
+    scraper.links = scraper.links[:12]
+    scraper.race_count = scraper.race_count[:12]
+    get_async = scraper.cache.get_async
+    in_flight = [0]
+    peak = [0]
+
+    async def tracked_get_async(session, url):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        try:
+            return await get_async(session, url)
+        finally:
+            in_flight[0] -= 1
+
+    flush = scraper._flush
+    flushed_on_loop = []
+
+    def tracked_flush():
+        try:
+            asyncio.get_running_loop()
+            flushed_on_loop.append(True)
+        except RuntimeError:
+            flushed_on_loop.append(False)
+        flush()
+
+    scraper.cache.get_async = tracked_get_async
+    scraper._flush = tracked_flush
+    scraper.scrape()
+
+    # Both pages of max_concurrency races at once, and never more
+    assert peak[0] == 2 * scraper.max_concurrency
+    assert len(flushed_on_loop) > 1
+    assert not any(flushed_on_loop)
+    races = load_store(str(tmp_path / "race_store.npy")).races()
+    assert races.tolist() == scraper.race_count
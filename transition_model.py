@@ -0,0 +1,170 @@
+"""
+    This script builds an alternative to the normal model: the probability of
+    an FP3 position finishing in a race position is taken directly from how
+    often it happened in the data. The FP3 position x race position counts
+    of every season are accumulated with a single np.bincount over the race
+    store, and the probabilities are calculated from the counts of the
+    training seasons.
+
+    The counts can be smoothed in two ways:
+    - Laplace smoothing adds the same pseudo-count to every cell, so no
+      finishing position has a probability of zero;
+    - kernel smoothing spreads every count over the neighbouring FP3 and
+      race positions with a Gaussian kernel.
+    Recent seasons can also be given more weight: with --decay 0.8, every
+    season counts 0.8 times as much as the season after it.
+
+    The counts are saved in transition_counts.npz together with the race
+    numbers they include, so new races can be added without counting the
+    previous ones again:
+
+        python transition_model.py                  (rebuilds from the store)
+        python transition_model.py --ingest 1021 --laplace 0.5 --decay 0.8
+
+    The probabilities are saved in probabilities_empirical.npz, in the same
+    layout as probabilities_positions.npz, so they can be used with
+    python predictions.py --model empirical.
+
+    If you have any suggestions on how I can improve this code, feel free to
+    open an issue on GitHub. I would love to hear your insight!
+"""
+import argparse
+import os
+import numpy as np
+import instrumentation
+from atomic_write import atomic_write
+from race_store import GRID_SIZE, TRAIN_SEASONS, load_store
+
+INPUT_PATH = "data/race_store.npy"
+OUTPUT_PATH = "results"
+COUNTS_PATH = f"{OUTPUT_PATH}/transition_counts.npz"
+LAPLACE = 1.0
+BANDWIDTH = 0.0
+DECAY = 1.0
+
+
+class TransitionCounts:
+
+    """
+        The TransitionCounts class keeps counts[season, fp3_pos - 1,
+        race_pos - 1] for every season in the data, and the race numbers
+        which have already been counted.
+    """
+
+    def __init__(self, grid_size=GRID_SIZE):
+        self.seasons = np.empty(0, dtype=np.int64)
+        self.counts = np.zeros((0, grid_size, grid_size), dtype=np.int64)
+        self.race_numbers = np.empty(0, dtype=np.int64)
+
+    @property
+    def grid_size(self):
+        return self.counts.shape[-1]
+
+    def ingest(self, races):
+        # Adds the races of a race store that have not been added yet, with
+        # one np.bincount over all of their rows
+        new_rows = ~np.isin(races.race_no, self.race_numbers)
+        fp3_pos = np.asarray(races.fp3_pos[new_rows], dtype=np.int64)
+        race_pos = np.asarray(races.race_pos[new_rows], dtype=np.int64)
+        row_seasons = np.asarray(races.season[new_rows], dtype=np.int64)
+        on_grid = (fp3_pos <= self.grid_size) & (race_pos <= self.grid_size)
+
+        seasons = np.union1d(self.seasons, row_seasons)
+        counts = np.zeros((len(seasons),) + self.counts.shape[1:],
+                          dtype=np.int64)
+        counts[np.searchsorted(seasons, self.seasons)] = self.counts
+        cells = ((np.searchsorted(seasons, row_seasons[on_grid]) *
+                  self.grid_size + fp3_pos[on_grid] - 1) * self.grid_size +
+                 race_pos[on_grid] - 1)
+        counts += np.bincount(cells, minlength=counts.size).reshape(
+            counts.shape)
+
+        self.seasons = seasons
+        self.counts = counts
+        self.race_numbers = np.union1d(self.race_numbers,
+                                       races.race_no[new_rows])
+        return self
+
+    def weighted(self, seasons=TRAIN_SEASONS, decay=DECAY):
+        # The counts of the given seasons added together, where every season
+        # is weighted decay times as much as the season after it
+        selected = np.isin(self.seasons, list(seasons))
+        weights = decay ** (self.seasons[selected].max(initial=0) -
+                            self.seasons[selected])
+        return np.tensordot(weights, self.counts[selected], axes=1)
+
+    def save(self, path=COUNTS_PATH):
+        with atomic_write(path) as temp_path:
+            np.savez(temp_path, seasons=self.seasons, counts=self.counts,
+                     race_numbers=self.race_numbers)
+
+    @classmethod
+    def load(cls, path=COUNTS_PATH):
+        with np.load(path) as arrays:
+            transition_counts = cls(arrays["counts"].shape[-1])
+            transition_counts.seasons = arrays["seasons"]
+            transition_counts.counts = arrays["counts"]
+            transition_counts.race_numbers = arrays["race_numbers"]
+        return transition_counts
+
+
+def gaussian_kernel(size, bandwidth):
+    # kernel[i, j] is the share of a count at position j which is moved to
+    # position i; every column adds up to 1
+    positions = np.arange(size)
+    kernel = np.exp(-0.5 * ((positions[:, np.newaxis] - positions) /
+                            bandwidth)**2)
+    return kernel / kernel.sum(axis=0)
+
+
+def transition_probabilities(counts, laplace=LAPLACE, bandwidth=BANDWIDTH):
+    # Turns the counts into probabilities[fp3_pos - 1, race_pos - 1], where
+    # every row adds up to 1
+    counts = np.asarray(counts, dtype=np.float64)
+    if bandwidth > 0:
+        fp3_kernel = gaussian_kernel(counts.shape[0], bandwidth)
+        race_kernel = gaussian_kernel(counts.shape[1], bandwidth)
+        counts = fp3_kernel @ counts @ race_kernel.T
+    counts = counts + laplace
+    totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(totals > 0, counts / totals, 1.0 / counts.shape[1])
+
+
+def save_probabilities(probabilities):
+    positions = np.arange(1, len(probabilities) + 1, dtype=np.float64)
+    with atomic_write(f"{OUTPUT_PATH}/probabilities_empirical.npz"
+                      ) as temp_path:
+        np.savez(temp_path, fp3_positions=positions,
+                 race_positions=positions, probability=probabilities)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ingest", type=int, nargs="+", metavar="RACE_NO",
+                        help="add these races to the saved counts instead "
+                             "of rebuilding them")
+    parser.add_argument("--laplace", type=float, default=LAPLACE,
+                        help="pseudo-count added to every cell")
+    parser.add_argument("--bandwidth", type=float, default=BANDWIDTH,
+                        help="bandwidth of the Gaussian kernel in positions "
+                             "(0 for no kernel smoothing)")
+    parser.add_argument("--decay", type=float, default=DECAY,
+                        help="weight of every season relative to the next")
+    parser.add_argument("--seasons", type=int, nargs="+",
+                        default=list(TRAIN_SEASONS))
+    args = parser.parse_args()
+
+    with instrumentation.stage("transition_model") as stage:
+        races = load_store(INPUT_PATH)
+        stage["rows"] = len(races)
+        if args.ingest and os.path.exists(COUNTS_PATH):
+            transition_counts = TransitionCounts.load().ingest(
+                races.select(races=args.ingest))
+        else:
+            transition_counts = TransitionCounts().ingest(races)
+        transition_counts.save()
+
+        counts = transition_counts.weighted(args.seasons, args.decay)
+        save_probabilities(transition_probabilities(counts, args.laplace,
+                                                    args.bandwidth))